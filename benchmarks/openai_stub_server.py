@@ -0,0 +1,145 @@
+import json
+import time
+import random
+import hashlib
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+
+import numpy as np
+
+
+class _OpenAIStubHandler(BaseHTTPRequestHandler):
+    # Mantendo as conexões abertas entre as requisições, como a API da OpenAI
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        self.server.contar('connections')
+
+    def do_POST(self):
+        corpo = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        self.server.contar('requests')
+
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        # Simulando o limite de taxa da API
+        if self.server.rejeitar() or random.random() < self.server.error_rate:
+            self.server.contar('rate_limited')
+            self._responder(429, {'error': {'message': 'Rate limit reached', 'type': 'rate_limit_exceeded'}},
+                            {'retry-after-ms': str(int(self.server.retry_after * 1000))})
+            return
+
+        if self.path.endswith('/chat/completions'):
+            self._chat(corpo)
+        elif self.path.endswith('/embeddings'):
+            self._embeddings(corpo)
+        else:
+            self._responder(404, {'error': {'message': f'Rota {self.path} não encontrada'}})
+
+    def _chat(self, corpo: dict) -> None:
+        resposta = 'Thought: I can answer without using any more tools.\nAnswer: resposta do servidor de testes.'
+        identificador = f'chatcmpl-{hashlib.md5(json.dumps(corpo).encode()).hexdigest()[:12]}'
+        modelo = corpo.get('model', 'gpt-3.5-turbo')
+
+        if not corpo.get('stream'):
+            self._responder(200, {'id': identificador, 'object': 'chat.completion', 'created': int(time.time()),
+                                  'model': modelo,
+                                  'choices': [{'index': 0, 'finish_reason': 'stop',
+                                               'message': {'role': 'assistant', 'content': resposta}}],
+                                  'usage': {'prompt_tokens': 10, 'completion_tokens': 10, 'total_tokens': 20}})
+            return
+
+        eventos = []
+        for i, trecho in enumerate([resposta[i:i + 16] for i in range(0, len(resposta), 16)] + [None]):
+            delta = {} if trecho is None else ({'role': 'assistant', 'content': trecho} if i == 0 else
+                                                {'content': trecho})
+            eventos.append({'id': identificador, 'object': 'chat.completion.chunk', 'created': int(time.time()),
+                            'model': modelo, 'choices': [{'index': 0, 'delta': delta,
+                                                          'finish_reason': 'stop' if trecho is None else None}]})
+        texto = ''.join(f'data: {json.dumps(evento)}\n\n' for evento in eventos) + 'data: [DONE]\n\n'
+        self._enviar(200, texto.encode('utf-8'), 'text/event-stream')
+
+    def _embeddings(self, corpo: dict) -> None:
+        entrada = corpo.get('input')
+        textos = [entrada] if isinstance(entrada, str) else list(entrada or [])
+
+        dados = []
+        for i, texto in enumerate(textos):
+            semente = int.from_bytes(hashlib.md5(str(texto).encode()).digest()[:4], 'little')
+            vetor = np.random.default_rng(semente).standard_normal(self.server.embed_dim)
+            dados.append({'object': 'embedding', 'index': i, 'embedding': (vetor / np.linalg.norm(vetor)).tolist()})
+
+        self._responder(200, {'object': 'list', 'data': dados, 'model': corpo.get('model'),
+                              'usage': {'prompt_tokens': len(textos), 'total_tokens': len(textos)}})
+
+    def _responder(self, status: int, corpo: dict, headers: Optional[Dict[str, str]] = None) -> None:
+        self._enviar(status, json.dumps(corpo).encode('utf-8'), 'application/json', headers)
+
+    def _enviar(self, status: int, corpo: bytes, tipo: str, headers: Optional[Dict[str, str]] = None) -> None:
+        self.send_response(status)
+        self.send_header('Content-Type', tipo)
+        self.send_header('Content-Length', str(len(corpo)))
+        for nome, valor in (headers or {}).items():
+            self.send_header(nome, valor)
+        self.end_headers()
+        self.wfile.write(corpo)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class OpenAIStubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port: int = 0, latency: float = 0.0, error_rate: float = 0.0, retry_after: float = 0.05,
+                 embed_dim: int = 256, reject_first: int = 0):
+        """
+        Servidor HTTP local que imita as rotas de chat e de embeddings da API da OpenAI, para testar o cliente
+        compartilhado (pool de conexões, limitador e repetições) sem chamadas à API.
+        :param port: a porta do servidor (0 para uma porta livre qualquer)
+        :param latency: o tempo simulado, em segundos, de cada requisição
+        :param error_rate: a fração das requisições recusadas com o status 429 (limite de taxa)
+        :param retry_after: o tempo, em segundos, indicado em Retry-After nas requisições recusadas
+        :param embed_dim: a dimensão dos embeddings gerados
+        :param reject_first: o número de requisições iniciais recusadas com o status 429, para testes determinísticos
+        """
+        super().__init__(('127.0.0.1', port), _OpenAIStubHandler)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.embed_dim = embed_dim
+        self.reject_first = reject_first
+        self.counters: Dict[str, int] = {'requests': 0, 'rate_limited': 0, 'connections': 0}
+        self._lock = threading.Lock()
+
+    @property
+    def base_url(self) -> str:
+        """
+        :return: o endereço da API simulada, a ser informado em configure_openai_client
+        """
+        return f'http://127.0.0.1:{self.server_address[1]}/v1'
+
+    def contar(self, chave: str) -> None:
+        with self._lock:
+            self.counters[chave] += 1
+
+    def rejeitar(self) -> bool:
+        with self._lock:
+            if self.reject_first <= 0:
+                return False
+            self.reject_first -= 1
+            return True
+
+    def start(self) -> "OpenAIStubServer":
+        """
+        Inicia o servidor em uma thread em segundo plano.
+        :return: o próprio servidor
+        """
+        threading.Thread(target=self.serve_forever, name='openai-stub', daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
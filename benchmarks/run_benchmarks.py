@@ -0,0 +1,513 @@
+from benchmarks.stubs import StubEmbedding, StubLLM, write_corpus
+from llama_index.core import Settings
+from types import SimpleNamespace
+from typing import Dict, List, Optional
+import numpy as np
+import subprocess
+import threading
+import platform
+import argparse
+import tempfile
+import shutil
+import json
+import time
+import os
+
+# Raiz do repositório, de onde vêm os recursos (o PDF) indexados nos benchmarks
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _estatisticas(amostras: List[float]) -> Dict[str, float]:
+    """
+    Resume as latências medidas.
+    :param amostras: as latências, em segundos
+    :return: a média e os percentis 50, 95 e 99, em milissegundos, e o número de amostras
+    """
+    ms = np.array(amostras) * 1000
+
+    return {'n': len(ms), 'ms_media': float(ms.mean()), 'ms_p50': float(np.percentile(ms, 50)),
+            'ms_p95': float(np.percentile(ms, 95)), 'ms_p99': float(np.percentile(ms, 99))}
+
+
+def bench_indexing(n_docs: int) -> Dict[str, Dict[str, float]]:
+    """
+    Mede a vazão das funções index_* em um corpus sintético (e, para index_pdf, no PDF do repositório): a indexação
+    completa e a reindexação sem alterações, que deve apenas conferir os hashes do manifesto.
+    :param n_docs: o número de documentos do corpus sintético
+    :return: o resultado de cada função
+    """
+    from data_indexing.indexing_tools import index_pdf, index_img, index_exercicios, index_video
+
+    resultados = {}
+    for funcao in (index_pdf, index_img, index_exercicios, index_video):
+        nome = funcao.__name__
+        docs, persist = f'data/{nome}', f'results/{nome}'
+        if funcao is not index_pdf:
+            write_corpus(docs, n_docs, seed=1)
+
+        try:
+            inicio = time.perf_counter()
+            resumo = funcao(docs, persist)
+            duracao = time.perf_counter() - inicio
+
+            inicio = time.perf_counter()
+            funcao(docs, persist)
+            reindexacao = time.perf_counter() - inicio
+        except (ImportError, FileNotFoundError, ValueError) as e:
+            print(f'{nome}: ignorado ({e})')
+            continue
+
+        resultados[nome] = {'chunks': resumo['chunks_embedados'], 'segundos': duracao,
+                            'chunks_por_segundo': resumo['chunks_embedados'] / duracao if duracao else 0.0,
+                            'segundos_reindexacao_sem_alteracoes': reindexacao}
+        print(f"{nome}: {resumo['chunks_embedados']} chunks em {duracao:.2f}s, reindexação em {reindexacao:.3f}s")
+
+    return resultados
+
+
+def bench_retrieval(sizes: List[int], n_queries: int, vector_store: str) -> List[Dict[str, float]]:
+    """
+    Mede a latência de retrieve_nodes para corpus sintéticos de tamanhos crescentes.
+    :param sizes: os números de documentos de cada corpus
+    :param n_queries: o número de queries medidas em cada corpus
+    :param vector_store: o tipo de vector store dos índices
+    :return: o resultado de cada tamanho de corpus
+    """
+    from data_indexing.indexing_tools import index_directory, get_index, get_retriever, retrieve_nodes
+
+    resultados = []
+    for n_docs in sizes:
+        docs, persist = f'data/corpus_{n_docs}', f'results/corpus_{n_docs}'
+        frases = write_corpus(docs, n_docs, seed=2)
+        resumo = index_directory(docs, persist, chunk_size=256, vector_store=vector_store)
+
+        inicio = time.perf_counter()
+        retriever = get_retriever(get_index(persist))
+        carga = time.perf_counter() - inicio
+
+        latencias = []
+        for i in range(n_queries):
+            inicio = time.perf_counter()
+            retrieve_nodes(retriever, frases[i % len(frases)])
+            latencias.append(time.perf_counter() - inicio)
+
+        resultado = {'documentos': n_docs, 'chunks': resumo['chunks_embedados'], 'segundos_carga': carga,
+                     **_estatisticas(latencias)}
+        resultados.append(resultado)
+        print(f"retrieve_nodes com {resultado['chunks']} chunks: p50 {resultado['ms_p50']:.2f}ms, "
+              f"p95 {resultado['ms_p95']:.2f}ms (carga em {carga:.2f}s)")
+
+    return resultados
+
+
+def bench_broker(n_messages: int) -> Dict[str, float]:
+    """
+    Mede a latência de ida e volta pelo message broker: o usuário publica uma mensagem e um agente, que apenas
+    responde com send_message, a devolve.
+    :param n_messages: o número de mensagens medidas
+    :return: as estatísticas da latência
+    """
+    from chat.broker import MessageBroker, bind_broker, unbind_broker
+    from llm_tools.tools import send_message
+
+    broker = MessageBroker(idle_timeout=10)
+
+    def agente():
+        token = bind_broker(broker)
+        try:
+            mensagem = broker.receive('user', timeout=10)
+            while mensagem is not None and not mensagem.startswith('fim'):
+                mensagem = send_message(f'eco: {mensagem.splitlines()[0]}')
+        finally:
+            unbind_broker(token)
+
+    thread = threading.Thread(target=agente, daemon=True)
+    thread.start()
+
+    latencias = []
+    for i in range(n_messages):
+        offset = broker.offset('assistant')
+        inicio = time.perf_counter()
+        broker.publish('user', f'mensagem {i}')
+        broker.wait_for_message('assistant', offset, timeout=10)
+        latencias.append(time.perf_counter() - inicio)
+
+    broker.publish('user', 'fim')
+    thread.join(timeout=10)
+    resultado = _estatisticas(latencias)
+    print(f"ida e volta pelo broker (send_message): p50 {resultado['ms_p50']:.3f}ms, p95 {resultado['ms_p95']:.3f}ms")
+
+    return resultado
+
+
+def bench_turns(n_sessions: int, turns: int, first_token_latency: float, token_latency: float,
+                prefetch: bool = False) -> Dict[str, float]:
+    """
+    Mede a latência de ponta a ponta de cada turno da conversa, a partir de talk_to_agent: a mensagem passa pelo
+    gerenciador de sessões e pelo broker e é respondida por um agente ReAct com as ferramentas reais (get_content
+    consulta o índice de texto) e um LLM determinístico. Várias sessões conversam ao mesmo tempo.
+    :param n_sessions: o número de sessões simultâneas
+    :param turns: o número de turnos de cada sessão
+    :param first_token_latency: o tempo simulado até o primeiro trecho gerado pelo LLM, em segundos
+    :param token_latency: o tempo simulado entre trechos gerados pelo LLM, em segundos
+    :param prefetch: se True, a busca de conteúdo é antecipada ao chegar cada mensagem
+    :return: as estatísticas da latência até a primeira atualização exibida e até a resposta completa
+    """
+    import main
+    from chat.sessions import SessionManager
+    from llm.educational_agent import EduAgent
+    from data_indexing.indexing_tools import index_directory
+    from llm_tools.tools import configure_prefetch, get_prefetch_stats
+
+    frases = write_corpus('data/turnos', 50, seed=3)
+    index_directory('data/turnos', 'results/pdf', chunk_size=256)
+
+    configure_prefetch(prefetch)
+    llm = StubLLM(first_token_latency=first_token_latency, token_latency=token_latency)
+    main.session_manager = SessionManager(lambda: EduAgent(llm=llm, verbose=False).create_agent(),
+                                          max_workers=n_sessions, idle_timeout=1)
+    main._pronto.set()
+
+    primeiras, completas = [], []
+    lock = threading.Lock()
+
+    def conversar(sessao: int):
+        request = SimpleNamespace(session_hash=f'benchmark_{sessao}')
+        for turno in range(turns + 1):
+            mensagem = frases[(sessao * turns + turno) % len(frases)] if turno < turns else 'tchau'
+            inicio = time.perf_counter()
+            primeira = None
+            for _ in main.talk_to_agent(mensagem, [], request):
+                if primeira is None:
+                    primeira = time.perf_counter() - inicio
+            with lock:
+                primeiras.append(primeira)
+                completas.append(time.perf_counter() - inicio)
+
+    threads = [threading.Thread(target=conversar, args=(i,)) for i in range(n_sessions)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    main.session_manager.shutdown()
+
+    resultado = {'sessoes': n_sessions, 'primeira_atualizacao': _estatisticas(primeiras),
+                 'resposta_completa': _estatisticas(completas)}
+    print(f"turno de ponta a ponta: primeira atualização p50 {resultado['primeira_atualizacao']['ms_p50']:.1f}ms, "
+          f"resposta completa p50 {resultado['resposta_completa']['ms_p50']:.1f}ms, "
+          f"p95 {resultado['resposta_completa']['ms_p95']:.1f}ms")
+
+    if prefetch:
+        resultado['antecipacao'] = get_prefetch_stats()
+        print(f"antecipação: {resultado['antecipacao']['aproveitadas']} de {resultado['antecipacao']['iniciadas']} "
+              f"buscas aproveitadas (taxa {resultado['antecipacao']['taxa_aproveitamento']:.0%})")
+
+    return resultado
+
+
+def bench_openai_client(n_requests: int, concurrency: int, rpm: Optional[float], error_rate: float) -> Dict[str, float]:
+    """
+    Mede o cliente da OpenAI compartilhado pelo processo contra um servidor local que imita a API: várias threads
+    enviam requisições de chat e de embedding ao mesmo tempo, parte delas recusadas com o status 429. As requisições
+    devem reaproveitar as conexões do pool, respeitar o limite de requisições por minuto e ser repetidas até o sucesso.
+    :param n_requests: o número de requisições enviadas
+    :param concurrency: o número de threads que enviam as requisições
+    :param rpm: o limite de requisições por minuto do cliente (None para não limitar)
+    :param error_rate: a fração das requisições recusadas pelo servidor com o status 429
+    :return: as estatísticas da latência das requisições, o número de conexões abertas e as métricas do cliente
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from benchmarks.openai_stub_server import OpenAIStubServer
+    from llm.openai_client import configure_openai_client, get_client_metrics, get_openai_client
+
+    # O servidor local não verifica a chave da API, mas o SDK exige uma
+    os.environ.setdefault('OPENAI_API_KEY', 'sk-servidor-local')
+    servidor = OpenAIStubServer(error_rate=error_rate, retry_after=0.02).start()
+    configure_openai_client(rpm=rpm, base_url=servidor.base_url, max_connections=concurrency, backoff_base=0.02)
+    client = get_openai_client()
+
+    def requisitar(i: int) -> float:
+        inicio = time.perf_counter()
+        if i % 2:
+            client.embeddings.create(model='text-embedding-ada-002', input=[f'texto {i}'])
+        else:
+            client.chat.completions.create(model='gpt-3.5-turbo', messages=[{'role': 'user', 'content': f'oi {i}'}])
+        return time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            latencias = list(executor.map(requisitar, range(n_requests)))
+    finally:
+        servidor.stop()
+    duracao = time.perf_counter() - inicio
+
+    metricas = get_client_metrics()
+    resultado = {'requisicoes': _estatisticas(latencias), 'segundos': duracao,
+                 'requisicoes_por_minuto': n_requests / duracao * 60, 'conexoes': servidor.counters['connections'],
+                 'recusadas_pelo_servidor': servidor.counters['rate_limited'], 'repeticoes': metricas['retries'],
+                 'falhas': metricas['failures'], 'espera_no_limitador': metricas['queue_delay']}
+    print(f"cliente da OpenAI: {n_requests} requisições em {duracao:.2f}s "
+          f"({resultado['requisicoes_por_minuto']:.0f}/min) por {resultado['conexoes']} conexões, "
+          f"{resultado['repeticoes']} repetições, {resultado['falhas']} falhas, "
+          f"espera no limitador p95 {metricas['queue_delay']['p95'] * 1000:.1f}ms")
+
+    return resultado
+
+
+def bench_token_bucket(tpm: float, request_tokens: int, n_requests: int) -> Dict[str, float]:
+    """
+    Verifica a vazão sustentada do limitador de tokens por minuto quando cada requisição é maior que a capacidade do
+    balde (as liberadas em um segundo): as reservas são feitas todas de uma vez e a vazão é calculada entre o envio da
+    primeira e o da última requisição, e deve se manter no limite configurado.
+    :param tpm: o limite de tokens por minuto
+    :param request_tokens: o número de tokens de cada requisição
+    :param n_requests: o número de requisições reservadas
+    :return: a vazão sustentada, em tokens por minuto, e a sua razão com o limite
+    """
+    from llm.openai_client import TokenBucket
+
+    balde = TokenBucket(tpm)
+    esperas = [balde.reserve(request_tokens) for _ in range(n_requests)]
+
+    # Cada requisição é enviada ao fim da sua espera
+    vazao = (n_requests - 1) * request_tokens / (esperas[-1] - esperas[0]) * 60
+    resultado = {'tokens_por_minuto': vazao, 'razao_com_o_limite': vazao / tpm, 'espera_maxima_segundos': esperas[-1]}
+    print(f"limitador de tokens: {n_requests} requisições de {request_tokens} tokens liberadas a {vazao:.0f} tokens/min "
+          f"(limite {tpm:.0f}, razão {resultado['razao_com_o_limite']:.2f})")
+
+    return resultado
+
+
+def _commit() -> Optional[str]:
+    """
+    :return: o commit atual do repositório, ou None caso não seja possível obtê-lo
+    """
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=RAIZ, check=True, capture_output=True,
+                              text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _metricas(resultado, prefixo: str = '') -> Dict[str, float]:
+    """
+    Achata o resultado dos benchmarks em um dicionário de métricas numéricas.
+    :param resultado: o resultado (ou parte dele)
+    :param prefixo: o caminho da parte do resultado
+    :return: as métricas, indexadas pelo caminho
+    """
+    if isinstance(resultado, dict):
+        itens = resultado.items()
+    elif isinstance(resultado, list):
+        itens = enumerate(resultado)
+    else:
+        return {prefixo: resultado} if isinstance(resultado, (int, float)) else {}
+
+    metricas = {}
+    for chave, valor in itens:
+        metricas.update(_metricas(valor, f'{prefixo}.{chave}' if prefixo else str(chave)))
+
+    return metricas
+
+
+def compare(baseline: dict, current: dict) -> None:
+    """
+    Exibe a variação das métricas de tempo entre dois resultados dos benchmarks.
+    :param baseline: o resultado de referência
+    :param current: o resultado atual
+    :return: None
+    """
+    antes, depois = _metricas(baseline['resultados']), _metricas(current['resultados'])
+    print(f"Comparação com {baseline['meta'].get('commit')}:")
+    for nome in sorted(set(antes) & set(depois)):
+        if ('ms_' in nome or 'segundos' in nome) and antes[nome]:
+            print(f"  {nome}: {antes[nome]:.3f} -> {depois[nome]:.3f} ({depois[nome] / antes[nome]:.2f}x)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks offline, com LLM e embeddings determinísticos")
+    parser.add_argument(
+        "--only",
+        nargs="+",
+        choices=("indexing", "retrieval", "broker", "turns", "openai"),
+        default=("indexing", "retrieval", "broker", "turns"),
+        help="Os benchmarks executados",
+    )
+
+    parser.add_argument(
+        "--sizes",
+        nargs="+",
+        type=int,
+        default=[10, 100, 1000],
+        help="Os números de documentos dos corpus sintéticos da medição de retrieve_nodes",
+    )
+
+    parser.add_argument(
+        "--queries",
+        required=False,
+        type=int,
+        default=200,
+        help="O número de queries medidas em cada corpus",
+    )
+
+    parser.add_argument(
+        "--index-docs",
+        required=False,
+        type=int,
+        default=100,
+        help="O número de documentos do corpus sintético da medição das funções index_*",
+    )
+
+    parser.add_argument(
+        "--vector-store",
+        required=False,
+        type=str,
+        default="numpy",
+        help="O tipo de vector store dos índices",
+    )
+
+    parser.add_argument(
+        "--messages",
+        required=False,
+        type=int,
+        default=1000,
+        help="O número de mensagens da medição do broker",
+    )
+
+    parser.add_argument(
+        "--sessions",
+        required=False,
+        type=int,
+        default=4,
+        help="O número de sessões simultâneas da medição de turnos",
+    )
+
+    parser.add_argument(
+        "--turns",
+        required=False,
+        type=int,
+        default=5,
+        help="O número de turnos de cada sessão",
+    )
+
+    parser.add_argument(
+        "--llm-first-token",
+        required=False,
+        type=float,
+        default=0.0,
+        help="O tempo simulado, em segundos, até o primeiro trecho gerado pelo LLM",
+    )
+
+    parser.add_argument(
+        "--llm-token",
+        required=False,
+        type=float,
+        default=0.0,
+        help="O tempo simulado, em segundos, entre os trechos gerados pelo LLM",
+    )
+
+    parser.add_argument(
+        "--embedding-latency",
+        required=False,
+        type=float,
+        default=0.0,
+        help="O tempo simulado, em segundos, de cada chamada ao modelo de embedding",
+    )
+
+    parser.add_argument(
+        "--prefetch",
+        action="store_true",
+        help="Antecipa a busca de conteúdo na medição de turnos",
+    )
+
+    parser.add_argument(
+        "--openai-requests",
+        required=False,
+        type=int,
+        default=200,
+        help="O número de requisições da medição do cliente da OpenAI, enviadas a um servidor local que imita a API",
+    )
+
+    parser.add_argument(
+        "--openai-rpm",
+        required=False,
+        type=float,
+        default=None,
+        help="O limite de requisições por minuto do cliente da OpenAI na medição do cliente",
+    )
+
+    parser.add_argument(
+        "--openai-error-rate",
+        required=False,
+        type=float,
+        default=0.1,
+        help="A fração das requisições recusadas com o status 429 pelo servidor local na medição do cliente",
+    )
+
+    parser.add_argument(
+        "--output",
+        required=False,
+        type=str,
+        default=None,
+        help="O arquivo JSON onde os resultados serão salvos (por padrão, results/benchmarks/<commit>.json)",
+    )
+
+    parser.add_argument(
+        "--baseline",
+        required=False,
+        type=str,
+        default=None,
+        help="Um arquivo JSON de resultados anterior, com o qual os resultados atuais serão comparados",
+    )
+
+    args = parser.parse_args()
+
+    # Substituindo o modelo de embedding e o LLM por versões determinísticas, sem chamadas à API
+    Settings.embed_model = StubEmbedding(embed_dim=256, latency=args.embedding_latency)
+    Settings.llm = StubLLM(first_token_latency=args.llm_first_token, token_latency=args.llm_token)
+
+    # Executando os benchmarks em um diretório temporário, com os dados e índices sintéticos nos caminhos padrão
+    commit = _commit()
+    output = os.path.abspath(args.output or os.path.join(RAIZ, 'results', 'benchmarks', f'{commit or "local"}.json'))
+    diretorio = tempfile.mkdtemp(prefix='benchmarks_')
+    os.symlink(os.path.join(RAIZ, 'resources'), os.path.join(diretorio, 'resources'))
+    origem = os.getcwd()
+    os.chdir(diretorio)
+
+    resultados = {}
+    try:
+        if 'indexing' in args.only:
+            resultados['indexing'] = bench_indexing(args.index_docs)
+        if 'retrieval' in args.only:
+            resultados['retrieval'] = bench_retrieval(args.sizes, args.queries, args.vector_store)
+        if 'broker' in args.only:
+            resultados['broker'] = bench_broker(args.messages)
+        if 'turns' in args.only:
+            resultados['turns'] = bench_turns(args.sessions, args.turns, args.llm_first_token, args.llm_token,
+                                             args.prefetch)
+        if 'openai' in args.only:
+            resultados['openai'] = bench_openai_client(args.openai_requests, args.sessions, args.openai_rpm,
+                                                       args.openai_error_rate)
+            resultados['openai']['limitador_de_tokens'] = bench_token_bucket(90000, 6000, 50)
+    finally:
+        os.chdir(origem)
+        shutil.rmtree(diretorio, ignore_errors=True)
+
+    relatorio = {'meta': {'commit': commit, 'data': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                          'python': platform.python_version(), 'plataforma': platform.platform(),
+                          'cpus': os.cpu_count(), 'argumentos': vars(args)},
+                 'resultados': resultados}
+
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as arquivo:
+        json.dump(relatorio, arquivo, indent=2, ensure_ascii=False)
+    print(f'Resultados salvos em {output}')
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as arquivo:
+            compare(json.load(arquivo), relatorio)
+
+
+if __name__ == "__main__":
+    main()
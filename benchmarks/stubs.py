@@ -0,0 +1,224 @@
+import os
+import re
+import json
+import time
+import asyncio
+import random
+import hashlib
+from functools import lru_cache
+from typing import Any, List, Sequence
+
+import numpy as np
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.base.llms.types import (
+    ChatMessage,
+    ChatResponse,
+    ChatResponseAsyncGen,
+    ChatResponseGen,
+    CompletionResponse,
+    CompletionResponseGen,
+    LLMMetadata,
+    MessageRole,
+)
+from llama_index.core.llms.callbacks import llm_chat_callback, llm_completion_callback
+from llama_index.core.llms.custom import CustomLLM
+
+from chat.broker import get_broker
+from chat.streaming import ReActStreamParser
+
+# Vocabulário do corpus sintético, com os assuntos tratados pelo agente de ensino
+_VOCABULARIO = """
+html tag elemento atributo pagina documento estrutura cabecalho rodape corpo titulo paragrafo texto negrito italico
+link ancora href destino lista ordenada item tabela linha coluna celula cabecalho borda imagem src alt legenda
+formulario campo botao semantica section article nav aside main header footer navegador codigo exemplo valor
+""".split()
+
+_TERMOS = re.compile(r'\w+')
+
+
+@lru_cache(maxsize=65536)
+def _vetor_do_termo(termo: str, dim: int) -> np.ndarray:
+    """
+    Vetor aleatório fixo de um termo, gerado a partir do seu hash.
+    :param termo: o termo
+    :param dim: a dimensão do vetor
+    :return: o vetor
+    """
+    semente = int(hashlib.md5(termo.encode('utf-8')).hexdigest()[:8], 16)
+
+    return np.random.default_rng(semente).standard_normal(dim, dtype=np.float32)
+
+
+class StubEmbedding(BaseEmbedding):
+    """
+    Modelo de embedding determinístico, sem chamadas à API, para os benchmarks. Cada termo do texto é mapeado, pelo
+    seu hash, para um vetor aleatório fixo, e o embedding é a soma dos vetores dos termos: textos com termos em comum
+    têm embeddings similares, como em um modelo real. Opcionalmente, cada chamada espera um tempo fixo, simulando a
+    latência da API.
+    """
+
+    embed_dim: int = 256
+    latency: float = 0.0
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "StubEmbedding"
+
+    def _vetor(self, texto: str) -> List[float]:
+        vetor = np.zeros(self.embed_dim, dtype=np.float32)
+        for termo in _TERMOS.findall(texto.lower()):
+            vetor += _vetor_do_termo(termo, self.embed_dim)
+
+        return vetor.tolist()
+
+    def _esperar(self) -> None:
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        self._esperar()
+        return self._vetor(query)
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        self._esperar()
+        return self._vetor(text)
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        self._esperar()
+        return [self._vetor(texto) for texto in texts]
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return self._get_query_embedding(query)
+
+
+class StubLLM(CustomLLM):
+    """
+    LLM determinístico, sem chamadas à API, que segue o roteiro de um turno do agente de ensino no formato ReAct: a
+    cada mensagem do usuário, busca conteúdo com get_content e responde com send_message; quando o usuário se despede
+    (mensagem iniciada por "tchau"), encerra a conversa com Answer. A resposta é gerada em trechos, com um tempo
+    opcional até o primeiro trecho e entre trechos, e o texto destinado ao usuário é publicado como rascunho no
+    message broker da sessão, como no StreamingOpenAI.
+    """
+
+    first_token_latency: float = 0.0
+    token_latency: float = 0.0
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "StubLLM"
+
+    @property
+    def metadata(self) -> LLMMetadata:
+        return LLMMetadata(is_chat_model=True, model_name='stub')
+
+    def _roteiro(self, messages: Sequence[ChatMessage]) -> str:
+        """
+        Gera a próxima etapa do roteiro a partir das últimas mensagens.
+        :param messages: as mensagens enviadas ao LLM
+        :return: o texto gerado, no formato ReAct
+        """
+        ultima = messages[-1].content or ''
+        anterior = (messages[-2].content or '') if len(messages) > 1 else ''
+
+        # Respondendo diretamente, no caminho rápido, com o conteúdo enviado junto à mensagem
+        if ultima.startswith('Conteúdo de apoio:'):
+            conteudo = ultima[len('Conteúdo de apoio:'):].split('\n\nMensagem do usuário:')[0].strip()[:300]
+            return f"Thought: o usuário é iniciante.\nAnswer: Segundo o material: {conteudo}"
+
+        # Respondendo ao usuário com o conteúdo obtido
+        if ultima.startswith('Observation:') and 'Action: get_content' in anterior:
+            conteudo = ultima[len('Observation:'):].strip()[:300]
+            return ("Thought: tenho o conteúdo necessário para responder ao usuário.\nAction: send_message\n"
+                    f"Action Input: {json.dumps({'message': 'Segundo o material: ' + conteudo}, ensure_ascii=False)}")
+
+        # Nova mensagem do usuário, vinda diretamente ou como observação de send_message
+        mensagem = ultima[len('Observation:'):].strip() if ultima.startswith('Observation:') else ultima.strip()
+        mensagem = mensagem.split('\n(Aviso 1')[0].split(')\n')[-1].split('\n')[0]
+        if mensagem.lower().startswith('tchau') or 'ficou inativo' in mensagem:
+            return "Thought: o usuário se despediu, então, posso finalizar a conversa.\nAnswer: Até logo!"
+
+        return ("Thought: o usuário é iniciante e prefere texto; preciso buscar conteúdo.\nAction: get_content\n"
+                f"Action Input: {json.dumps({'user_msg': mensagem, 'content_format': 'texto'}, ensure_ascii=False)}")
+
+    def _trechos(self, texto: str) -> List[str]:
+        """
+        Divide o texto gerado em trechos de uma palavra, como os tokens de um streaming.
+        :param texto: o texto gerado
+        :return: os trechos
+        """
+        return re.findall(r'\S+\s*|\s+', texto)
+
+    @llm_chat_callback()
+    def chat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponse:
+        time.sleep(self.first_token_latency + self.token_latency * len(self._trechos(self._roteiro(messages))))
+
+        return ChatResponse(message=ChatMessage(role=MessageRole.ASSISTANT, content=self._roteiro(messages)))
+
+    @llm_chat_callback()
+    def stream_chat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponseGen:
+        texto = self._roteiro(messages)
+        broker = get_broker()
+        broker.clear_draft('assistant')
+        parser = ReActStreamParser(lambda trecho: broker.append_draft('assistant', trecho))
+
+        def gen() -> ChatResponseGen:
+            time.sleep(self.first_token_latency)
+            gerado = ''
+            for trecho in self._trechos(texto):
+                if self.token_latency:
+                    time.sleep(self.token_latency)
+                gerado += trecho
+                parser.feed(trecho)
+                yield ChatResponse(message=ChatMessage(role=MessageRole.ASSISTANT, content=gerado), delta=trecho)
+
+        return gen()
+
+    @llm_chat_callback()
+    async def astream_chat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponseAsyncGen:
+        texto = self._roteiro(messages)
+        broker = get_broker()
+        broker.clear_draft('assistant')
+        parser = ReActStreamParser(lambda trecho: broker.append_draft('assistant', trecho))
+
+        async def gen() -> ChatResponseAsyncGen:
+            await asyncio.sleep(self.first_token_latency)
+            gerado = ''
+            for trecho in self._trechos(texto):
+                if self.token_latency:
+                    await asyncio.sleep(self.token_latency)
+                gerado += trecho
+                parser.feed(trecho)
+                yield ChatResponse(message=ChatMessage(role=MessageRole.ASSISTANT, content=gerado), delta=trecho)
+
+        return gen()
+
+    @llm_completion_callback()
+    def complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+        return CompletionResponse(text=prompt[-200:])
+
+    @llm_completion_callback()
+    def stream_complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponseGen:
+        yield CompletionResponse(text=prompt[-200:], delta=prompt[-200:])
+
+
+def write_corpus(path: str, n_docs: int, paragraphs: int = 8, seed: int = 0) -> List[str]:
+    """
+    Escreve um corpus sintético de arquivos txt sobre HTML, determinístico para a mesma semente.
+    :param path: o diretório onde os arquivos serão escritos
+    :param n_docs: o número de arquivos
+    :param paragraphs: o número de parágrafos de cada arquivo
+    :param seed: a semente do gerador aleatório
+    :return: uma frase de cada documento, para ser utilizada como query
+    """
+    os.makedirs(path, exist_ok=True)
+    gerador = random.Random(seed)
+    frases = []
+
+    for i in range(n_docs):
+        paragrafos = [' '.join(gerador.choice(_VOCABULARIO) for _ in range(gerador.randint(40, 80))) + '.'
+                      for _ in range(paragraphs)]
+        with open(os.path.join(path, f'documento_{i:05d}.txt'), 'w', encoding='utf-8') as arquivo:
+            arquivo.write('\n\n'.join(paragrafos))
+        frases.append(' '.join(paragrafos[0].split()[:12]))
+
+    return frases
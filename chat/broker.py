@@ -0,0 +1,333 @@
+import asyncio
+import threading
+from contextvars import ContextVar, Token
+from typing import Callable, Dict, List, Optional, Tuple
+from chat.conversation_log import ConversationLog
+
+# Papéis que podem enviar mensagens pelo message broker
+PAPEIS = ('user', 'assistant')
+
+
+class MessageBroker:
+    def __init__(self, log_path: Optional[str] = None, idle_timeout: Optional[float] = None):
+        """
+        Classe que intermedeia a troca de mensagens entre o usuário e o agente. As mensagens ficam em memória e quem
+        aguarda uma mensagem é acordado assim que ela é publicada, sem precisar consultar arquivos periodicamente.
+        Opcionalmente, as mensagens também são salvas em um log somente de acréscimo, para que o histórico seja mantido
+        em disco.
+        :param log_path: caminho do log JSONL que armazenará as mensagens (None para não salvar em disco)
+        :param idle_timeout: tempo máximo, em segundos, que o agente aguarda uma resposta do usuário (None para esperar
+        indefinidamente)
+        """
+        self.idle_timeout = idle_timeout
+        self._condition = threading.Condition()
+        self._mensagens: Dict[str, List[str]] = {papel: [] for papel in PAPEIS}
+        self._log = ConversationLog(log_path) if log_path is not None else None
+
+        # Carregando o histórico já existente em disco, apenas uma vez, na criação do broker
+        if self._log is not None:
+            historico, _ = self._log.read_from(0)
+            for papel, mensagem in historico:
+                self._mensagens[papel].append(mensagem)
+
+        # Cursores de leitura de cada papel: as mensagens já existentes não são entregues novamente
+        self._cursores = {papel: len(self._mensagens[papel]) for papel in PAPEIS}
+
+        # Rascunhos das mensagens que ainda estão sendo geradas, para que sejam exibidas em streaming. A versão do
+        # rascunho é incrementada a cada alteração.
+        self._rascunhos: Dict[str, List[str]] = {papel: [] for papel in PAPEIS}
+        self._versoes_rascunho = {papel: 0 for papel in PAPEIS}
+
+        # Corrotinas aguardando uma alteração, cada uma com o seu event loop e o future que a acorda. Assim, as esperas
+        # assíncronas não ocupam uma thread.
+        self._esperas_assincronas: List[Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = []
+
+    def _notificar(self) -> None:
+        """
+        Acorda quem estiver aguardando uma alteração, tanto as threads quanto as corrotinas. Deve ser chamada com o lock
+        adquirido.
+        :return: None
+        """
+        self._condition.notify_all()
+
+        for loop, futuro in self._esperas_assincronas:
+            try:
+                loop.call_soon_threadsafe(_acordar, futuro)
+            except RuntimeError:
+                pass  # o event loop da espera já foi encerrado
+        self._esperas_assincronas = []
+
+    async def _aguardar(self, predicado: Callable[[], bool], timeout: Optional[float] = None) -> bool:
+        """
+        Aguarda, sem bloquear o event loop, até que o predicado seja verdadeiro.
+        :param predicado: função avaliada com o lock adquirido a cada alteração
+        :param timeout: tempo máximo de espera, em segundos (None para esperar indefinidamente)
+        :return: o valor final do predicado
+        """
+        loop = asyncio.get_running_loop()
+        prazo = None if timeout is None else loop.time() + timeout
+
+        while True:
+            with self._condition:
+                if predicado():
+                    return True
+
+                restante = None if prazo is None else prazo - loop.time()
+                if restante is not None and restante <= 0:
+                    return False
+
+                futuro = loop.create_future()
+                self._esperas_assincronas.append((loop, futuro))
+
+            try:
+                await asyncio.wait({futuro}, timeout=restante)
+            finally:
+                with self._condition:
+                    if (loop, futuro) in self._esperas_assincronas:
+                        self._esperas_assincronas.remove((loop, futuro))
+
+    def publish(self, role: str, message: str) -> int:
+        """
+        Publica uma mensagem e acorda imediatamente quem estiver aguardando mensagens desse papel.
+        :param role: papel de quem envia a mensagem ('user' ou 'assistant')
+        :param message: a mensagem a ser publicada
+        :return: a posição (offset) da mensagem no histórico do papel
+        """
+        with self._condition:
+            # Salvando a mensagem no log antes de entregá-la, para que nenhuma mensagem entregue seja perdida
+            if self._log is not None:
+                self._log.append(role, message)
+
+            self._mensagens[role].append(message)
+            offset = len(self._mensagens[role]) - 1
+
+            # A mensagem completa substitui o rascunho que estava sendo exibido
+            self._rascunhos[role] = []
+            self._versoes_rascunho[role] += 1
+            self._notificar()
+
+        return offset
+
+    def offset(self, role: str) -> int:
+        """
+        Retorna o número de mensagens já publicadas pelo papel, ou seja, a posição da próxima mensagem.
+        :param role: papel cujas mensagens serão contadas
+        :return: a posição da próxima mensagem do papel
+        """
+        with self._condition:
+            return len(self._mensagens[role])
+
+    def position(self, role: str) -> Tuple[int, int]:
+        """
+        Retorna, de forma consistente, a posição da próxima mensagem do papel e a versão atual do seu rascunho, a partir
+        das quais uma resposta pode ser acompanhada com wait_for_update sem receber o rascunho de uma mensagem anterior.
+        :param role: papel cuja posição será retornada
+        :return: a posição da próxima mensagem do papel e a versão atual do rascunho
+        """
+        with self._condition:
+            return len(self._mensagens[role]), self._versoes_rascunho[role]
+
+    def wait_for_message(self, role: str, offset: int, timeout: Optional[float] = None) -> Optional[str]:
+        """
+        Aguarda, sem polling, até que exista uma mensagem do papel na posição offset.
+        :param role: papel cuja mensagem será aguardada
+        :param offset: posição da mensagem aguardada
+        :param timeout: tempo máximo de espera, em segundos (None para esperar indefinidamente)
+        :return: a mensagem na posição offset, ou None caso o tempo de espera tenha se esgotado
+        """
+        with self._condition:
+            chegou = self._condition.wait_for(lambda: len(self._mensagens[role]) > offset, timeout=timeout)
+            if not chegou:
+                return None
+
+            return self._mensagens[role][offset]
+
+    def append_draft(self, role: str, delta: str) -> None:
+        """
+        Acrescenta um trecho ao rascunho da mensagem que está sendo gerada pelo papel, acordando quem estiver
+        acompanhando a geração.
+        :param role: papel que está gerando a mensagem
+        :param delta: o novo trecho da mensagem
+        :return: None
+        """
+        with self._condition:
+            self._rascunhos[role].append(delta)
+            self._versoes_rascunho[role] += 1
+            self._notificar()
+
+    def clear_draft(self, role: str) -> None:
+        """
+        Descarta o rascunho da mensagem que estava sendo gerada pelo papel.
+        :param role: papel cujo rascunho será descartado
+        :return: None
+        """
+        with self._condition:
+            if self._rascunhos[role]:
+                self._rascunhos[role] = []
+                self._versoes_rascunho[role] += 1
+                self._notificar()
+
+    def wait_for_update(self, role: str, offset: int, draft_version: int,
+                        timeout: Optional[float] = None) -> Tuple[Optional[str], str, int]:
+        """
+        Aguarda até que exista uma mensagem do papel na posição offset ou até que o rascunho da mensagem em geração
+        seja alterado.
+        :param role: papel cuja mensagem será aguardada
+        :param offset: posição da mensagem aguardada
+        :param draft_version: última versão do rascunho já recebida
+        :param timeout: tempo máximo de espera, em segundos (None para esperar indefinidamente)
+        :return: a mensagem na posição offset (ou None, caso ainda não exista), o texto atual do rascunho e sua versão
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: len(self._mensagens[role]) > offset
+                                     or self._versoes_rascunho[role] != draft_version, timeout=timeout)
+
+            mensagem = self._mensagens[role][offset] if len(self._mensagens[role]) > offset else None
+
+            return mensagem, ''.join(self._rascunhos[role]), self._versoes_rascunho[role]
+
+    async def await_for_update(self, role: str, offset: int, draft_version: int,
+                               timeout: Optional[float] = None) -> Tuple[Optional[str], str, int]:
+        """
+        Versão assíncrona de wait_for_update, que aguarda sem ocupar uma thread.
+        :param role: papel cuja mensagem será aguardada
+        :param offset: posição da mensagem aguardada
+        :param draft_version: última versão do rascunho já recebida
+        :param timeout: tempo máximo de espera, em segundos (None para esperar indefinidamente)
+        :return: a mensagem na posição offset (ou None, caso ainda não exista), o texto atual do rascunho e sua versão
+        """
+        await self._aguardar(lambda: len(self._mensagens[role]) > offset
+                             or self._versoes_rascunho[role] != draft_version, timeout=timeout)
+
+        with self._condition:
+            mensagem = self._mensagens[role][offset] if len(self._mensagens[role]) > offset else None
+
+            return mensagem, ''.join(self._rascunhos[role]), self._versoes_rascunho[role]
+
+    def receive(self, role: str, timeout: Optional[float] = None) -> Optional[str]:
+        """
+        Consome a próxima mensagem ainda não lida do papel, aguardando sua chegada caso necessário. Cada mensagem é
+        entregue uma única vez, na ordem em que foi publicada.
+        :param role: papel cuja mensagem será consumida
+        :param timeout: tempo máximo de espera, em segundos (None para esperar indefinidamente)
+        :return: a mensagem consumida, ou None caso o tempo de espera tenha se esgotado
+        """
+        with self._condition:
+            chegou = self._condition.wait_for(lambda: len(self._mensagens[role]) > self._cursores[role],
+                                              timeout=timeout)
+            if not chegou:
+                return None
+
+            mensagem = self._mensagens[role][self._cursores[role]]
+            self._cursores[role] += 1
+
+            return mensagem
+
+    async def areceive(self, role: str, timeout: Optional[float] = None) -> Optional[str]:
+        """
+        Versão assíncrona de receive, que aguarda a próxima mensagem sem ocupar uma thread.
+        :param role: papel cuja mensagem será consumida
+        :param timeout: tempo máximo de espera, em segundos (None para esperar indefinidamente)
+        :return: a mensagem consumida, ou None caso o tempo de espera tenha se esgotado
+        """
+        while True:
+            if not await self._aguardar(lambda: len(self._mensagens[role]) > self._cursores[role], timeout=timeout):
+                return None
+
+            # Outra espera pode ter consumido a mensagem entre a verificação e a aquisição do lock
+            with self._condition:
+                if len(self._mensagens[role]) > self._cursores[role]:
+                    mensagem = self._mensagens[role][self._cursores[role]]
+                    self._cursores[role] += 1
+
+                    return mensagem
+
+    def pending(self, role: str) -> int:
+        """
+        Retorna o número de mensagens do papel que ainda não foram consumidas através de receive.
+        :param role: papel cujas mensagens pendentes serão contadas
+        :return: o número de mensagens pendentes
+        """
+        with self._condition:
+            return len(self._mensagens[role]) - self._cursores[role]
+
+    def history(self, role: str) -> List[str]:
+        """
+        Retorna uma cópia do histórico de mensagens do papel.
+        :param role: papel cujo histórico será retornado
+        :return: a lista de mensagens do papel
+        """
+        with self._condition:
+            return list(self._mensagens[role])
+
+    def close(self) -> None:
+        """
+        Fecha o log do broker, gravando em disco as mensagens pendentes.
+        :return: None
+        """
+        if self._log is not None:
+            self._log.close()
+
+
+def _acordar(futuro: asyncio.Future) -> None:
+    """
+    Acorda uma espera assíncrona do message broker. Executada no event loop da espera.
+    :param futuro: o future da espera
+    :return: None
+    """
+    if not futuro.done():
+        futuro.set_result(None)
+
+
+# Broker utilizado pelas ferramentas do agente e pela interface de chat
+_broker: Optional[MessageBroker] = None
+
+# Broker da sessão que está sendo atendida no contexto atual (thread ou tarefa). Quando definido, tem prioridade sobre
+# o broker global, permitindo que cada sessão tenha seu próprio canal de mensagens.
+_broker_da_sessao: ContextVar[Optional[MessageBroker]] = ContextVar('broker_da_sessao', default=None)
+
+
+def set_broker(broker: MessageBroker) -> None:
+    """
+    Define o message broker utilizado pelas ferramentas do agente e pela interface de chat.
+    :param broker: o message broker a ser utilizado
+    :return: None
+    """
+    global _broker
+    _broker = broker
+
+
+def bind_broker(broker: MessageBroker) -> Token:
+    """
+    Associa um message broker ao contexto atual, de modo que as ferramentas do agente executadas nesse contexto
+    utilizem o canal de mensagens da sessão.
+    :param broker: o message broker da sessão
+    :return: o token que permite desfazer a associação através de unbind_broker
+    """
+    return _broker_da_sessao.set(broker)
+
+
+def unbind_broker(token: Token) -> None:
+    """
+    Desfaz a associação feita por bind_broker.
+    :param token: o token retornado por bind_broker
+    :return: None
+    """
+    _broker_da_sessao.reset(token)
+
+
+def get_broker() -> MessageBroker:
+    """
+    Retorna o message broker em uso: o broker da sessão associada ao contexto atual ou, caso não haja, o broker global,
+    que é criado apenas em memória caso nenhum tenha sido definido.
+    :return: o message broker em uso
+    """
+    global _broker
+    broker_da_sessao = _broker_da_sessao.get()
+    if broker_da_sessao is not None:
+        return broker_da_sessao
+
+    if _broker is None:
+        _broker = MessageBroker()
+
+    return _broker
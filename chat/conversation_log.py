@@ -0,0 +1,185 @@
+import os
+import json
+import threading
+from typing import List, Optional, Set, Tuple
+
+
+class GroupCommit:
+    def __init__(self, fsync_interval: float = 0.05, fsync_batch: int = 32):
+        """
+        Classe que agrupa as gravações em disco (fsync) dos logs de conversa. Uma única thread atende todos os logs
+        abertos: as mensagens escritas são gravadas a cada fsync_interval segundos ou assim que fsync_batch mensagens
+        estiverem pendentes, o que evita um fsync por mensagem e uma thread por conversa.
+        :param fsync_interval: intervalo máximo, em segundos, entre a escrita de uma mensagem e seu fsync
+        :param fsync_batch: número de mensagens pendentes que força um fsync imediato
+        """
+        self.fsync_interval = fsync_interval
+        self.fsync_batch = fsync_batch
+        self._condition = threading.Condition()
+        self._logs_pendentes: Set["ConversationLog"] = set()
+        self._mensagens_pendentes = 0
+        self._thread: Optional[threading.Thread] = None
+
+    def mark_dirty(self, log: "ConversationLog") -> None:
+        """
+        Registra que o log possui mensagens escritas que ainda não foram gravadas em disco.
+        :param log: o log com mensagens pendentes
+        :return: None
+        """
+        with self._condition:
+            self._logs_pendentes.add(log)
+            self._mensagens_pendentes += 1
+
+            # Iniciando a thread de fsync no primeiro uso
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, daemon=True, name='fsync-logs')
+                self._thread.start()
+
+            self._condition.notify()
+
+    def discard(self, log: "ConversationLog") -> None:
+        """
+        Remove o log do conjunto de logs pendentes, por exemplo, quando ele é fechado.
+        :param log: o log a ser removido
+        :return: None
+        """
+        with self._condition:
+            self._logs_pendentes.discard(log)
+
+    def _loop(self) -> None:
+        """
+        Loop da thread de fsync: aguarda mensagens pendentes, espera o restante do lote até o intervalo máximo e grava
+        todos os logs pendentes de uma só vez, fora do lock, para não bloquear novas escritas.
+        :return: None
+        """
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._mensagens_pendentes > 0)
+                self._condition.wait_for(lambda: self._mensagens_pendentes >= self.fsync_batch,
+                                         timeout=self.fsync_interval)
+                logs = self._logs_pendentes
+                self._logs_pendentes = set()
+                self._mensagens_pendentes = 0
+
+            for log in logs:
+                log.sync()
+
+
+# Agrupador de fsyncs compartilhado por todos os logs do processo
+_group_commit = GroupCommit()
+
+
+class ConversationLog:
+    def __init__(self, path: str, group_commit: Optional[GroupCommit] = None):
+        """
+        Classe que armazena as mensagens de uma conversa em um log JSONL somente de acréscimo: cada mensagem é uma linha
+        escrita de uma só vez no fim do arquivo, de modo que o custo de escrita não depende do tamanho do histórico e
+        escritas concorrentes não se misturam. As gravações em disco (fsync) são agrupadas pelo GroupCommit.
+        :param path: caminho do arquivo JSONL do log
+        :param group_commit: agrupador de fsyncs (por padrão, o agrupador compartilhado do processo)
+        """
+        self.path = path
+        self.group_commit = group_commit or _group_commit
+
+        diretorio = os.path.dirname(path)
+        if diretorio and not os.path.exists(diretorio):
+            os.makedirs(diretorio)
+
+        # Recuperando o log de uma possível interrupção no meio de uma escrita
+        self._recover()
+
+        # O arquivo é aberto sem buffer e em modo de acréscimo: uma mensagem escrita já está no sistema operacional,
+        # mesmo que o processo seja interrompido antes do fsync
+        self._fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self._lock = threading.Lock()
+        self._tamanho = os.fstat(self._fd).st_size
+        self._fechado = False
+
+    def append(self, role: str, message: str) -> int:
+        """
+        Acrescenta uma mensagem ao fim do log.
+        :param role: papel de quem enviou a mensagem ('user' ou 'assistant')
+        :param message: a mensagem
+        :return: o offset, em bytes, em que a mensagem foi escrita
+        """
+        linha = (json.dumps({'role': role, 'message': message}, ensure_ascii=False) + '\n').encode('utf-8')
+
+        with self._lock:
+            offset = self._tamanho
+            os.write(self._fd, linha)
+            self._tamanho += len(linha)
+
+        self.group_commit.mark_dirty(self)
+
+        return offset
+
+    def read_from(self, offset: int = 0) -> Tuple[List[Tuple[str, str]], int]:
+        """
+        Lê as mensagens escritas a partir de um offset, permitindo que um leitor acompanhe o log lendo apenas o que
+        foi acrescentado desde a última leitura.
+        :param offset: offset, em bytes, a partir do qual as mensagens serão lidas
+        :return: a lista de mensagens lidas, como tuplas (papel, mensagem), e o offset da próxima leitura
+        """
+        mensagens = []
+        with open(self.path, 'rb') as arquivo:
+            arquivo.seek(offset)
+            for linha in arquivo:
+                # Uma linha sem quebra de linha ainda está sendo escrita e será lida na próxima leitura
+                if not linha.endswith(b'\n'):
+                    break
+
+                registro = json.loads(linha)
+                mensagens.append((registro['role'], registro['message']))
+                offset += len(linha)
+
+        return mensagens, offset
+
+    def sync(self) -> None:
+        """
+        Grava imediatamente em disco todas as mensagens já escritas.
+        :return: None
+        """
+        with self._lock:
+            if not self._fechado:
+                os.fsync(self._fd)
+
+    def close(self) -> None:
+        """
+        Grava as mensagens pendentes e fecha o log.
+        :return: None
+        """
+        self.group_commit.discard(self)
+
+        with self._lock:
+            if self._fechado:
+                return
+
+            os.fsync(self._fd)
+            os.close(self._fd)
+            self._fechado = True
+
+    def _recover(self) -> None:
+        """
+        Remove do fim do log uma linha incompleta ou inválida, deixada por uma interrupção no meio de uma escrita. As
+        mensagens completas anteriores são preservadas.
+        :return: None
+        """
+        if not os.path.exists(self.path):
+            return
+
+        ultimo_offset_valido = 0
+        with open(self.path, 'rb') as arquivo:
+            for linha in arquivo:
+                if not linha.endswith(b'\n'):
+                    break
+                try:
+                    json.loads(linha)
+                except ValueError:
+                    break
+                ultimo_offset_valido += len(linha)
+
+        if ultimo_offset_valido < os.path.getsize(self.path):
+            print(f'Log {self.path} com escrita incompleta. Recuperando as mensagens até o byte {ultimo_offset_valido}.')
+            with open(self.path, 'r+b') as arquivo:
+                arquivo.truncate(ultimo_offset_valido)
+
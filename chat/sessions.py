@@ -0,0 +1,352 @@
+import os
+import time
+import queue
+import asyncio
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Deque, Dict, List, Optional
+
+from llama_index.core.agent import ReActAgent
+
+from chat.broker import MessageBroker, bind_broker, unbind_broker
+from chat.tracing import forget_session, set_session, unset_session
+from utils import astart_chat, start_chat
+
+
+class Session:
+    def __init__(self, session_id: str, broker: MessageBroker):
+        """
+        Classe que representa a conversa de um usuário com o agente, com seu próprio canal de mensagens.
+        :param session_id: identificador da sessão (por exemplo, o session_hash do Gradio)
+        :param broker: message broker exclusivo da sessão
+        """
+        self.session_id = session_id
+        self.broker = broker
+        self.status = 'inativa'  # 'inativa', 'na fila' ou 'em atendimento'
+        self.last_activity = time.monotonic()
+
+
+class SessionManager:
+    def __init__(self, agent_factory: Callable[[], ReActAgent], max_workers: int = 8, max_queue: int = 32,
+                 idle_timeout: float = 300, session_ttl: float = 3600, persist_dir: Optional[str] = None):
+        """
+        Classe que isola as conversas de cada usuário e as distribui em um pool limitado de workers. Cada sessão possui
+        seu próprio message broker e, enquanto é atendida, utiliza com exclusividade um dos agentes do pool.
+        :param agent_factory: função que cria um novo agente de ensino
+        :param max_workers: número máximo de sessões atendidas simultaneamente (e de agentes criados)
+        :param max_queue: número máximo de sessões aguardando um worker. Acima disso, novas sessões são recusadas.
+        :param idle_timeout: tempo, em segundos, sem mensagens do usuário após o qual o worker da sessão é liberado
+        :param session_ttl: tempo, em segundos, após o qual uma sessão inativa é descartada
+        :param persist_dir: diretório onde as mensagens de cada sessão serão salvas (None para manter apenas em memória)
+        """
+        self.agent_factory = agent_factory
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.idle_timeout = idle_timeout
+        self.session_ttl = session_ttl
+        self.persist_dir = persist_dir
+
+        self._lock = threading.Lock()
+        self._sessoes: Dict[str, Session] = {}
+        self._fila: Deque[str] = deque()  # sessões aguardando um worker, em ordem de chegada
+        self._em_atendimento = 0
+        self._recusadas = 0
+        self._agentes: "queue.LifoQueue[ReActAgent]" = queue.LifoQueue()  # agentes livres, reaproveitados
+        self._executor: Optional[ThreadPoolExecutor] = None  # criado no primeiro atendimento
+
+    def prewarm(self, n_agents: int = 1) -> None:
+        """
+        Cria agentes antecipadamente e os deixa livres no pool, para que as primeiras sessões não esperem a criação do
+        agente.
+        :param n_agents: número de agentes livres desejados (no máximo max_workers)
+        :return: None
+        """
+        for _ in range(min(n_agents, self.max_workers) - self._agentes.qsize()):
+            self._agentes.put(self.agent_factory())
+
+    def get_session(self, session_id: str) -> Session:
+        """
+        Retorna a sessão do usuário, criando-a, com seu próprio message broker, caso ainda não exista.
+        :param session_id: identificador da sessão
+        :return: a sessão do usuário
+        """
+        expiradas = []
+        with self._lock:
+            sessao = self._sessoes.get(session_id)
+            if sessao is None:
+                expiradas = self._descartar_sessoes_expiradas()
+                sessao = Session(session_id, self._criar_broker(session_id))
+                self._sessoes[session_id] = sessao
+
+        # Fechando os logs das sessões descartadas fora do lock, para que a escrita em disco não atrase as demais sessões
+        for broker in expiradas:
+            broker.close()
+
+        return sessao
+
+    def submit(self, session_id: str, message: str) -> bool:
+        """
+        Envia a mensagem do usuário para a sua sessão, colocando a sessão na fila de atendimento caso ela não esteja
+        sendo atendida. Se a fila estiver cheia, a mensagem é recusada.
+        :param session_id: identificador da sessão
+        :param message: a mensagem do usuário
+        :return: booleano que indica se a mensagem foi aceita
+        """
+        sessao = self.get_session(session_id)
+
+        with self._lock:
+            sessao.last_activity = time.monotonic()
+            em_atendimento = sessao.status != 'inativa'
+
+            if not em_atendimento:
+                # Controle de admissão: recusando a sessão caso a fila já esteja cheia
+                if len(self._fila) >= self.max_queue:
+                    self._recusadas += 1
+                    return False
+
+                self._enfileirar(sessao)
+
+        # A mensagem é publicada fora do lock do gerenciador, para que a escrita no log da sessão não atrase a admissão
+        # das demais sessões. A ordem das mensagens da sessão é garantida pelo lock do seu broker.
+        sessao.broker.publish('user', message)
+
+        # O worker pode ter encerrado o atendimento entre a decisão acima e a publicação, sem ver a mensagem: nesse caso,
+        # a sessão volta para a fila
+        if em_atendimento:
+            with self._lock:
+                if sessao.status == 'inativa' and sessao.broker.pending('user') > 0:
+                    self._enfileirar(sessao)
+
+        return True
+
+    def _enfileirar(self, sessao: Session) -> None:
+        """
+        Coloca a sessão na fila de atendimento e agenda o seu atendimento. Deve ser chamada com o lock adquirido.
+        :param sessao: a sessão
+        :return: None
+        """
+        sessao.status = 'na fila'
+        self._fila.append(sessao.session_id)
+        self._agendar(sessao)
+
+    def queue_position(self, session_id: str) -> Optional[int]:
+        """
+        Retorna a posição da sessão na fila de atendimento.
+        :param session_id: identificador da sessão
+        :return: a posição (começando em 1), ou None caso a sessão não esteja na fila
+        """
+        with self._lock:
+            try:
+                return self._fila.index(session_id) + 1
+            except ValueError:
+                return None
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Retorna as métricas de ocupação do pool de workers.
+        :return: dicionário com o número de sessões, de sessões em atendimento, de sessões na fila e de sessões recusadas
+        """
+        with self._lock:
+            return {'sessoes': len(self._sessoes), 'em_atendimento': self._em_atendimento, 'na_fila': len(self._fila),
+                    'max_workers': self.max_workers, 'max_fila': self.max_queue, 'recusadas': self._recusadas}
+
+    def shutdown(self) -> None:
+        """
+        Encerra o pool de workers, sem aguardar as sessões em atendimento.
+        :return: None
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _criar_broker(self, session_id: str) -> MessageBroker:
+        """
+        Cria o message broker de uma sessão, salvando as mensagens em um diretório próprio caso haja persistência.
+        :param session_id: identificador da sessão
+        :return: o message broker da sessão
+        """
+        if self.persist_dir is None:
+            return MessageBroker(idle_timeout=self.idle_timeout)
+
+        return MessageBroker(os.path.join(self.persist_dir, f'{session_id}.jsonl'), idle_timeout=self.idle_timeout)
+
+    def _descartar_sessoes_expiradas(self) -> List[MessageBroker]:
+        """
+        Descarta as sessões inativas há mais de session_ttl segundos. Deve ser chamada com o lock adquirido.
+        :return: os message brokers das sessões descartadas, que devem ser fechados após liberar o lock
+        """
+        agora = time.monotonic()
+        expiradas = [session_id for session_id, sessao in self._sessoes.items()
+                     if sessao.status == 'inativa' and agora - sessao.last_activity > self.session_ttl]
+
+        for session_id in expiradas:
+            forget_session(session_id)
+
+        return [self._sessoes.pop(session_id).broker for session_id in expiradas]
+
+    def _agendar(self, sessao: Session) -> None:
+        """
+        Agenda o atendimento da sessão em um dos workers do pool. Deve ser chamada com o lock adquirido.
+        :param sessao: a sessão a ser atendida
+        :return: None
+        """
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='sessao')
+
+        self._executor.submit(self._atender, sessao)
+
+    def _retirar_da_fila(self, sessao: Session) -> None:
+        """
+        Retira a sessão da fila e a marca como em atendimento.
+        :param sessao: a sessão a ser atendida
+        :return: None
+        """
+        with self._lock:
+            self._fila.remove(sessao.session_id)
+            sessao.status = 'em atendimento'
+            self._em_atendimento += 1
+
+    def _iniciar_atendimento(self, sessao: Session) -> ReActAgent:
+        """
+        Retira a sessão da fila e obtém um agente livre para atendê-la, ou cria um novo. Como há no máximo max_workers
+        sessões em atendimento, nunca são criados mais do que max_workers agentes.
+        :param sessao: a sessão a ser atendida
+        :return: o agente que atenderá a sessão
+        """
+        self._retirar_da_fila(sessao)
+
+        try:
+            return self._agentes.get_nowait()
+        except queue.Empty:
+            return self.agent_factory()
+
+    def _encerrar_se_ociosa(self, sessao: Session) -> bool:
+        """
+        Encerra o atendimento apenas se nenhuma mensagem chegou enquanto o agente finalizava a conversa.
+        :param sessao: a sessão em atendimento
+        :return: booleano que indica se o atendimento foi encerrado
+        """
+        with self._lock:
+            if sessao.broker.pending('user') == 0:
+                sessao.status = 'inativa'
+                self._em_atendimento -= 1
+                return True
+
+            return False
+
+    def _encerrar_com_erro(self, sessao: Session, erro: Exception) -> None:
+        """
+        Encerra o atendimento após um erro, avisando o usuário, para que a interface não fique aguardando uma resposta
+        que nunca chegará.
+        :param sessao: a sessão em atendimento
+        :param erro: o erro ocorrido
+        :return: None
+        """
+        print(f'Erro no atendimento da sessão {sessao.session_id}: {erro}')
+
+        sessao.broker.publish('assistant', 'Desculpe, ocorreu um erro ao processar sua mensagem. Tente novamente.')
+        with self._lock:
+            sessao.status = 'inativa'
+            self._em_atendimento -= 1
+
+    def _devolver_agente(self, agent: Optional[ReActAgent]) -> None:
+        """
+        Devolve o agente ao pool, sem o histórico da conversa.
+        :param agent: o agente que atendeu a sessão
+        :return: None
+        """
+        if agent is not None:
+            agent.reset()
+            self._agentes.put(agent)
+
+    def _atender(self, sessao: Session) -> None:
+        """
+        Atende uma sessão em um dos workers do pool: obtém um agente livre, associa o message broker da sessão ao
+        contexto do worker e conversa com o usuário até que ele fique inativo.
+        :param sessao: a sessão a ser atendida
+        :return: None
+        """
+        agent = None
+        token = bind_broker(sessao.broker)
+        token_sessao = set_session(sessao.session_id)
+        try:
+            agent = self._iniciar_atendimento(sessao)
+
+            while True:
+                start_chat(agent, sessao.broker, idle_timeout=self.idle_timeout)
+                if self._encerrar_se_ociosa(sessao):
+                    break
+        except Exception as e:
+            self._encerrar_com_erro(sessao, e)
+        finally:
+            unset_session(token_sessao)
+            unbind_broker(token)
+            self._devolver_agente(agent)
+
+
+class AsyncSessionManager(SessionManager):
+    def __init__(self, agent_factory: Callable[[], ReActAgent], max_workers: int = 8, max_queue: int = 32,
+                 idle_timeout: float = 300, session_ttl: float = 3600, persist_dir: Optional[str] = None):
+        """
+        Gerenciador de sessões do runtime assíncrono: cada sessão em atendimento é uma corrotina, executada em um único
+        event loop, e não uma thread. Os agentes utilizam a API assíncrona do LlamaIndex e aguardam o usuário sem
+        ocupar uma thread, de forma que milhares de conversas aguardando o usuário custam apenas corrotinas. Os
+        parâmetros são os mesmos do SessionManager; max_workers continua limitando as sessões atendidas ao mesmo tempo
+        (e os agentes criados).
+        """
+        super().__init__(agent_factory, max_workers=max_workers, max_queue=max_queue, idle_timeout=idle_timeout,
+                         session_ttl=session_ttl, persist_dir=persist_dir)
+
+        # Vagas de atendimento: as sessões agendadas aguardam uma vaga ainda na fila, como no pool de workers
+        self._vagas = asyncio.Semaphore(max_workers)
+
+        self._loop = asyncio.new_event_loop()
+        threading.Thread(target=self._loop.run_forever, name='runtime', daemon=True).start()
+
+    def shutdown(self) -> None:
+        """
+        Encerra o event loop das sessões, sem aguardar as sessões em atendimento.
+        :return: None
+        """
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+    def _agendar(self, sessao: Session) -> None:
+        asyncio.run_coroutine_threadsafe(self._aatender(sessao), self._loop)
+
+    async def _ainiciar_atendimento(self, sessao: Session) -> ReActAgent:
+        """
+        Versão assíncrona de _iniciar_atendimento. O agente é criado em uma thread, para não bloquear o event loop.
+        :param sessao: a sessão a ser atendida
+        :return: o agente que atenderá a sessão
+        """
+        self._retirar_da_fila(sessao)
+
+        try:
+            return self._agentes.get_nowait()
+        except queue.Empty:
+            return await asyncio.to_thread(self.agent_factory)
+
+    async def _aatender(self, sessao: Session) -> None:
+        """
+        Versão assíncrona de _atender. A sessão aguarda na fila até que uma das max_workers vagas de atendimento seja
+        liberada. O broker da sessão é associado ao contexto da corrotina.
+        :param sessao: a sessão a ser atendida
+        :return: None
+        """
+        async with self._vagas:
+            agent = None
+            token = bind_broker(sessao.broker)
+            token_sessao = set_session(sessao.session_id)
+            try:
+                agent = await self._ainiciar_atendimento(sessao)
+
+                while True:
+                    await astart_chat(agent, sessao.broker, idle_timeout=self.idle_timeout)
+                    if self._encerrar_se_ociosa(sessao):
+                        break
+            except Exception as e:
+                self._encerrar_com_erro(sessao, e)
+            finally:
+                unset_session(token_sessao)
+                unbind_broker(token)
+                self._devolver_agente(agent)
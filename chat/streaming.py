@@ -0,0 +1,114 @@
+import re
+from typing import Callable
+
+# Início da mensagem enviada ao usuário pela ferramenta send_message, no formato ReAct
+_INICIO_MENSAGEM = re.compile(r'Action:\s*send_message\s*Action Input:\s*\{\s*"message"\s*:\s*"')
+
+# Início da resposta final do agente, no formato ReAct
+_INICIO_RESPOSTA = re.compile(r'Answer:\s*')
+
+# Maior trecho que um dos marcadores acima pode ocupar, para que a busca não precise percorrer todo o texto novamente
+_TAMANHO_MAXIMO_MARCADOR = 200
+
+# Sequências de escape de strings JSON
+_ESCAPES_JSON = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+
+
+class ReActStreamParser:
+    def __init__(self, on_text: Callable[[str], None]):
+        """
+        Classe que, a partir dos trechos gerados pelo LLM no formato ReAct, extrai incrementalmente a parte que deve ser
+        exibida ao usuário: a mensagem passada à ferramenta send_message ou a resposta final (Answer). Os pensamentos e
+        ações do agente não são repassados.
+        :param on_text: função chamada com cada novo trecho de texto destinado ao usuário
+        """
+        self.on_text = on_text
+        self._texto = ''
+        self._varrido = 0  # posição até onde os marcadores já foram procurados
+        self._pos = 0  # posição do próximo caractere a ser repassado ao usuário
+        self._modo = None  # None (procurando marcador), 'mensagem', 'resposta' ou 'fim'
+        self._emitiu = False  # indica se algum texto já foi repassado ao usuário
+
+    def feed(self, delta: str) -> None:
+        """
+        Processa um novo trecho gerado pelo LLM.
+        :param delta: o trecho gerado
+        :return: None
+        """
+        if not delta or self._modo == 'fim':
+            return
+
+        self._texto += delta
+
+        # Procurando o início da mensagem ou da resposta, apenas na parte do texto ainda não varrida
+        if self._modo is None:
+            inicio_busca = max(0, self._varrido - _TAMANHO_MAXIMO_MARCADOR)
+            for modo, padrao in (('mensagem', _INICIO_MENSAGEM), ('resposta', _INICIO_RESPOSTA)):
+                encontrado = padrao.search(self._texto, inicio_busca)
+                if encontrado:
+                    self._modo = modo
+                    self._pos = encontrado.end()
+                    break
+
+            self._varrido = len(self._texto)
+            if self._modo is None:
+                return
+
+        # Repassando o texto destinado ao usuário
+        if self._modo == 'resposta':
+            novo_texto = self._texto[self._pos:]
+            self._pos = len(self._texto)
+
+            # Ignorando os espaços entre o marcador e o início da resposta
+            if not self._emitiu:
+                novo_texto = novo_texto.lstrip()
+        else:
+            novo_texto = self._decodificar_string_json()
+
+        if novo_texto:
+            self._emitiu = True
+            self.on_text(novo_texto)
+
+    def _decodificar_string_json(self) -> str:
+        """
+        Decodifica a string JSON da mensagem a partir da última posição repassada, parando antes de sequências de
+        escape incompletas, que serão decodificadas quando o restante chegar.
+        :return: o texto decodificado
+        """
+        partes = []
+        texto = self._texto
+        i = self._pos
+
+        while i < len(texto):
+            caractere = texto[i]
+
+            if caractere == '\\':
+                if i + 1 >= len(texto):
+                    break
+
+                escape = texto[i + 1]
+                if escape == 'u':
+                    if i + 6 > len(texto):
+                        break
+                    try:
+                        partes.append(chr(int(texto[i + 2:i + 6], 16)))
+                    except ValueError:
+                        pass
+                    i += 6
+                else:
+                    partes.append(_ESCAPES_JSON.get(escape, escape))
+                    i += 2
+                continue
+
+            # Aspas sem escape encerram a mensagem
+            if caractere == '"':
+                self._modo = 'fim'
+                i += 1
+                break
+
+            partes.append(caractere)
+            i += 1
+
+        self._pos = i
+
+        return ''.join(partes)
@@ -0,0 +1,485 @@
+import json
+import time
+import uuid
+import threading
+import inspect
+import functools
+import contextvars
+from collections import Counter, deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional
+
+# Percentis exportados pelas métricas de cada tipo de span
+QUANTIS = (0.5, 0.95, 0.99)
+
+# Configuração do tracing: se está ativo, o arquivo JSONL onde os turnos são exportados e o número máximo de durações
+# guardadas por tipo de span para o cálculo dos percentis
+_ativo = False
+_jsonl_path: Optional[str] = None
+_max_amostras = 10000
+
+_lock = threading.Lock()
+_duracoes: Dict[str, Deque[float]] = {}
+_somas: Counter = Counter()
+_contagens: Counter = Counter()
+_tokens: Counter = Counter()
+_servidor: Optional[ThreadingHTTPServer] = None
+
+# Turno, sessão e span em andamento no contexto atual (a thread do worker que atende a sessão)
+_turno_atual: contextvars.ContextVar = contextvars.ContextVar('turno_atual', default=None)
+_sessao_atual: contextvars.ContextVar = contextvars.ContextVar('sessao_atual', default=None)
+_span_atual: contextvars.ContextVar = contextvars.ContextVar('span_atual', default=None)
+_turnos_por_sessao: Counter = Counter()
+
+
+class Span:
+    def __init__(self, kind: str, name: str, trace: Optional["Trace"], parent: Optional["Span"], **attrs: Any):
+        """
+        Classe que representa uma operação medida dentro de um turno: uma etapa do ciclo ReAct, uma chamada ao LLM, a
+        uma ferramenta, ao modelo de embedding, uma busca ou o carregamento de um índice.
+        :param kind: o tipo da operação ('react_step', 'llm', 'tool', 'retrieval', 'embedding', 'index_load', ...)
+        :param name: o nome da operação (por exemplo, o nome da ferramenta)
+        :param trace: o turno ao qual a operação pertence (None para operações fora de um turno)
+        :param parent: a operação da qual esta faz parte
+        :param attrs: atributos adicionais da operação
+        """
+        self.id = uuid.uuid4().hex[:16]
+        self.kind = kind
+        self.name = name
+        self.trace = trace
+        self.parent = parent
+        self.attrs = attrs
+        self.start = time.perf_counter()
+        self.end_time: Optional[float] = None
+
+    def end(self, **attrs: Any) -> None:
+        """
+        Encerra a operação, registrando sua duração nas métricas. Chamadas após a primeira são ignoradas.
+        :param attrs: atributos adicionais da operação
+        :return: None
+        """
+        if self.end_time is not None:
+            return
+
+        self.end_time = time.perf_counter()
+        self.attrs.update(attrs)
+        _registrar(self)
+
+    def to_dict(self, origin: float) -> Dict[str, Any]:
+        """
+        :param origin: o instante de início do turno
+        :return: a operação serializável, com os tempos em milissegundos relativos ao início do turno
+        """
+        return {'id': self.id, 'parent': self.parent.id if self.parent is not None else None, 'kind': self.kind,
+                'name': self.name, 'start_ms': (self.start - origin) * 1000,
+                'duration_ms': (self.end_time - self.start) * 1000 if self.end_time is not None else None,
+                'attrs': self.attrs}
+
+
+class Trace:
+    def __init__(self, session_id: Optional[str], turn: int, message: str):
+        """
+        Classe que reúne as operações de um turno da conversa, da mensagem do usuário à mensagem seguinte do agente.
+        :param session_id: a sessão do usuário
+        :param turn: o número do turno na sessão
+        :param message: a mensagem do usuário
+        """
+        self.id = uuid.uuid4().hex
+        self.session_id = session_id
+        self.turn = turn
+        self.message_chars = len(message)
+        self.timestamp = time.time()
+        self.root = Span('turn', 'turn', self, None)
+        self.spans: List[Span] = [self.root]
+        self.step: Optional[Span] = None  # etapa do ciclo ReAct em andamento
+        self.steps = 0
+        self.lock = threading.Lock()
+
+    def add(self, span: Span) -> None:
+        with self.lock:
+            self.spans.append(span)
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self.lock:
+            spans = [span.to_dict(self.root.start) for span in self.spans]
+
+        return {'trace_id': self.id, 'session': self.session_id, 'turn': self.turn, 'timestamp': self.timestamp,
+                'message_chars': self.message_chars, 'react_steps': self.steps,
+                'duration_ms': spans[0]['duration_ms'], 'spans': spans}
+
+
+def _registrar(span: Span) -> None:
+    """
+    Registra a duração e os tokens de uma operação encerrada nas métricas agregadas.
+    :param span: a operação
+    :return: None
+    """
+    duracao = span.end_time - span.start
+    with _lock:
+        if span.kind not in _duracoes:
+            _duracoes[span.kind] = deque(maxlen=_max_amostras)
+        _duracoes[span.kind].append(duracao)
+        _somas[span.kind] += duracao
+        _contagens[span.kind] += 1
+        for tipo in ('prompt_tokens', 'completion_tokens'):
+            if tipo in span.attrs:
+                _tokens[tipo] += span.attrs[tipo]
+
+
+class _SpanNulo:
+    """
+    Operação que não é registrada, utilizada quando o tracing está desativado.
+    """
+
+    @property
+    def attrs(self) -> Dict[str, Any]:
+        return {}
+
+    def end(self, **attrs: Any) -> None:
+        pass
+
+
+_SPAN_NULO = _SpanNulo()
+
+
+def configure_tracing(jsonl_path: Optional[str] = None, metrics_port: Optional[int] = None,
+                      max_samples: int = 10000) -> None:
+    """
+    Ativa o tracing dos turnos: cada turno é exportado como uma linha JSON em jsonl_path e as durações de cada tipo de
+    operação são agregadas em percentis, expostos em http://127.0.0.1:<metrics_port>/metrics (formato Prometheus) e
+    /metrics.json. As chamadas ao LLM e ao modelo de embedding são capturadas pelos eventos de instrumentação do
+    LlamaIndex.
+    :param jsonl_path: o arquivo onde os turnos são exportados (None para não exportar)
+    :param metrics_port: a porta do endpoint de métricas (None para não iniciar o endpoint)
+    :param max_samples: o número máximo de durações guardadas por tipo de operação para o cálculo dos percentis
+    :return: None
+    """
+    global _ativo, _jsonl_path, _max_amostras
+
+    if not _ativo:
+        from llama_index.core.instrumentation import get_dispatcher
+        get_dispatcher().add_event_handler(_criar_event_handler())
+
+    _ativo = True
+    _jsonl_path = jsonl_path
+    _max_amostras = max_samples
+
+    if metrics_port is not None:
+        start_metrics_server(metrics_port)
+
+
+def set_session(session_id: Optional[str]) -> contextvars.Token:
+    """
+    Associa os turnos do contexto atual a uma sessão.
+    :param session_id: a sessão
+    :return: o token para restaurar a sessão anterior
+    """
+    return _sessao_atual.set(session_id)
+
+
+def unset_session(token: contextvars.Token) -> None:
+    """
+    Encerra o turno ainda aberto da sessão do contexto atual e restaura a sessão anterior.
+    :param token: o token retornado por set_session
+    :return: None
+    """
+    end_turn()
+    _sessao_atual.reset(token)
+
+
+def forget_session(session_id: str) -> None:
+    """
+    Descarta o contador de turnos de uma sessão encerrada, para que a memória não cresça com o número de sessões.
+    :param session_id: a sessão
+    :return: None
+    """
+    with _lock:
+        _turnos_por_sessao.pop(session_id, None)
+
+
+def begin_turn(message: str) -> None:
+    """
+    Inicia um turno no contexto atual, ao receber uma mensagem do usuário. Um turno ainda aberto é encerrado.
+    :param message: a mensagem do usuário
+    :return: None
+    """
+    if not _ativo:
+        return
+
+    end_turn()
+    sessao = _sessao_atual.get()
+    with _lock:
+        _turnos_por_sessao[sessao] += 1
+        turno = _turnos_por_sessao[sessao]
+
+    _turno_atual.set(Trace(sessao, turno, message))
+
+
+def end_turn(**attrs: Any) -> None:
+    """
+    Encerra o turno do contexto atual, ao publicar a mensagem do agente, e o exporta. As operações ainda abertas (por
+    exemplo, a chamada a send_message, que continua aguardando o usuário) são encerradas junto com o turno.
+    :param attrs: atributos adicionais do turno
+    :return: None
+    """
+    trace = _turno_atual.get()
+    if trace is None:
+        return
+
+    _turno_atual.set(None)
+    with trace.lock:
+        abertos = [span for span in trace.spans[1:] if span.end_time is None]
+    for span in abertos:
+        span.end(closed_by_turn=True)
+    trace.root.end(react_steps=trace.steps, **attrs)
+
+    if _jsonl_path is not None:
+        linha = json.dumps(trace.to_dict(), ensure_ascii=False, default=str)
+        with _lock:
+            with open(_jsonl_path, 'a', encoding='utf-8') as arquivo:
+                arquivo.write(linha + '\n')
+
+
+def start_span(kind: str, name: Optional[str] = None, **attrs: Any):
+    """
+    Inicia uma operação no turno atual. Deve ser encerrada com end.
+    :param kind: o tipo da operação
+    :param name: o nome da operação (por padrão, o tipo)
+    :param attrs: atributos adicionais da operação
+    :return: a operação
+    """
+    if not _ativo:
+        return _SPAN_NULO
+
+    trace = _turno_atual.get()
+    parent = _span_atual.get()
+    if parent is None and trace is not None:
+        parent = trace.step or trace.root
+
+    span = Span(kind, name or kind, trace, parent, **attrs)
+    if trace is not None:
+        trace.add(span)
+
+    return span
+
+
+@contextmanager
+def span(kind: str, name: Optional[str] = None, **attrs: Any) -> Iterator[Any]:
+    """
+    Mede uma operação no turno atual. As operações iniciadas dentro do bloco são registradas como parte dela.
+    :param kind: o tipo da operação
+    :param name: o nome da operação (por padrão, o tipo)
+    :param attrs: atributos adicionais da operação
+    :return: a operação, cujos atributos podem ser complementados dentro do bloco
+    """
+    atual = start_span(kind, name, **attrs)
+    if atual is _SPAN_NULO:
+        yield atual
+        return
+
+    token = _span_atual.set(atual)
+    try:
+        yield atual
+    except BaseException as e:
+        atual.attrs['error'] = type(e).__name__
+        raise
+    finally:
+        _span_atual.reset(token)
+        atual.end()
+
+
+def traced_tool(function: Callable) -> Callable:
+    """
+    Decorador que mede cada chamada a uma ferramenta do agente.
+    :param function: a ferramenta
+    :return: a ferramenta medida, com o mesmo nome, assinatura e docstring
+    """
+    if inspect.iscoroutinefunction(function):
+        @functools.wraps(function)
+        async def wrapper_assincrono(*args, **kwargs):
+            with span('tool', function.__name__):
+                return await function(*args, **kwargs)
+
+        return wrapper_assincrono
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        with span('tool', function.__name__):
+            return function(*args, **kwargs)
+
+    return wrapper
+
+
+def _iniciar_etapa() -> Optional[Span]:
+    """
+    Inicia uma nova etapa do ciclo ReAct no turno atual, encerrando a anterior. Cada etapa começa com uma chamada ao
+    LLM e inclui a ferramenta chamada em seguida.
+    :return: a nova etapa, ou None fora de um turno
+    """
+    trace = _turno_atual.get()
+    if trace is None:
+        return None
+
+    if trace.step is not None:
+        trace.step.end()
+    trace.steps += 1
+    trace.step = Span('react_step', f'step_{trace.steps}', trace, trace.root, step=trace.steps)
+    trace.add(trace.step)
+
+    return trace.step
+
+
+def _contar_tokens(texto: str) -> int:
+    from llama_index.core.utils import get_tokenizer
+    return len(get_tokenizer()(texto))
+
+
+def _uso_de_tokens(messages, response) -> Dict[str, Any]:
+    """
+    Obtém o número de tokens de uma chamada ao LLM, informado pela API quando disponível ou estimado com o tokenizador
+    do LlamaIndex (por exemplo, no streaming, em que a API não informa o uso).
+    :param messages: as mensagens enviadas ao LLM
+    :param response: a resposta do LLM
+    :return: os tokens do prompt e da resposta
+    """
+    uso = getattr(getattr(response, 'raw', None), 'usage', None)
+    if uso is None and isinstance(getattr(response, 'raw', None), dict):
+        uso = response.raw.get('usage')
+    if isinstance(uso, dict):
+        return {'prompt_tokens': uso.get('prompt_tokens', 0), 'completion_tokens': uso.get('completion_tokens', 0)}
+    if uso is not None:
+        return {'prompt_tokens': uso.prompt_tokens, 'completion_tokens': uso.completion_tokens}
+
+    return {'prompt_tokens': sum(_contar_tokens(message.content or '') for message in messages),
+            'completion_tokens': _contar_tokens(response.message.content or ''), 'tokens_estimated': True}
+
+
+def _criar_event_handler():
+    """
+    Cria o handler dos eventos de instrumentação do LlamaIndex que registra as chamadas ao LLM e ao modelo de
+    embedding. Os eventos de início e fim de uma chamada ao LLM são associados pelo conteúdo das mensagens, pois o fim
+    de um streaming pode ocorrer em outra thread e os eventos recebem cópias das mensagens.
+    :return: o handler
+    """
+    from llama_index.core.instrumentation.event_handlers import BaseEventHandler
+    from llama_index.core.instrumentation.events.embedding import EmbeddingStartEvent, EmbeddingEndEvent
+    from llama_index.core.instrumentation.events.llm import LLMChatStartEvent, LLMChatEndEvent
+
+    chamadas_llm: Dict[int, Deque[Span]] = {}
+    lock_llm = threading.Lock()
+    embeddings = threading.local()
+
+    def chave(messages) -> int:
+        return hash(tuple((str(message.role), message.content) for message in messages))
+
+    class TracingEventHandler(BaseEventHandler):
+        @classmethod
+        def class_name(cls) -> str:
+            return "TracingEventHandler"
+
+        def handle(self, event, **kwargs) -> None:
+            if isinstance(event, LLMChatStartEvent):
+                _iniciar_etapa()
+                modelo = event.model_dict.get('model', event.model_dict.get('class_name'))
+                llm = start_span('llm', str(modelo), messages=len(event.messages))
+                with lock_llm:
+                    chamadas_llm.setdefault(chave(event.messages), deque()).append(llm)
+            elif isinstance(event, LLMChatEndEvent):
+                with lock_llm:
+                    pendentes = chamadas_llm.get(chave(event.messages))
+                    llm = pendentes.popleft() if pendentes else None
+                    if pendentes is not None and not pendentes:
+                        del chamadas_llm[chave(event.messages)]
+                if llm is not None and event.response is not None:
+                    llm.end(**_uso_de_tokens(event.messages, event.response))
+            elif isinstance(event, EmbeddingStartEvent):
+                pilha = getattr(embeddings, 'pilha', None)
+                if pilha is None:
+                    pilha = embeddings.pilha = []
+                pilha.append(start_span('embedding', event.model_dict.get('class_name')))
+            elif isinstance(event, EmbeddingEndEvent):
+                pilha = getattr(embeddings, 'pilha', None)
+                if pilha:
+                    pilha.pop().end(chunks=len(event.chunks))
+
+    return TracingEventHandler()
+
+
+def get_metrics() -> Dict[str, Dict[str, float]]:
+    """
+    Retorna as métricas agregadas de cada tipo de operação.
+    :return: para cada tipo de operação, o número de operações, a soma das durações e os percentis (em segundos), além
+    do total de tokens das chamadas ao LLM, em 'tokens'
+    """
+    with _lock:
+        amostras = {tipo: sorted(duracoes) for tipo, duracoes in _duracoes.items()}
+        metricas = {tipo: {'count': _contagens[tipo], 'sum': _somas[tipo]} for tipo in amostras}
+        tokens = dict(_tokens)
+
+    for tipo, ordenadas in amostras.items():
+        for quantil in QUANTIS:
+            metricas[tipo][f'p{int(quantil * 100)}'] = ordenadas[min(len(ordenadas) - 1, int(quantil * len(ordenadas)))]
+    metricas['tokens'] = tokens
+
+    return metricas
+
+
+def _formato_prometheus(metricas: Dict[str, Dict[str, float]]) -> str:
+    """
+    Formata as métricas no formato de texto do Prometheus.
+    :param metricas: as métricas retornadas por get_metrics
+    :return: o texto das métricas
+    """
+    linhas = ['# HELP edu_span_seconds Duração das operações de cada turno, por tipo.', '# TYPE edu_span_seconds summary']
+    for tipo, valores in metricas.items():
+        if tipo == 'tokens':
+            continue
+        for quantil in QUANTIS:
+            linhas.append(f'edu_span_seconds{{kind="{tipo}",quantile="{quantil}"}} '
+                          f'{valores[f"p{int(quantil * 100)}"]:.6f}')
+        linhas.append(f'edu_span_seconds_sum{{kind="{tipo}"}} {valores["sum"]:.6f}')
+        linhas.append(f'edu_span_seconds_count{{kind="{tipo}"}} {valores["count"]}')
+
+    linhas += ['# HELP edu_llm_tokens_total Tokens das chamadas ao LLM.', '# TYPE edu_llm_tokens_total counter']
+    for tipo, total in metricas['tokens'].items():
+        linhas.append(f'edu_llm_tokens_total{{type="{tipo.replace("_tokens", "")}"}} {total}')
+
+    return '\n'.join(linhas) + '\n'
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == '/metrics':
+            corpo, tipo = _formato_prometheus(get_metrics()).encode('utf-8'), 'text/plain; version=0.0.4'
+        elif self.path == '/metrics.json':
+            corpo, tipo = json.dumps(get_metrics()).encode('utf-8'), 'application/json'
+        else:
+            self.send_error(404)
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', tipo)
+        self.send_header('Content-Length', str(len(corpo)))
+        self.end_headers()
+        self.wfile.write(corpo)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port: int, host: str = '127.0.0.1') -> ThreadingHTTPServer:
+    """
+    Inicia, em uma thread em segundo plano, o endpoint HTTP local das métricas.
+    :param port: a porta do endpoint
+    :param host: o endereço do endpoint
+    :return: o servidor
+    """
+    global _servidor
+
+    if _servidor is None:
+        _servidor = ThreadingHTTPServer((host, port), _MetricsHandler)
+        threading.Thread(target=_servidor.serve_forever, name='metricas', daemon=True).start()
+        print(f'Métricas disponíveis em http://{host}:{port}/metrics')
+
+    return _servidor
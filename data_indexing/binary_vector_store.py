@@ -0,0 +1,212 @@
+import os
+import json
+from typing import Any, Dict, List, Optional, Sequence
+
+import fsspec
+import numpy as np
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.schema import BaseNode
+from llama_index.core.storage.docstore.utils import doc_to_json, json_to_doc
+from llama_index.core.vector_stores.types import VectorStoreQueryResult
+
+from data_indexing.numpy_vector_store import NumpyVectorStore, NUMPY_VECTOR_STORE_BASENAME
+
+
+class BinaryVectorStore(NumpyVectorStore):
+    """
+    Vector store persistido em formato binário compacto, que guarda também os textos e metadados dos nós, dispensando o
+    docstore do índice. São salvos quatro arquivos ao lado do caminho indicado pelo StorageContext:
+    - {base}.f32: os embeddings normalizados, como uma matriz float32 crua (little-endian), uma linha por nó;
+    - {base}.nodes.bin: os nós serializados (sem o embedding), concatenados;
+    - {base}.nodes.idx: os offsets de cada nó em {base}.nodes.bin, como int64 (n + 1 valores);
+    - {base}.meta.json: a dimensão dos embeddings e os ids dos nós e de seus documentos de origem.
+    Na carga, os embeddings e os nós são mapeados em memória (memory-mapped), sem leitura ou parse: apenas as páginas
+    efetivamente acessadas pelas consultas são lidas do disco, e apenas os nós retornados são desserializados.
+    """
+
+    stores_text: bool = True
+
+    _dados: Optional[np.ndarray] = PrivateAttr()
+    _offsets: Optional[np.ndarray] = PrivateAttr()
+    _persistidos: Dict[str, int] = PrivateAttr()
+    _novos: Dict[str, bytes] = PrivateAttr()
+
+    def __init__(self, embeddings: Optional[np.ndarray] = None, ids: Optional[List[str]] = None,
+                 ref_doc_ids: Optional[List[str]] = None, data: Optional[np.ndarray] = None,
+                 offsets: Optional[np.ndarray] = None, **kwargs: Any):
+        """
+        :param embeddings: matriz com os embeddings já normalizados, um por linha (por padrão, um store vazio)
+        :param ids: os ids dos nós de cada linha da matriz
+        :param ref_doc_ids: os ids dos documentos de origem de cada linha da matriz
+        :param data: os bytes dos nós serializados, na ordem das linhas da matriz
+        :param offsets: os offsets de cada nó em data (n + 1 valores)
+        """
+        super().__init__(embeddings, ids, ref_doc_ids, **kwargs)
+        self._dados = data
+        self._offsets = offsets
+        self._persistidos = dict(self._posicoes) if data is not None else {}
+        self._novos = {}
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "BinaryVectorStore"
+
+    def _serializar(self, node: BaseNode) -> bytes:
+        """
+        Serializa o nó sem o embedding, que já está na matriz.
+        :param node: o nó
+        :return: os bytes do nó serializado
+        """
+        dados = doc_to_json(node)
+        dados['__data__']['embedding'] = None
+
+        return json.dumps(dados, ensure_ascii=False).encode('utf-8')
+
+    def _bytes_do_no(self, node_id: str) -> bytes:
+        """
+        Obtém os bytes serializados de um nó, adicionado desde a carga ou mapeado do arquivo persistido.
+        :param node_id: o id do nó
+        :return: os bytes do nó serializado
+        """
+        if node_id in self._novos:
+            return self._novos[node_id]
+
+        linha = self._persistidos[node_id]
+
+        return self._dados[self._offsets[linha]:self._offsets[linha + 1]].tobytes()
+
+    def get_node(self, node_id: str) -> BaseNode:
+        """
+        Retorna um nó do store.
+        :param node_id: o id do nó
+        :return: o nó, sem o embedding
+        """
+        with self._lock:
+            dados = self._bytes_do_no(node_id)
+
+        return json_to_doc(json.loads(dados))
+
+    def get_nodes(self, node_ids: Optional[Sequence[str]] = None) -> List[BaseNode]:
+        """
+        Retorna vários nós do store.
+        :param node_ids: os ids dos nós (None para todos os nós, na ordem em que foram adicionados)
+        :return: os nós, sem os embeddings
+        """
+        with self._lock:
+            if node_ids is None:
+                node_ids = self._ids
+            dados = [self._bytes_do_no(node_id) for node_id in node_ids]
+
+        return [json_to_doc(json.loads(no)) for no in dados]
+
+    def add(self, nodes: List[BaseNode], **add_kwargs: Any) -> List[str]:
+        if not nodes:
+            return []
+
+        serializados = [self._serializar(node) for node in nodes]
+
+        with self._lock:
+            # A matriz mapeada do arquivo é somente leitura: ela é copiada para a memória antes da primeira escrita
+            if not self._matriz.flags.writeable:
+                self._matriz = np.array(self._matriz[:self._n])
+
+            ids = super().add(nodes, **add_kwargs)
+            for node, dados in zip(nodes, serializados):
+                self._novos[node.node_id] = dados
+
+        return ids
+
+    def delete(self, ref_doc_id: str, **delete_kwargs: Any) -> None:
+        with self._lock:
+            removidos = self._por_documento.get(ref_doc_id, set())
+            for node_id in removidos:
+                self._novos.pop(node_id, None)
+                self._persistidos.pop(node_id, None)
+            super().delete(ref_doc_id, **delete_kwargs)
+
+    def query_batch(self, query_embeddings: Sequence[Sequence[float]], similarity_top_k: int = 3,
+                    node_ids: Optional[Sequence[str]] = None) -> List[VectorStoreQueryResult]:
+        resultados = super().query_batch(query_embeddings, similarity_top_k, node_ids)
+
+        # Desserializando apenas os nós retornados. Os nós removidos entre a busca e a leitura são descartados.
+        com_nos = []
+        for resultado in resultados:
+            with self._lock:
+                encontrados = [(node_id, similaridade, self._bytes_do_no(node_id))
+                               for node_id, similaridade in zip(resultado.ids, resultado.similarities)
+                               if node_id in self._novos or node_id in self._persistidos]
+
+            com_nos.append(VectorStoreQueryResult(
+                nodes=[json_to_doc(json.loads(dados)) for _, _, dados in encontrados],
+                similarities=[similaridade for _, similaridade, _ in encontrados],
+                ids=[node_id for node_id, _, _ in encontrados]))
+
+        return com_nos
+
+    def persist(self, persist_path: str, fs: Optional[fsspec.AbstractFileSystem] = None) -> None:
+        """
+        Salva os embeddings, os nós e os ids nos arquivos binários ao lado de persist_path.
+        :param persist_path: o caminho do vector store indicado pelo StorageContext
+        :param fs: não utilizado, os arquivos são salvos no sistema de arquivos local
+        :return: None
+        """
+        base = os.path.splitext(persist_path)[0]
+        diretorio = os.path.dirname(base)
+        if diretorio and not os.path.exists(diretorio):
+            os.makedirs(diretorio)
+
+        with self._lock:
+            matriz = self._matriz[:self._n]
+            ids = list(self._ids)
+            meta = {'dim': int(self._matriz.shape[1]), 'ids': ids, 'ref_doc_ids': list(self._ref_doc_ids)}
+            nos = [self._bytes_do_no(node_id) for node_id in ids]
+
+        offsets = np.zeros(len(nos) + 1, dtype='<i8')
+        offsets[1:] = np.cumsum([len(no) for no in nos])
+
+        # Escrevendo em arquivos temporários e renomeando, para que uma interrupção não corrompa o índice. Os arquivos
+        # mapeados pela versão carregada continuam válidos, pois a renomeação não altera o arquivo antigo.
+        matriz.astype('<f4', copy=False).tofile(base + '.f32.tmp')
+        with open(base + '.nodes.bin.tmp', 'wb') as arquivo:
+            for no in nos:
+                arquivo.write(no)
+        offsets.tofile(base + '.nodes.idx.tmp')
+        with open(base + '.meta.json.tmp', 'w', encoding='utf-8') as arquivo:
+            json.dump(meta, arquivo)
+
+        for extensao in ('.f32', '.nodes.bin', '.nodes.idx', '.meta.json'):
+            os.replace(base + extensao + '.tmp', base + extensao)
+
+    @classmethod
+    def from_persist_path(cls, persist_path: str) -> "BinaryVectorStore":
+        """
+        Carrega o vector store salvo por persist, mapeando em memória os embeddings e os nós.
+        :param persist_path: o caminho do vector store indicado pelo StorageContext
+        :return: o vector store carregado
+        """
+        base = os.path.splitext(persist_path)[0]
+        if not os.path.exists(base + '.meta.json'):
+            raise ValueError(f"BinaryVectorStore não encontrado em {base}.meta.json.")
+
+        with open(base + '.meta.json', 'r', encoding='utf-8') as arquivo:
+            meta = json.load(arquivo)
+
+        n = len(meta['ids'])
+        if n == 0:
+            return cls()
+
+        embeddings = np.memmap(base + '.f32', dtype='<f4', mode='r', shape=(n, meta['dim']))
+        offsets = np.memmap(base + '.nodes.idx', dtype='<i8', mode='r', shape=(n + 1,))
+        dados = (np.memmap(base + '.nodes.bin', dtype=np.uint8, mode='r') if offsets[-1] > 0
+                 else np.empty(0, dtype=np.uint8))
+
+        return cls(embeddings, meta['ids'], meta['ref_doc_ids'], data=dados, offsets=offsets)
+
+    @classmethod
+    def from_persist_dir(cls, persist_dir: str) -> "BinaryVectorStore":
+        """
+        Carrega o vector store salvo junto ao índice persistido em persist_dir.
+        :param persist_dir: o diretório onde o índice foi persistido
+        :return: o vector store carregado
+        """
+        return cls.from_persist_path(os.path.join(persist_dir, NUMPY_VECTOR_STORE_BASENAME + '.json'))
@@ -0,0 +1,132 @@
+import re
+import unicodedata
+from collections import Counter
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+
+# Palavras muito frequentes em português, que não ajudam a identificar o conteúdo buscado
+STOPWORDS = frozenset("""
+a ao aos as com como da das de do dos e ela ele em entre era essa esse esta este eu foi ha isso isto ja mais mas me
+meu minha muito na nas nao no nos o os ou para pela pelo por pode posso qual quais quando que quero se sei ser sim
+sobre sua seu tem um uma umas uns voce
+""".split())
+
+_TOKEN = re.compile(r'[a-z0-9]+')
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Divide o texto em termos para a busca lexical: letras minúsculas, sem acentos, separando palavras e tags HTML
+    (por exemplo, "<ul>" e "ul" geram o mesmo termo) e descartando as stopwords.
+    :param text: o texto
+    :return: a lista de termos
+    """
+    texto = unicodedata.normalize('NFKD', text.lower())
+    texto = ''.join(caractere for caractere in texto if not unicodedata.combining(caractere))
+
+    return [termo for termo in _TOKEN.findall(texto) if termo not in STOPWORDS]
+
+
+class BM25Index:
+    def __init__(self, documents: Iterable[Tuple[str, str]], k1: float = 1.5, b: float = 0.75):
+        """
+        Índice invertido em memória com pontuação BM25. Para cada termo, guarda os documentos em que ele aparece e sua
+        frequência em cada um, de modo que uma busca percorre apenas os documentos que contêm os termos da query.
+        :param documents: os documentos indexados, como tuplas (id, texto)
+        :param k1: parâmetro de saturação da frequência dos termos
+        :param b: parâmetro de normalização pelo tamanho do documento
+        """
+        self.k1 = k1
+        self.b = b
+        self.ids: List[str] = []
+
+        postings: Dict[str, Tuple[List[int], List[int]]] = {}
+        tamanhos = []
+        for posicao, (doc_id, texto) in enumerate(documents):
+            termos = tokenize(texto)
+            self.ids.append(doc_id)
+            tamanhos.append(len(termos))
+            for termo, frequencia in Counter(termos).items():
+                docs, frequencias = postings.setdefault(termo, ([], []))
+                docs.append(posicao)
+                frequencias.append(frequencia)
+
+        n = len(self.ids)
+        self._tamanhos = np.array(tamanhos, dtype=np.float32)
+        tamanho_medio = float(self._tamanhos.mean()) if n else 0.0
+        normalizacao = k1 * (1 - b + b * self._tamanhos / tamanho_medio) if n and tamanho_medio else np.full(n, k1)
+
+        # Pré-calculando, para cada termo, os documentos (em ordem) e a contribuição BM25 do termo em cada um
+        self._postings: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        self._idf: Dict[str, float] = {}
+        for termo, (docs, frequencias) in postings.items():
+            docs = np.array(docs, dtype=np.int64)
+            frequencias = np.array(frequencias, dtype=np.float32)
+            idf = float(np.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5)))
+            self._idf[termo] = idf
+            self._postings[termo] = (docs, idf * frequencias * (k1 + 1) / (frequencias + normalizacao[docs]))
+
+        # Peso de um termo desconhecido: o maior idf possível, de um termo que não aparece em nenhum documento
+        self._idf_desconhecido = float(np.log(1 + (n + 0.5) / 0.5))
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def search(self, query: str, top_k: int = 3) -> List[Tuple[str, float, float]]:
+        """
+        Busca os documentos mais relevantes para a query.
+        :param query: a query
+        :param top_k: o número de documentos retornados
+        :return: os documentos encontrados, em ordem decrescente de score, como tuplas (id, score BM25, cobertura). A
+        cobertura é a fração do peso (idf) dos termos da query presentes no documento, entre 0 e 1.
+        """
+        termos = list(dict.fromkeys(tokenize(query)))
+        if not termos or not self.ids:
+            return []
+
+        scores = np.zeros(len(self.ids), dtype=np.float32)
+        for termo in termos:
+            if termo in self._postings:
+                docs, contribuicoes = self._postings[termo]
+                scores[docs] += contribuicoes
+
+        encontrados = np.flatnonzero(scores)
+        if not len(encontrados):
+            return []
+
+        k = min(top_k, len(encontrados))
+        topo = encontrados[np.argpartition(scores[encontrados], len(encontrados) - k)[-k:]]
+        topo = topo[np.argsort(-scores[topo])]
+
+        # Calculando a cobertura dos termos da query em cada documento retornado
+        pesos = {termo: self._idf.get(termo, self._idf_desconhecido) for termo in termos}
+        peso_total = sum(pesos.values())
+        resultados = []
+        for posicao in topo:
+            peso_presente = 0.0
+            for termo in termos:
+                if termo in self._postings:
+                    docs = self._postings[termo][0]
+                    i = np.searchsorted(docs, posicao)
+                    if i < len(docs) and docs[i] == posicao:
+                        peso_presente += pesos[termo]
+            resultados.append((self.ids[posicao], float(scores[posicao]), peso_presente / peso_total))
+
+        return resultados
+
+    def is_confident(self, query: str, results: List[Tuple[str, float, float]], min_coverage: float = 0.8,
+                     max_terms: int = 4) -> bool:
+        """
+        Indica se o resultado lexical é confiável o suficiente para dispensar a busca por embeddings: a query é curta
+        (uma busca por palavras-chave, e não uma pergunta em linguagem natural) e o melhor documento contém quase todo
+        o peso dos seus termos.
+        :param query: a query
+        :param results: o resultado de search para a query
+        :param min_coverage: a cobertura mínima do melhor documento
+        :param max_terms: o número máximo de termos da query
+        :return: True caso o resultado lexical seja confiável
+        """
+        termos = set(tokenize(query))
+
+        return bool(results) and 0 < len(termos) <= max_terms and results[0][2] >= min_coverage
@@ -0,0 +1,119 @@
+from data_indexing.indexing_tools import get_index, invalidate_index, create_storage_context, get_index_nodes
+from data_indexing.manifest import load_manifest, save_manifest
+from llama_index.core import VectorStoreIndex
+from typing import Dict, List
+import argparse
+import shutil
+import glob
+import time
+import os
+
+
+def _tamanho_do_diretorio(path: str) -> int:
+    """
+    Calcula o tamanho total dos arquivos de um diretório.
+    :param path: o caminho do diretório
+    :return: o tamanho, em bytes
+    """
+    return sum(os.path.getsize(os.path.join(raiz, nome)) for raiz, _, nomes in os.walk(path) for nome in nomes)
+
+
+def convert_index(persist_dir: str, backup: bool = True) -> Dict[str, float]:
+    """
+    Converte um índice persistido para o formato binário ('binary'), reaproveitando os embeddings já calculados, sem
+    chamadas à API. O índice convertido é escrito em um diretório temporário e só então substitui o original, que é
+    mantido em {persist_dir}.bak caso backup seja True. O manifesto é atualizado, de modo que as próximas indexações
+    incrementais com --vector-store binary continuem de onde o índice parou.
+    :param persist_dir: o diretório onde o índice foi persistido
+    :param backup: se o índice original deve ser mantido em {persist_dir}.bak
+    :return: um resumo da conversão, com o número de nós e o tamanho do índice antes e depois
+    """
+    inicio = time.perf_counter()
+    index = get_index(persist_dir)
+    if index.vector_store.stores_text:
+        raise ValueError(f"O índice em {persist_dir} já guarda os textos no vector store.")
+
+    # Copiando os nós com os embeddings armazenados, para que nada precise ser embedado novamente
+    nodes = get_index_nodes(index)
+    for node in nodes:
+        node.embedding = index.vector_store.get(node.node_id)
+
+    convertido = VectorStoreIndex(nodes=[], storage_context=create_storage_context('binary'))
+    convertido.insert_nodes(nodes)
+
+    temporario = os.path.normpath(persist_dir) + '.convertendo'
+    shutil.rmtree(temporario, ignore_errors=True)
+    convertido.storage_context.persist(persist_dir=temporario)
+
+    # Registrando o novo formato no manifesto. Índices sem manifesto são reconstruídos na próxima indexação.
+    manifesto = load_manifest(persist_dir)
+    if manifesto is not None:
+        manifesto['config']['vector_store'] = 'binary'
+        manifesto['config'].pop('nlist', None)
+        save_manifest(temporario, manifesto)
+
+    resumo = {'nos': len(nodes), 'bytes_antes': _tamanho_do_diretorio(persist_dir),
+              'bytes_depois': _tamanho_do_diretorio(temporario)}
+
+    # Substituindo o índice original pelo convertido
+    if backup:
+        shutil.rmtree(os.path.normpath(persist_dir) + '.bak', ignore_errors=True)
+        os.replace(persist_dir, os.path.normpath(persist_dir) + '.bak')
+    else:
+        shutil.rmtree(persist_dir)
+    os.replace(temporario, persist_dir)
+    invalidate_index(persist_dir)
+
+    resumo['segundos'] = time.perf_counter() - inicio
+
+    return resumo
+
+
+def _diretorios_de_indices(padrao: str) -> List[str]:
+    """
+    Lista os diretórios de índices persistidos que correspondem ao padrão, ignorando backups e conversões em andamento.
+    :param padrao: o padrão dos diretórios (por exemplo, results/*)
+    :return: os diretórios encontrados, em ordem
+    """
+    return sorted(diretorio for diretorio in glob.glob(padrao)
+                  if os.path.exists(os.path.join(diretorio, 'index_store.json'))
+                  and not diretorio.endswith(('.bak', '.convertendo')))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Conversão dos índices para o formato binário")
+    parser.add_argument(
+        "persist_dirs",
+        nargs="*",
+        type=str,
+        help="Os diretórios dos índices a serem convertidos (por padrão, todos os índices em results/).",
+    )
+
+    parser.add_argument(
+        "--no-backup",
+        action="store_true",
+        help="Apaga os índices originais, em vez de mantê-los em <diretório>.bak.",
+    )
+
+    args = parser.parse_args()
+    diretorios = args.persist_dirs or _diretorios_de_indices('results/*')
+    if not diretorios:
+        print("Nenhum índice encontrado.")
+        return
+
+    for diretorio in diretorios:
+        try:
+            resumo = convert_index(diretorio, backup=not args.no_backup)
+        except ValueError as erro:
+            print(f"{diretorio}: ignorado ({erro})")
+            continue
+
+        print(f"{diretorio}: {resumo['nos']} nós convertidos em {resumo['segundos']:.1f}s "
+              f"({resumo['bytes_antes'] / 1e6:.1f} MB -> {resumo['bytes_depois'] / 1e6:.1f} MB)")
+
+    print("Para continuar indexando os índices convertidos de forma incremental, utilize --vector-store binary no "
+          "run_indexing.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+import os
+import asyncio
+import sqlite3
+import hashlib
+import threading
+from array import array
+from concurrent.futures import Future
+from typing import Any, Dict, List, Optional, Tuple
+
+from llama_index.core import Settings
+from llama_index.core.base.embeddings.base import BaseEmbedding, Embedding
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+
+from data_indexing.retrieval_cache import normalize_query
+from data_indexing.single_flight import SingleFlight
+
+# Embeddings em andamento: textos e queries idênticos embedados ao mesmo tempo compartilham uma única requisição ao
+# modelo de embedding
+_embeddings_em_andamento = SingleFlight('embedding')
+
+
+class EmbeddingCache:
+    def __init__(self, path: str = 'results/embedding_cache.sqlite'):
+        """
+        Classe que armazena embeddings em disco, em um banco SQLite, para que textos já embedados não precisem ser
+        enviados novamente ao modelo de embedding, inclusive após reiniciar a aplicação. Os embeddings são salvos em
+        formato binário compacto (float32) e indexados pelo nome do modelo e pelo hash do texto. O banco opera em modo
+        WAL, podendo ser compartilhado com segurança por vários processos.
+        :param path: caminho do arquivo SQLite do cache
+        """
+        self.path = path
+
+        diretorio = os.path.dirname(path)
+        if diretorio and not os.path.exists(diretorio):
+            os.makedirs(diretorio)
+
+        # Conexões SQLite não podem ser compartilhadas entre threads, então cada thread possui a sua
+        self._local = threading.local()
+
+        conexao = self._conexao()
+        conexao.execute('PRAGMA journal_mode=WAL')
+        conexao.execute('CREATE TABLE IF NOT EXISTS embeddings (model TEXT NOT NULL, text_hash BLOB NOT NULL, '
+                        'vector BLOB NOT NULL, PRIMARY KEY (model, text_hash)) WITHOUT ROWID')
+        conexao.commit()
+
+    def _conexao(self) -> sqlite3.Connection:
+        """
+        Retorna a conexão da thread atual com o banco, criando-a caso necessário.
+        :return: a conexão SQLite
+        """
+        conexao = getattr(self._local, 'conexao', None)
+        if conexao is None:
+            # Aguardando até 30 segundos caso outro processo esteja escrevendo no banco
+            conexao = sqlite3.connect(self.path, timeout=30)
+            conexao.execute('PRAGMA synchronous=NORMAL')
+            self._local.conexao = conexao
+
+        return conexao
+
+    @staticmethod
+    def _hash(text: str) -> bytes:
+        """
+        Calcula o hash do texto, utilizado como chave do embedding.
+        :param text: o texto
+        :return: o hash SHA-256 do texto
+        """
+        return hashlib.sha256(text.encode('utf-8')).digest()
+
+    def get_many(self, model: str, texts: List[str]) -> Dict[str, Embedding]:
+        """
+        Busca os embeddings armazenados de vários textos de uma só vez.
+        :param model: nome do modelo de embedding
+        :param texts: os textos cujos embeddings serão buscados
+        :return: dicionário com os embeddings encontrados, indexados pelo texto
+        """
+        hashes = {self._hash(texto): texto for texto in texts}
+        encontrados = {}
+
+        # Consultando em lotes, respeitando o limite de parâmetros do SQLite
+        chaves = list(hashes)
+        for i in range(0, len(chaves), 500):
+            lote = chaves[i:i + 500]
+            linhas = self._conexao().execute(
+                f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN "
+                f"({', '.join('?' * len(lote))})", [model, *lote])
+
+            for text_hash, vetor in linhas:
+                embedding = array('f')
+                embedding.frombytes(vetor)
+                encontrados[hashes[text_hash]] = embedding.tolist()
+
+        return encontrados
+
+    def put_many(self, model: str, embeddings: Dict[str, Embedding]) -> None:
+        """
+        Armazena os embeddings de vários textos em uma única transação.
+        :param model: nome do modelo de embedding
+        :param embeddings: dicionário com os embeddings, indexados pelo texto
+        :return: None
+        """
+        conexao = self._conexao()
+        with conexao:
+            conexao.executemany('INSERT OR REPLACE INTO embeddings (model, text_hash, vector) VALUES (?, ?, ?)',
+                                [(model, self._hash(texto), array('f', embedding).tobytes())
+                                 for texto, embedding in embeddings.items()])
+
+
+class CachedEmbedding(BaseEmbedding):
+    """
+    Modelo de embedding que consulta o EmbeddingCache antes de chamar o modelo de embedding original. Apenas os textos
+    que não estão no cache são enviados ao modelo original, e os embeddings obtidos são armazenados no cache. As queries
+    são normalizadas para a consulta ao cache, para que variações irrelevantes da mesma pergunta reaproveitem o embedding,
+    mas o modelo original recebe a query sem alterações. Um texto que já está sendo embedado em outra chamada não é
+    enviado novamente: o embedding em andamento é aguardado.
+    """
+
+    embed_model: BaseEmbedding = Field(description="O modelo de embedding original.")
+    _cache: EmbeddingCache = PrivateAttr()
+
+    def __init__(self, embed_model: BaseEmbedding, cache: EmbeddingCache, **kwargs: Any):
+        super().__init__(embed_model=embed_model, model_name=embed_model.model_name,
+                         embed_batch_size=embed_model.embed_batch_size, **kwargs)
+        self._cache = cache
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "CachedEmbedding"
+
+    def _chave_modelo(self, tipo: str) -> str:
+        """
+        Retorna o nome do modelo utilizado como chave no cache, diferenciando embeddings de queries e de textos.
+        :param tipo: 'query' ou 'text'
+        :return: a chave do modelo
+        """
+        return f"{self.embed_model.class_name()}:{self.model_name}:{tipo}"
+
+    def _get_query_embedding(self, query: str) -> Embedding:
+        # A query normalizada é apenas a chave do cache: o modelo recebe a query original
+        chave = normalize_query(query)
+        modelo = self._chave_modelo('query')
+
+        encontrado = self._cache.get_many(modelo, [chave])
+        if chave in encontrado:
+            return encontrado[chave]
+
+        def embedar() -> Embedding:
+            embedding = self.embed_model.get_query_embedding(query)
+            self._cache.put_many(modelo, {chave: embedding})
+            return embedding
+
+        return _embeddings_em_andamento.do((modelo, chave), embedar)
+
+    async def _aget_query_embedding(self, query: str) -> Embedding:
+        chave = normalize_query(query)
+        modelo = self._chave_modelo('query')
+
+        encontrado = self._cache.get_many(modelo, [chave])
+        if chave in encontrado:
+            return encontrado[chave]
+
+        async def embedar() -> Embedding:
+            embedding = await self.embed_model.aget_query_embedding(query)
+            self._cache.put_many(modelo, {chave: embedding})
+            return embedding
+
+        return await _embeddings_em_andamento.ado((modelo, chave), embedar)
+
+    def _get_text_embedding(self, text: str) -> Embedding:
+        return self._get_text_embeddings([text])[0]
+
+    async def _aget_text_embedding(self, text: str) -> Embedding:
+        return (await self._aget_text_embeddings([text]))[0]
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[Embedding]:
+        modelo = self._chave_modelo('text')
+        encontrados = self._cache.get_many(modelo, texts)
+
+        # Embedando, em lote, apenas os textos que não estão no cache nem sendo embedados em outra chamada
+        proprios, aguardados = self._reservar(modelo, texts, encontrados)
+        if proprios:
+            try:
+                novos = dict(zip(proprios, self.embed_model.get_text_embedding_batch(list(proprios))))
+                self._cache.put_many(modelo, novos)
+            except BaseException as e:
+                self._liberar(modelo, proprios, error=e)
+                raise
+            self._liberar(modelo, proprios, novos)
+            encontrados.update(novos)
+
+        for texto, future in aguardados.items():
+            encontrados[texto] = future.result()
+
+        return [encontrados[texto] for texto in texts]
+
+    async def _aget_text_embeddings(self, texts: List[str]) -> List[Embedding]:
+        modelo = self._chave_modelo('text')
+        encontrados = self._cache.get_many(modelo, texts)
+
+        proprios, aguardados = self._reservar(modelo, texts, encontrados)
+        if proprios:
+            try:
+                novos = dict(zip(proprios, await self.embed_model.aget_text_embedding_batch(list(proprios))))
+                self._cache.put_many(modelo, novos)
+            except BaseException as e:
+                self._liberar(modelo, proprios, error=e)
+                raise
+            self._liberar(modelo, proprios, novos)
+            encontrados.update(novos)
+
+        for texto, future in aguardados.items():
+            encontrados[texto] = await asyncio.wrap_future(future)
+
+        return [encontrados[texto] for texto in texts]
+
+    @staticmethod
+    def _reservar(modelo: str, texts: List[str], encontrados: Dict[str, Embedding]) -> Tuple[Dict[str, Future],
+                                                                                             Dict[str, Future]]:
+        """
+        Registra os textos que não estão no cache como embeddings em andamento.
+        :param modelo: a chave do modelo
+        :param texts: os textos
+        :param encontrados: os embeddings encontrados no cache
+        :return: os textos que devem ser embedados por esta chamada e os textos já em andamento em outras chamadas,
+        com os seus futures
+        """
+        proprios, aguardados = {}, {}
+        for texto in dict.fromkeys(texto for texto in texts if texto not in encontrados):
+            future, leader = _embeddings_em_andamento.begin((modelo, texto))
+            (proprios if leader else aguardados)[texto] = future
+
+        return proprios, aguardados
+
+    @staticmethod
+    def _liberar(modelo: str, proprios: Dict[str, Future], novos: Optional[Dict[str, Embedding]] = None,
+                 error: Optional[BaseException] = None) -> None:
+        """
+        Encerra os embeddings em andamento desta chamada, entregando os resultados (ou o erro) às demais chamadas.
+        :param modelo: a chave do modelo
+        :param proprios: os textos embedados por esta chamada, com os seus futures
+        :param novos: os embeddings obtidos
+        :param error: o erro ocorrido (None em caso de sucesso)
+        :return: None
+        """
+        for texto, future in proprios.items():
+            _embeddings_em_andamento.finish((modelo, texto), future, None if error else novos[texto], error)
+
+
+def configure_embedding_cache(path: str = 'results/embedding_cache.sqlite',
+                              embed_model: Optional[BaseEmbedding] = None) -> CachedEmbedding:
+    """
+    Configura o modelo de embedding global do LlamaIndex para utilizar o cache de embeddings em disco. Deve ser chamada
+    antes de carregar ou criar os índices.
+    :param path: caminho do arquivo SQLite do cache
+    :param embed_model: o modelo de embedding original (por padrão, o modelo configurado no LlamaIndex)
+    :return: o modelo de embedding com cache
+    """
+    embed_model = embed_model or Settings.embed_model
+
+    # Evitando envolver o modelo em mais de uma camada de cache
+    if isinstance(embed_model, CachedEmbedding):
+        embed_model = embed_model.embed_model
+
+    cached_embed_model = CachedEmbedding(embed_model, EmbeddingCache(path))
+    Settings.embed_model = cached_embed_model
+
+    return cached_embed_model
@@ -0,0 +1,30 @@
+from typing import Dict, Hashable, List, Optional, Sequence, Tuple
+
+# Constante da fusão por posição recíproca. Valores maiores diminuem a diferença entre as primeiras posições de cada
+# ranking.
+RRF_K = 60
+
+
+def reciprocal_rank_fusion(rankings: Dict[str, Sequence[Hashable]], weights: Optional[Dict[str, float]] = None,
+                           k: int = RRF_K) -> List[Tuple[Hashable, float, List[str]]]:
+    """
+    Combina vários rankings com a fusão por posição recíproca (RRF): cada item recebe, de cada ranking em que aparece,
+    peso / (k + posição), e os itens são ordenados pela soma. A fusão não depende da escala dos scores de cada ranking,
+    o que permite combinar buscas em índices ou com métodos diferentes.
+    :param rankings: os rankings a serem combinados, indexados pelo nome do ranking, com os itens em ordem decrescente
+    de relevância
+    :param weights: o peso de cada ranking (por padrão, 1 para todos)
+    :param k: a constante da fusão
+    :return: os itens combinados, em ordem decrescente de score, como tuplas (item, score, rankings em que aparece)
+    """
+    weights = weights or {}
+    scores: Dict[Hashable, float] = {}
+    origens: Dict[Hashable, List[str]] = {}
+
+    for nome, ranking in rankings.items():
+        peso = weights.get(nome, 1.0)
+        for posicao, item in enumerate(ranking, start=1):
+            scores[item] = scores.get(item, 0.0) + peso / (k + posicao)
+            origens.setdefault(item, []).append(nome)
+
+    return sorted(((item, score, origens[item]) for item, score in scores.items()), key=lambda x: x[1], reverse=True)
@@ -1,24 +1,343 @@
-from llama_index.core import VectorStoreIndex, SimpleDirectoryReader, StorageContext, load_index_from_storage
+from llama_index.core import VectorStoreIndex, SimpleDirectoryReader, StorageContext, load_index_from_storage, Settings
 from llama_index.core.indices.base import BaseIndex
 from llama_index.core.retrievers import VectorIndexRetriever
 from llama_index.core.query_engine import RetrieverQueryEngine
 from llama_index.core.node_parser import SentenceSplitter
-from llama_index.core.schema import QueryBundle
+from llama_index.core.schema import BaseNode, QueryBundle, MetadataMode
 import shutil
-from typing import List
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+import time
+from typing import Dict, List, Optional, Tuple
 
 import os
 from dotenv import load_dotenv
+from data_indexing.retrieval_cache import RetrievalCache, normalize_query
+from data_indexing.single_flight import SingleFlight
+from data_indexing.fusion import reciprocal_rank_fusion
+from data_indexing.bm25 import BM25Index
+from data_indexing.manifest import empty_manifest, file_hash, load_manifest, save_manifest, text_hash
+from data_indexing.numpy_vector_store import NumpyVectorStore
+from data_indexing.ivf_vector_store import IVFVectorStore
+from data_indexing.binary_vector_store import BinaryVectorStore
+from chat.tracing import span
 
 load_dotenv(".env")
 
+# Registro dos índices já carregados no processo: cada diretório persistido é desserializado uma única vez e os
+# retrievers são reaproveitados entre as chamadas das ferramentas do agente.
+_indices_carregados: Dict[str, BaseIndex] = {}
+_retrievers_carregados: Dict[Tuple[str, int], RetrieverQueryEngine] = {}
+_locks_indices: Dict[str, threading.Lock] = {}
+_lock_registro = threading.Lock()
 
-def index_pdf(path_to_pdf: str = './data/pdf', persist_dir: str = 'results/pdf') -> None:
+# Assinatura (nomes, tamanhos e datas de modificação dos arquivos) de cada índice carregado, utilizada para perceber
+# que o índice foi reconstruído por outro processo, e o instante da última verificação de cada índice
+_assinaturas_indices: Dict[str, Tuple] = {}
+_ultima_verificacao: Dict[str, float] = {}
+
+# Intervalo mínimo, em segundos, entre duas verificações da assinatura de um mesmo índice
+INTERVALO_VERIFICACAO_INDICE = 5.0
+
+# Cache dos resultados das recuperações, compartilhado por todos os índices
+_retrieval_cache = RetrievalCache()
+
+# Recuperações em andamento: perguntas idênticas feitas ao mesmo tempo (por exemplo, por vários alunos da mesma turma)
+# compartilham uma única recuperação
+_recuperacoes_em_andamento = SingleFlight('retrieval')
+
+# Índices lexicais (BM25) de cada índice carregado, junto ao índice a partir do qual foram construídos
+_bm25_carregados: Dict[str, Tuple[BaseIndex, BM25Index]] = {}
+
+# Modos de recuperação: 'vector' (apenas a busca por embeddings) ou 'hybrid' (a busca lexical responde sozinha quando
+# é confiável, sem embedar a query, e caso contrário é combinada com a busca por embeddings)
+MODOS_RECUPERACAO = ('vector', 'hybrid')
+_modo_recuperacao = 'vector'
+
+# Critérios de confiança da busca lexical: cobertura mínima dos termos da query pelo melhor documento e número
+# máximo de termos da query
+_cobertura_minima = 0.8
+_max_termos_lexicos = 4
+
+# Tamanho dos lotes de textos enviados ao modelo de embedding durante a indexação
+_embed_batch_size = 64
+
+# Número máximo de requisições de embedding simultâneas, somando todos os índices sendo construídos no processo. Quando
+# o limite é atingido, a divisão de novos lotes aguarda (backpressure) até que uma requisição termine.
+_embed_concurrency = 4
+_embed_semaphore = threading.BoundedSemaphore(_embed_concurrency)
+
+
+# Tipos de vector store suportados: 'numpy' (busca exata em uma matriz contígua de float32), 'ivf' (busca aproximada
+# por arquivo invertido, para índices grandes), 'binary' (busca exata, com embeddings e nós persistidos em arquivos
+# binários mapeados em memória, sem docstore) ou 'simple' (o vector store padrão do LlamaIndex). O tipo é escolhido
+# na indexação e registrado no manifesto do índice.
+VECTOR_STORES = ('numpy', 'ivf', 'binary', 'simple')
+
+# Tipo de vector store utilizado nos índices criados quando a indexação não indica um tipo
+_vector_store_padrao = 'numpy'
+
+# Parâmetros da busca aproximada: o número de clusters dos índices criados (None para a raiz do número de nós) e o
+# número de clusters visitados por consulta (None para manter o valor salvo em cada índice)
+_ivf_nlist: Optional[int] = None
+_ivf_nprobe: Optional[int] = None
+
+
+def configure_vector_store(vector_store: str = 'numpy', nlist: Optional[int] = None,
+                           nprobe: Optional[int] = None) -> None:
+    """
+    Configura o tipo de vector store utilizado nos índices criados a partir de então e os parâmetros da busca
+    aproximada.
+    :param vector_store: o tipo de vector store ('numpy', 'ivf', 'binary' ou 'simple')
+    :param nlist: o número de clusters dos índices 'ivf' criados (None para a raiz do número de nós)
+    :param nprobe: o número de clusters visitados por consulta nos índices 'ivf' (None para o valor salvo no índice).
+    Valores maiores aumentam o recall e o tempo de cada consulta.
+    :return: None
+    """
+    if vector_store not in VECTOR_STORES:
+        raise ValueError(f"Vector store {vector_store} inválido. Utilize um dos valores: {VECTOR_STORES}.")
+
+    global _vector_store_padrao, _ivf_nlist, _ivf_nprobe
+    _vector_store_padrao = vector_store
+    _ivf_nlist = nlist
+    _ivf_nprobe = nprobe
+
+
+def create_storage_context(vector_store: str, persist_dir: Optional[str] = None) -> StorageContext:
+    """
+    Cria o StorageContext de um índice com o tipo de vector store indicado.
+    :param vector_store: o tipo de vector store ('numpy', 'ivf', 'binary' ou 'simple')
+    :param persist_dir: o diretório de onde o índice será carregado (None para um índice novo)
+    :return: o StorageContext
+    """
+    if vector_store == 'simple':
+        return StorageContext.from_defaults(persist_dir=persist_dir)
+
+    if vector_store == 'numpy':
+        store = NumpyVectorStore.from_persist_dir(persist_dir) if persist_dir else NumpyVectorStore()
+        return StorageContext.from_defaults(persist_dir=persist_dir, vector_store=store)
+
+    if vector_store == 'ivf':
+        store = IVFVectorStore.from_persist_dir(persist_dir) if persist_dir else IVFVectorStore(nlist=_ivf_nlist)
+        if _ivf_nprobe is not None:
+            store.nprobe = _ivf_nprobe
+        return StorageContext.from_defaults(persist_dir=persist_dir, vector_store=store)
+
+    if vector_store == 'binary':
+        store = BinaryVectorStore.from_persist_dir(persist_dir) if persist_dir else BinaryVectorStore()
+        return StorageContext.from_defaults(persist_dir=persist_dir, vector_store=store)
+
+    raise ValueError(f"Vector store {vector_store} inválido. Utilize um dos valores: {VECTOR_STORES}.")
+
+
+def configure_indexing_embeddings(batch_size: int = 64, concurrency: int = 4) -> None:
+    """
+    Configura o envio dos embeddings durante a indexação.
+    :param batch_size: número de textos enviados em cada requisição ao modelo de embedding
+    :param concurrency: número máximo de requisições de embedding simultâneas no processo
+    :return: None
+    """
+    if batch_size < 1 or concurrency < 1:
+        raise ValueError("O tamanho do lote e a concorrência dos embeddings devem ser maiores que zero.")
+
+    global _embed_batch_size, _embed_concurrency, _embed_semaphore
+    _embed_batch_size = batch_size
+    _embed_concurrency = concurrency
+    _embed_semaphore = threading.BoundedSemaphore(concurrency)
+
+    # Fazendo com que o modelo de embedding (e os modelos que ele envolve, como no cache de embeddings) não divida
+    # novamente os lotes em requisições menores
+    embed_model = Settings.embed_model
+    while embed_model is not None:
+        embed_model.embed_batch_size = batch_size
+        embed_model = getattr(embed_model, 'embed_model', None)
+
+
+def _embed_nodes(nodes: List[BaseNode]) -> int:
+    """
+    Calcula o embedding dos nós que ainda não o possuem, dividindo os textos em lotes que são enviados ao modelo de
+    embedding em paralelo. O número de requisições simultâneas é limitado pelo semáforo compartilhado por todas as
+    indexações do processo.
+    :param nodes: os nós a serem embedados
+    :return: o número de nós embedados
+    """
+    pendentes = [node for node in nodes if node.embedding is None]
+    if not pendentes:
+        return 0
+
+    embed_model = Settings.embed_model
+    semaforo = _embed_semaphore
+
+    def embedar_lote(lote: List[BaseNode]) -> None:
+        try:
+            textos = [node.get_content(metadata_mode=MetadataMode.EMBED) for node in lote]
+            for node, embedding in zip(lote, embed_model.get_text_embedding_batch(textos)):
+                node.embedding = embedding
+        finally:
+            semaforo.release()
+
+    with ThreadPoolExecutor(max_workers=_embed_concurrency) as executor:
+        futures = []
+        for i in range(0, len(pendentes), _embed_batch_size):
+            # Aguardando uma vaga antes de enviar o próximo lote
+            semaforo.acquire()
+            futures.append(executor.submit(embedar_lote, pendentes[i:i + _embed_batch_size]))
+
+        # Propagando eventuais erros das requisições
+        for future in futures:
+            future.result()
+
+    return len(pendentes)
+
+
+def index_directory(path_to_docs: str, persist_dir: str, chunk_size: int = 256, chunk_overlap: int = 0,
+                    vector_store: Optional[str] = None) -> Dict[str, float]:
+    """
+    Indexa, de forma incremental, os documentos em path_to_docs e persiste o índice em persist_dir. O índice mantém um
+    manifesto com o hash de cada arquivo fonte e de cada chunk: arquivos inalterados são ignorados, apenas os chunks
+    novos ou alterados são embedados e os chunks que deixaram de existir são removidos do índice.
+    :param path_to_docs: o caminho para os documentos
+    :param persist_dir: o diretório onde o índice será persistido
+    :param chunk_size: o tamanho dos chunks em que os documentos serão divididos
+    :param chunk_overlap: a sobreposição entre chunks consecutivos
+    :param vector_store: o tipo de vector store do índice (por padrão, o tipo configurado em configure_vector_store)
+    :return: um resumo da indexação, com o número de fontes e chunks processados
+    """
+    vector_store = vector_store or _vector_store_padrao
+    config = {'chunk_size': chunk_size, 'chunk_overlap': chunk_overlap, 'vector_store': vector_store}
+    if vector_store == 'ivf':
+        config['nlist'] = _ivf_nlist
+    splitter = SentenceSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    resumo = {'fontes_inalteradas': 0, 'fontes_atualizadas': 0, 'fontes_removidas': 0, 'chunks_embedados': 0,
+              'chunks_reaproveitados': 0, 'chunks_removidos': 0, 'segundos': 0.0, 'segundos_embedding': 0.0}
+    inicio = time.perf_counter()
+
+    # Carregando o índice e o manifesto existentes. Se não houver manifesto, ou se as configurações de indexação
+    # mudaram, o índice é reconstruído do zero.
+    manifesto = load_manifest(persist_dir) if os.path.exists(persist_dir) else None
+    if manifesto is not None and manifesto['config'] == config:
+        index = get_index(persist_dir)
+    else:
+        manifesto = empty_manifest(config)
+        index = VectorStoreIndex(nodes=[], storage_context=create_storage_context(vector_store))
+
+    # Calculando o hash de cada arquivo fonte
+    arquivos = [str(arquivo) for arquivo in SimpleDirectoryReader(path_to_docs).input_files]
+    hashes = {arquivo: file_hash(arquivo) for arquivo in arquivos}
+    fontes = manifesto['fontes']
+
+    # Removendo do índice as fontes que deixaram de existir
+    for arquivo in [arquivo for arquivo in fontes if arquivo not in hashes]:
+        for doc_id in fontes[arquivo]['doc_ids']:
+            index.delete_ref_doc(doc_id, delete_from_docstore=True)
+        resumo['chunks_removidos'] += len(fontes[arquivo]['chunks'])
+        resumo['fontes_removidas'] += 1
+        del fontes[arquivo]
+
+    for arquivo in arquivos:
+        fonte_antiga = fontes.get(arquivo)
+
+        # Ignorando as fontes que não mudaram desde a última indexação
+        if fonte_antiga is not None and fonte_antiga['hash'] == hashes[arquivo]:
+            resumo['fontes_inalteradas'] += 1
+            continue
+
+        # Dividindo a fonte em chunks e identificando cada chunk pelo hash do texto que é embedado. Chunks repetidos
+        # dentro da mesma fonte são diferenciados pela ordem de ocorrência.
+        documents = SimpleDirectoryReader(input_files=[arquivo], filename_as_id=True).load_data()
+        nodes = splitter.get_nodes_from_documents(documents)
+        chunks_antigos = fonte_antiga['chunks'] if fonte_antiga is not None else {}
+        chunks = {}
+        for node in nodes:
+            hash_chunk = text_hash(node.get_content(metadata_mode=MetadataMode.EMBED))
+            ocorrencia = 0
+            while f"{hash_chunk}:{ocorrencia}" in chunks:
+                ocorrencia += 1
+            chave = f"{hash_chunk}:{ocorrencia}"
+
+            # Reaproveitando o id e o embedding dos chunks que já estavam no índice
+            if chave in chunks_antigos:
+                node.id_ = chunks_antigos[chave]
+                node.embedding = _embedding_armazenado(index, node.id_)
+
+            if node.embedding is not None:
+                resumo['chunks_reaproveitados'] += 1
+            chunks[chave] = node.node_id
+
+        resumo['chunks_removidos'] += len(set(chunks_antigos) - set(chunks))
+
+        # Embedando, em lotes paralelos, apenas os chunks novos ou alterados
+        inicio_embedding = time.perf_counter()
+        resumo['chunks_embedados'] += _embed_nodes(nodes)
+        resumo['segundos_embedding'] += time.perf_counter() - inicio_embedding
+
+        # Substituindo os documentos antigos da fonte pelos novos, já com seus embeddings
+        if fonte_antiga is not None:
+            for doc_id in fonte_antiga['doc_ids']:
+                index.delete_ref_doc(doc_id, delete_from_docstore=True)
+        index.insert_nodes(nodes)
+
+        fontes[arquivo] = {'hash': hashes[arquivo], 'doc_ids': [doc.doc_id for doc in documents], 'chunks': chunks}
+        resumo['fontes_atualizadas'] += 1
+
+    # Persistindo o índice e o manifesto apenas se algo mudou
+    if resumo['fontes_atualizadas'] or resumo['fontes_removidas'] or not os.path.exists(persist_dir):
+        index.storage_context.persist(persist_dir=persist_dir)
+        save_manifest(persist_dir, manifesto)
+
+        # Descartando a versão antiga do índice que possa estar carregada em memória
+        invalidate_index(persist_dir)
+
+    resumo['segundos'] = time.perf_counter() - inicio
+
+    return resumo
+
+
+def _embedding_armazenado(index: VectorStoreIndex, node_id: str) -> Optional[List[float]]:
+    """
+    Busca, no vector store do índice, o embedding já calculado de um nó.
+    :param index: o índice
+    :param node_id: o id do nó
+    :return: o embedding do nó, ou None caso o vector store não permita recuperá-lo
+    """
+    try:
+        return index.vector_store.get(node_id)
+    except (AttributeError, KeyError, NotImplementedError):
+        return None
+
+
+def get_index_nodes(index: VectorStoreIndex) -> List[BaseNode]:
+    """
+    Retorna todos os nós do índice, do vector store quando ele guarda os textos ou, caso contrário, do docstore.
+    :param index: o índice
+    :return: os nós do índice
+    """
+    if index.vector_store.stores_text:
+        return index.vector_store.get_nodes()
+
+    return index.docstore.get_nodes(list(index.index_struct.nodes_dict.values()))
+
+
+def _texto_do_no(index: VectorStoreIndex, node_id: str) -> str:
+    """
+    Retorna o texto de um nó do índice, do vector store quando ele guarda os textos ou, caso contrário, do docstore.
+    :param index: o índice
+    :param node_id: o id do nó
+    :return: o texto do nó
+    """
+    if index.vector_store.stores_text:
+        return index.vector_store.get_node(node_id).get_content()
+
+    return index.docstore.get_node(node_id).get_content()
+
+
+def index_pdf(path_to_pdf: str = './data/pdf', persist_dir: str = 'results/pdf') -> Dict[str, float]:
     """
     Indexa os documentos PDF em path_to_pdf e persiste o índice em persist_dir.
     :param path_to_pdf: o caminho para os documentos PDF
     :param persist_dir: o diretório onde o índice será persistido
-    :return: None
+    :return: um resumo da indexação
     """
 
     # Copiando o PDF para um diretório que contenha só ele, para evitar que outros arquivos sejam indexados
@@ -27,75 +346,43 @@ def index_pdf(path_to_pdf: str = './data/pdf', persist_dir: str = 'results/pdf')
         # Se não existir, cria o caminho
         os.makedirs(path_to_pdf)
 
-    # Copia o arquivo de origem para o destino
-    shutil.copy(caminho_origem, path_to_pdf)
-
-    # Carregando os documentos
-    documents = SimpleDirectoryReader(path_to_pdf).load_data()
+    # Copia o arquivo de origem para o destino, apenas se ele ainda não estiver lá ou tiver sido alterado
+    caminho_destino = os.path.join(path_to_pdf, os.path.basename(caminho_origem))
+    if not os.path.exists(caminho_destino) or file_hash(caminho_origem) != file_hash(caminho_destino):
+        shutil.copy(caminho_origem, path_to_pdf)
 
     # Indexando os documentos
-    index = VectorStoreIndex.from_documents(documents,
-                                            transformations=[SentenceSplitter(chunk_size=256, chunk_overlap=0)])
-
-    # Persistindo o índice
-    index.storage_context.persist(persist_dir=persist_dir)
+    return index_directory(path_to_pdf, persist_dir, chunk_size=256)
 
 
-def index_img(path_to_img: str = './data/imagem', persist_dir: str = 'results/imagem') -> None:
+def index_img(path_to_img: str = './data/imagem', persist_dir: str = 'results/imagem') -> Dict[str, float]:
     """
     Indexa o texto da imagem, que está em path_to_img, e persiste o índice em persist_dir.
     :param path_to_img: o caminho para o texto da imagem
     :param persist_dir: o diretório onde o índice será persistido
-    :return: None
+    :return: um resumo da indexação
     """
-
-    # Carregando os documentos
-    documents = SimpleDirectoryReader(path_to_img).load_data()
-
-    # Indexando os documentos
-    index = VectorStoreIndex.from_documents(documents,
-                                            transformations=[SentenceSplitter(chunk_size=128, chunk_overlap=0)])
-
-    # Persistindo o índice
-    index.storage_context.persist(persist_dir=persist_dir)
+    return index_directory(path_to_img, persist_dir, chunk_size=128)
 
 
-def index_exercicios(path_to_txt: str = './data/exercicio', persist_dir: str = 'results/exercicio') -> None:
+def index_exercicios(path_to_txt: str = './data/exercicio', persist_dir: str = 'results/exercicio') -> Dict[str, float]:
     """
     Indexa o texto dos exercícios, que está em path_to_txt, e persiste o índice em persist_dir.
     :param path_to_txt: o caminho para o texto dos exercícios
     :param persist_dir: o diretório onde o índice será persistido
-    :return: None
+    :return: um resumo da indexação
     """
-
-    # Carregando os documentos
-    documents = SimpleDirectoryReader(path_to_txt).load_data()
-
-    # Indexando os documentos
-    index = VectorStoreIndex.from_documents(documents,
-                                            transformations=[SentenceSplitter(chunk_size=256, chunk_overlap=0)])
-
-    # Persistindo o índice
-    index.storage_context.persist(persist_dir=persist_dir)
+    return index_directory(path_to_txt, persist_dir, chunk_size=256)
 
 
-def index_video(path_to_txt: str = './data/video', persist_dir: str = 'results/video') -> None:
+def index_video(path_to_txt: str = './data/video', persist_dir: str = 'results/video') -> Dict[str, float]:
     """
     Indexa o texto do vídeo, que está em path_to_txt, e persiste o índice em persist_dir.
     :param path_to_txt: o caminho para o texto do vídeo
     :param persist_dir: o diretório onde o índice será persistido
-    :return: None
+    :return: um resumo da indexação
     """
-
-    # Carregando os documentos
-    documents = SimpleDirectoryReader(path_to_txt).load_data()
-
-    # Indexando os documentos
-    index = VectorStoreIndex.from_documents(documents,
-                                            transformations=[SentenceSplitter(chunk_size=256, chunk_overlap=0)])
-
-    # Persistindo o índice
-    index.storage_context.persist(persist_dir=persist_dir)
+    return index_directory(path_to_txt, persist_dir, chunk_size=256)
 
 
 def get_index(persist_dir: str = 'results/pdf') -> BaseIndex:
@@ -111,25 +398,28 @@ def get_index(persist_dir: str = 'results/pdf') -> BaseIndex:
             f"Index não encontrado em {persist_dir}. Certifique-se de indexar os documentos primeiro e persistir o "
             f"índice em {persist_dir}.")
 
-    # Carregando o índice, caso o índice já tenha sido persistido.
+    # Carregando o índice, caso o índice já tenha sido persistido, com o vector store registrado no manifesto. Índices
+    # sem manifesto foram criados com o vector store padrão do LlamaIndex.
     else:
-        storage_context = StorageContext.from_defaults(persist_dir=persist_dir)
-        index = load_index_from_storage(storage_context)
+        manifesto = load_manifest(persist_dir)
+        vector_store = manifesto['config'].get('vector_store', 'simple') if manifesto is not None else 'simple'
+        index = load_index_from_storage(create_storage_context(vector_store, persist_dir))
 
     return index
 
 
-def get_retriever(index) -> RetrieverQueryEngine:
+def get_retriever(index, top_k: int = 3) -> RetrieverQueryEngine:
     """
     Configura o retriever e a query engine que retornará os documentos mais similares à query.
     :param index: o índice a ser utilizado
+    :param top_k: número de nós mais similares a serem retornados
     :return: a query engine configurada
     """
 
     # Configurando o retriever
     retriever = VectorIndexRetriever(
         index=index,
-        similarity_top_k=3,  # retornando o top 3 nós mais similares
+        similarity_top_k=top_k,  # retornando o top k nós mais similares
     )
 
     # Criando a engine que irá retornar os nós a partir da query do usuário.
@@ -160,3 +450,310 @@ def retrieve_nodes(retriever: RetrieverQueryEngine, query: str) -> List[str]:
             materiais.append(r.text)
 
     return materiais
+
+
+def _lock_do_indice(persist_dir: str) -> threading.Lock:
+    """
+    Retorna o lock associado a um diretório persistido, criando-o caso ainda não exista. Há um lock por índice, para
+    que o carregamento de um índice não bloqueie o uso dos demais.
+    :param persist_dir: o diretório onde o índice foi persistido
+    :return: o lock do índice
+    """
+    with _lock_registro:
+        if persist_dir not in _locks_indices:
+            _locks_indices[persist_dir] = threading.Lock()
+        return _locks_indices[persist_dir]
+
+
+def _assinatura_do_indice(persist_dir: str) -> Tuple:
+    """
+    Calcula a assinatura dos arquivos de um índice persistido, que muda sempre que o índice é reconstruído.
+    :param persist_dir: o diretório onde o índice foi persistido
+    :return: a assinatura do índice
+    """
+    if not os.path.exists(persist_dir):
+        return ()
+
+    with os.scandir(persist_dir) as arquivos:
+        return tuple(sorted((arquivo.name, arquivo.stat().st_size, arquivo.stat().st_mtime_ns)
+                            for arquivo in arquivos if arquivo.is_file()))
+
+
+def _verificar_reconstrucao(chave: str) -> None:
+    """
+    Descarta o índice carregado caso seus arquivos tenham sido alterados desde o carregamento, por exemplo, por uma
+    nova execução do run_indexing. A verificação é feita no máximo uma vez a cada INTERVALO_VERIFICACAO_INDICE segundos.
+    :param chave: o diretório normalizado do índice
+    :return: None
+    """
+    agora = time.monotonic()
+    if agora - _ultima_verificacao.get(chave, 0.0) < INTERVALO_VERIFICACAO_INDICE:
+        return
+    _ultima_verificacao[chave] = agora
+
+    if chave in _assinaturas_indices and _assinaturas_indices[chave] != _assinatura_do_indice(chave):
+        print(f'O índice em {chave} foi reconstruído. Recarregando o índice.')
+        invalidate_index(chave)
+
+
+def get_cached_index(persist_dir: str = 'results/pdf') -> BaseIndex:
+    """
+    Carrega o índice persistido em persist_dir apenas na primeira vez em que é solicitado. Nas chamadas seguintes, o
+    índice já carregado em memória é retornado, a menos que ele tenha sido reconstruído.
+    :param persist_dir: o diretório onde o índice foi persistido
+    :return: o índice carregado
+    """
+    chave = os.path.normpath(persist_dir)
+    _verificar_reconstrucao(chave)
+
+    # Verificando se o índice já foi carregado, sem precisar adquirir o lock
+    index = _indices_carregados.get(chave)
+    if index is not None:
+        return index
+
+    with _lock_do_indice(chave):
+        # Outra thread pode ter carregado o índice enquanto esperávamos o lock
+        if chave not in _indices_carregados:
+            with span('index_load', chave):
+                _assinaturas_indices[chave] = _assinatura_do_indice(chave)
+                _indices_carregados[chave] = get_index(persist_dir)
+
+        return _indices_carregados[chave]
+
+
+def get_cached_retriever(persist_dir: str = 'results/pdf', top_k: int = 3) -> RetrieverQueryEngine:
+    """
+    Retorna o retriever do índice persistido em persist_dir, criando-o apenas na primeira vez em que é solicitado.
+    :param persist_dir: o diretório onde o índice foi persistido
+    :param top_k: número de nós mais similares a serem retornados pelo retriever
+    :return: a query engine configurada para o índice
+    """
+    chave = os.path.normpath(persist_dir)
+
+    index = get_cached_index(chave)
+    retriever = _retrievers_carregados.get((chave, top_k))
+    if retriever is not None:
+        return retriever
+
+    with _lock_do_indice(chave):
+        if (chave, top_k) not in _retrievers_carregados:
+            _retrievers_carregados[(chave, top_k)] = get_retriever(index, top_k)
+
+        return _retrievers_carregados[(chave, top_k)]
+
+
+def get_cached_bm25(persist_dir: str = 'results/pdf') -> BM25Index:
+    """
+    Retorna o índice lexical (BM25) dos nós do índice persistido em persist_dir, construindo-o em memória na primeira
+    vez em que é solicitado e sempre que o índice for recarregado.
+    :param persist_dir: o diretório onde o índice foi persistido
+    :return: o índice lexical
+    """
+    chave = os.path.normpath(persist_dir)
+    index = get_cached_index(chave)
+
+    carregado = _bm25_carregados.get(chave)
+    if carregado is not None and carregado[0] is index:
+        return carregado[1]
+
+    with _lock_do_indice(chave):
+        carregado = _bm25_carregados.get(chave)
+        if carregado is None or carregado[0] is not index:
+            nodes = get_index_nodes(index)
+            _bm25_carregados[chave] = (index, BM25Index((node.node_id, node.get_content()) for node in nodes))
+
+        return _bm25_carregados[chave][1]
+
+
+def configure_retrieval_mode(mode: str = 'vector', min_coverage: float = 0.8, max_terms: int = 4) -> None:
+    """
+    Configura o modo de recuperação utilizado por retrieve_nodes_cached.
+    :param mode: 'vector' (apenas a busca por embeddings) ou 'hybrid' (busca lexical e por embeddings)
+    :param min_coverage: no modo híbrido, a fração mínima do peso dos termos da query presente no melhor documento
+    lexical para que a busca por embeddings seja dispensada
+    :param max_terms: no modo híbrido, o número máximo de termos de uma query respondida apenas pela busca lexical
+    :return: None
+    """
+    if mode not in MODOS_RECUPERACAO:
+        raise ValueError(f"Modo de recuperação {mode} inválido. Utilize um dos valores: {MODOS_RECUPERACAO}.")
+
+    global _modo_recuperacao, _cobertura_minima, _max_termos_lexicos
+    _modo_recuperacao = mode
+    _cobertura_minima = min_coverage
+    _max_termos_lexicos = max_terms
+
+
+def retrieve_nodes_hybrid(persist_dir: str, query: str, top_k: int = 3) -> List[str]:
+    """
+    Recupera os nós mais relevantes para a query combinando a busca lexical (BM25) e a busca por embeddings. Quando a
+    busca lexical é confiável (uma query curta, cujos termos aparecem quase todos no melhor documento), o resultado é
+    retornado sem embedar a query. Caso contrário, os dois rankings são combinados com a fusão por posição recíproca.
+    :param persist_dir: o diretório onde o índice foi persistido
+    :param query: a query do usuário
+    :param top_k: número de nós retornados
+    :return: uma lista com os nós mais relevantes para a query
+    """
+    chave = os.path.normpath(persist_dir)
+    index = get_cached_index(chave)
+    bm25 = get_cached_bm25(chave)
+
+    # Considerando apenas os nós que contêm boa parte dos termos da query
+    with span('bm25', chave):
+        lexicos = bm25.search(query, top_k)
+    relevantes = [node_id for node_id, _, cobertura in lexicos if cobertura >= _cobertura_minima / 2]
+
+    if bm25.is_confident(query, lexicos, _cobertura_minima, _max_termos_lexicos):
+        return [_texto_do_no(index, node_id) for node_id in relevantes]
+
+    # Combinando os nós similares da busca por embeddings, com o mesmo limite de similaridade de retrieve_nodes, com os
+    # nós relevantes da busca lexical
+    recuperado = get_cached_retriever(chave, top_k).retrieve(QueryBundle(query))
+    textos = {r.node.node_id: r.text for r in recuperado}
+    rankings = {'vetorial': [r.node.node_id for r in recuperado if r.score >= 0.75], 'lexica': relevantes}
+
+    materiais = []
+    for node_id, _, _ in reciprocal_rank_fusion(rankings)[:top_k]:
+        materiais.append(textos[node_id] if node_id in textos else _texto_do_no(index, node_id))
+
+    return materiais
+
+
+def warm_up_indexes(persist_dirs: List[str]) -> List[str]:
+    """
+    Carrega antecipadamente os índices e retrievers informados, para que a primeira chamada das ferramentas do agente
+    não pague o custo de desserialização dos índices. Os índices que não podem ser carregados (por exemplo, ainda não
+    criados) são ignorados, sem impedir o carregamento dos demais.
+    :param persist_dirs: os diretórios onde os índices foram persistidos
+    :return: os diretórios dos índices ignorados
+    """
+    ignorados = []
+    for persist_dir in persist_dirs:
+        try:
+            get_cached_retriever(persist_dir)
+            if _modo_recuperacao == 'hybrid':
+                get_cached_bm25(persist_dir)
+        except ValueError as e:
+            print(f'Índice {persist_dir} não pré-carregado: {e}')
+            ignorados.append(persist_dir)
+
+    return ignorados
+
+
+def invalidate_index(persist_dir: str) -> None:
+    """
+    Remove do registro o índice e os retrievers de persist_dir, além dos resultados de recuperação armazenados em
+    cache, fazendo com que sejam recarregados do disco no próximo uso. Deve ser chamada sempre que o índice for
+    reconstruído.
+    :param persist_dir: o diretório onde o índice foi persistido
+    :return: None
+    """
+    chave = os.path.normpath(persist_dir)
+
+    with _lock_do_indice(chave):
+        _indices_carregados.pop(chave, None)
+        _assinaturas_indices.pop(chave, None)
+        _bm25_carregados.pop(chave, None)
+        for chave_retriever in [c for c in _retrievers_carregados if c[0] == chave]:
+            del _retrievers_carregados[chave_retriever]
+
+    _retrieval_cache.invalidate(chave)
+
+
+def configure_retrieval_cache(max_entries: int = 1024, ttl: Optional[float] = 3600, policy: str = 'lru') -> None:
+    """
+    Substitui o cache de recuperações por um novo cache com as configurações informadas.
+    :param max_entries: número máximo de entradas armazenadas
+    :param ttl: tempo, em segundos, após o qual uma entrada expira (None para não expirar)
+    :param policy: política de descarte quando o cache está cheio ('lru' ou 'fifo')
+    :return: None
+    """
+    global _retrieval_cache
+    _retrieval_cache = RetrievalCache(max_entries=max_entries, ttl=ttl, policy=policy)
+
+
+def get_retrieval_cache() -> RetrievalCache:
+    """
+    Retorna o cache de recuperações em uso, permitindo consultar suas métricas.
+    :return: o cache de recuperações
+    """
+    return _retrieval_cache
+
+
+def retrieve_nodes_cached(persist_dir: str, query: str, top_k: int = 3) -> List[str]:
+    """
+    Recupera os nós mais similares à query no índice persistido em persist_dir, reaproveitando o resultado de uma
+    recuperação anterior da mesma pergunta, caso ela esteja em cache. Se a mesma pergunta já está sendo recuperada em
+    outra chamada, o resultado dela é aguardado, em vez de uma nova recuperação.
+    :param persist_dir: o diretório onde o índice foi persistido
+    :param query: a query do usuário
+    :param top_k: número de nós mais similares a serem considerados
+    :return: uma lista com os nós mais similares à query
+    """
+    chave_indice = os.path.normpath(persist_dir)
+    modo = _modo_recuperacao
+
+    with span('retrieval', chave_indice, mode=modo) as recuperacao:
+        retriever = get_cached_retriever(chave_indice, top_k)
+
+        # O modo de recuperação faz parte da chave, para que os resultados densos não sejam servidos às buscas híbridas
+        # (e vice-versa) após uma mudança de modo
+        chave = (normalize_query(query), chave_indice, top_k, modo)
+        materiais = _retrieval_cache.get(chave)
+        recuperacao.attrs['cache_hit'] = materiais is not None
+        if materiais is not None:
+            return materiais
+
+        # A chamada é marcada como agrupada, a menos que seja ela a executar a recuperação
+        recuperacao.attrs['coalesced'] = True
+
+        def recuperar() -> List[str]:
+            recuperacao.attrs['coalesced'] = False
+
+            if modo == 'hybrid':
+                encontrados = retrieve_nodes_hybrid(chave_indice, query, top_k)
+            else:
+                encontrados = retrieve_nodes(retriever, query)
+            _retrieval_cache.put(chave, encontrados)
+
+            return encontrados
+
+        materiais = _recuperacoes_em_andamento.do(chave, recuperar)
+        recuperacao.attrs['nodes'] = len(materiais)
+
+        # Cada chamada recebe sua própria cópia, como nas consultas ao cache
+        return list(materiais)
+
+
+# Threads utilizadas para consultar vários índices ao mesmo tempo
+_executor_recuperacao = ThreadPoolExecutor(max_workers=8, thread_name_prefix='recuperacao')
+
+
+def retrieve_nodes_fused(persist_dirs: Dict[str, str], query: str, preferred: Optional[str] = None,
+                         preferred_boost: float = 2.0, top_k: int = 3) -> List[Tuple[str, str]]:
+    """
+    Recupera os nós mais similares à query em vários índices ao mesmo tempo e combina os resultados com a fusão por
+    posição recíproca, dando um peso maior ao índice preferido. Assim, quando o índice preferido não tem conteúdo
+    relevante, os materiais dos demais índices são retornados na mesma chamada.
+    :param persist_dirs: os diretórios dos índices consultados, indexados pelo nome do índice (por exemplo, o formato)
+    :param query: a query do usuário
+    :param preferred: o nome do índice preferido
+    :param preferred_boost: o peso do índice preferido na fusão (os demais têm peso 1)
+    :param top_k: número de materiais retornados, e de nós considerados em cada índice
+    :return: os materiais mais relevantes, como tuplas (nome do índice, material)
+    """
+    # Cada busca é executada com uma cópia do contexto atual, para que seja registrada no turno da conversa
+    futures = {nome: _executor_recuperacao.submit(contextvars.copy_context().run, retrieve_nodes_cached, persist_dir,
+                                                  query, top_k)
+               for nome, persist_dir in persist_dirs.items()}
+
+    rankings = {}
+    for nome, future in futures.items():
+        try:
+            rankings[nome] = [(nome, material) for material in future.result()]
+        except ValueError as erro:
+            # Ignorando os índices que ainda não foram criados
+            print(erro)
+
+    fundidos = reciprocal_rank_fusion(rankings, {preferred: preferred_boost} if preferred else None)
+
+    return [item for item, _, _ in fundidos[:top_k]]
@@ -0,0 +1,283 @@
+import os
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+import fsspec
+import numpy as np
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+from llama_index.core.schema import BaseNode
+from llama_index.core.vector_stores.types import VectorStoreQueryResult
+
+from data_indexing.numpy_vector_store import NumpyVectorStore, top_k
+
+# Número máximo de linhas multiplicadas de uma só vez pelos centróides, limitando a memória usada na atribuição
+_LINHAS_POR_BLOCO = 65536
+
+
+class IVFVectorStore(NumpyVectorStore):
+    """
+    Vector store com busca aproximada por arquivo invertido (IVF). Os embeddings são agrupados em nlist clusters por
+    k-means esférico e cada consulta compara a query apenas com os nós dos nprobe clusters cujos centróides são mais
+    similares a ela, de modo que o custo da consulta cresce com nprobe / nlist do índice, e não com o índice inteiro.
+    Aumentar nprobe melhora o recall e deixa a consulta mais lenta. Índices menores que min_train_size continuam com a
+    busca exata do NumpyVectorStore.
+    """
+
+    nlist: Optional[int] = Field(default=None, description="Número de clusters (por padrão, a raiz do número de nós).")
+    nprobe: int = Field(default=8, description="Número de clusters visitados em cada consulta.")
+    min_train_size: int = Field(default=1024, description="Número mínimo de nós para utilizar a busca aproximada.")
+
+    _centroides: Optional[np.ndarray] = PrivateAttr(default=None)
+    _atribuicoes: Optional[np.ndarray] = PrivateAttr(default=None)
+    _listas: Optional[List[np.ndarray]] = PrivateAttr(default=None)
+    _n_treino: int = PrivateAttr(default=0)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "IVFVectorStore"
+
+    @property
+    def trained(self) -> bool:
+        return self._centroides is not None
+
+    def add(self, nodes: List[BaseNode], **add_kwargs: Any) -> List[str]:
+        with self._lock:
+            ids = super().add(nodes, **add_kwargs)
+
+            # Atribuindo os nós novos ou alterados aos clusters já treinados
+            if self._centroides is not None and nodes:
+                posicoes = np.array([self._posicoes[node_id] for node_id in ids], dtype=np.int64)
+                atribuicoes = np.empty(self._n, dtype=np.int32)
+                atribuicoes[:len(self._atribuicoes)] = self._atribuicoes
+                atribuicoes[posicoes] = self._atribuir(self._matriz[posicoes])
+                self._atribuicoes = atribuicoes
+                self._listas = None
+
+        return ids
+
+    def _manter_linhas(self, mantidos: np.ndarray) -> None:
+        super()._manter_linhas(mantidos)
+
+        if self._atribuicoes is not None:
+            self._atribuicoes = self._atribuicoes[mantidos]
+            self._listas = None
+
+    def _atribuir(self, embeddings: np.ndarray) -> np.ndarray:
+        """
+        Atribui cada embedding ao cluster de centróide mais similar.
+        :param embeddings: os embeddings normalizados, um por linha
+        :return: o cluster de cada embedding
+        """
+        atribuicoes = np.empty(len(embeddings), dtype=np.int32)
+        for i in range(0, len(embeddings), _LINHAS_POR_BLOCO):
+            atribuicoes[i:i + _LINHAS_POR_BLOCO] = np.argmax(
+                embeddings[i:i + _LINHAS_POR_BLOCO] @ self._centroides.T, axis=1)
+
+        return atribuicoes
+
+    def train(self, iterations: int = 10, seed: int = 0) -> None:
+        """
+        Treina os centróides com k-means esférico sobre uma amostra dos embeddings e atribui todos os nós aos clusters.
+        Índices menores que min_train_size não são treinados e continuam com a busca exata.
+        :param iterations: número de iterações do k-means
+        :param seed: semente da amostragem
+        :return: None
+        """
+        with self._lock:
+            matriz = self._matriz[:self._n]
+            if self._n < self.min_train_size:
+                self._centroides = self._atribuicoes = self._listas = None
+                return
+
+            nlist = min(self.nlist or int(np.sqrt(self._n)), self._n)
+            rng = np.random.default_rng(seed)
+
+            # Treinando sobre no máximo 64 pontos por cluster, o suficiente para estimar os centróides
+            amostra = matriz[rng.choice(self._n, min(self._n, 64 * nlist), replace=False)]
+            centroides = amostra[rng.choice(len(amostra), nlist, replace=False)].copy()
+
+            for _ in range(iterations):
+                atribuicoes = np.argmax(amostra @ centroides.T, axis=1)
+                somas = np.zeros_like(centroides)
+                np.add.at(somas, atribuicoes, amostra)
+
+                # Reiniciando os clusters vazios em pontos aleatórios da amostra
+                vazios = np.bincount(atribuicoes, minlength=nlist) == 0
+                somas[vazios] = amostra[rng.choice(len(amostra), int(vazios.sum()), replace=False)]
+                centroides = self._normalizar(somas)
+
+            self._centroides = centroides
+            self._atribuicoes = self._atribuir(matriz)
+            self._listas = None
+            self._n_treino = self._n
+
+    def _precisa_treinar(self) -> bool:
+        """
+        Indica se os clusters devem ser (re)treinados: o índice atingiu o tamanho mínimo sem ter sido treinado, ou
+        cresceu ou diminuiu tanto desde o treino que os clusters ficaram desbalanceados.
+        :return: True caso o índice precise ser treinado
+        """
+        if self._n < self.min_train_size:
+            return self._centroides is not None
+        if self._centroides is None:
+            return True
+
+        return not self._n_treino / 2 <= self._n <= self._n_treino * 2
+
+    def _listas_invertidas(self) -> List[np.ndarray]:
+        """
+        Retorna, para cada cluster, as posições dos nós atribuídos a ele, montando as listas caso necessário.
+        :return: as listas invertidas
+        """
+        if self._listas is None:
+            ordem = np.argsort(self._atribuicoes, kind='stable')
+            limites = np.searchsorted(self._atribuicoes[ordem], np.arange(len(self._centroides) + 1))
+            self._listas = [ordem[limites[i]:limites[i + 1]] for i in range(len(self._centroides))]
+
+        return self._listas
+
+    def query_batch(self, query_embeddings: Sequence[Sequence[float]], similarity_top_k: int = 3,
+                    node_ids: Optional[Sequence[str]] = None) -> List[VectorStoreQueryResult]:
+        with self._lock:
+            centroides = self._centroides
+            if centroides is not None:
+                matriz = self._matriz[:self._n]
+                ids = self._ids
+                listas = self._listas_invertidas()
+                candidatos = self._candidatos(node_ids)
+
+        # Índices ainda não treinados utilizam a busca exata
+        if centroides is None:
+            return super().query_batch(query_embeddings, similarity_top_k, node_ids)
+
+        queries = self._normalizar(np.atleast_2d(query_embeddings))
+        nprobe = min(self.nprobe, len(centroides))
+
+        # Selecionando os clusters mais similares a cada query
+        clusters, _ = top_k(queries @ centroides.T, nprobe)
+
+        resultados = []
+        for query, clusters_query in zip(queries, clusters):
+            posicoes = np.concatenate([listas[c] for c in clusters_query])
+            if candidatos is not None:
+                posicoes = np.intersect1d(posicoes, candidatos)
+
+            k = min(similarity_top_k, len(posicoes))
+            if k == 0:
+                resultados.append(VectorStoreQueryResult(similarities=[], ids=[]))
+                continue
+
+            topo, scores_topo = top_k((matriz[posicoes] @ query)[np.newaxis], k)
+            resultados.append(VectorStoreQueryResult(similarities=scores_topo[0].tolist(),
+                                                     ids=[ids[posicoes[i]] for i in topo[0]]))
+
+        return resultados
+
+    def persist(self, persist_path: str, fs: Optional[fsspec.AbstractFileSystem] = None) -> None:
+        """
+        Salva o vector store e os clusters, treinando-os antes caso necessário, para que o índice carregado já esteja
+        pronto para a busca aproximada.
+        :param persist_path: o caminho do vector store indicado pelo StorageContext
+        :param fs: não utilizado, os arquivos são salvos no sistema de arquivos local
+        :return: None
+        """
+        with self._lock:
+            if self._precisa_treinar():
+                self.train()
+
+            super().persist(persist_path, fs)
+
+            base = os.path.splitext(persist_path)[0]
+            dados = {'nprobe': self.nprobe, 'min_train_size': self.min_train_size, 'n_treino': self._n_treino,
+                     'nlist': -1 if self.nlist is None else self.nlist}
+            if self._centroides is not None:
+                dados.update(centroides=self._centroides, atribuicoes=self._atribuicoes)
+
+            with open(base + '.ivf.npz.tmp', 'wb') as arquivo:
+                np.savez(arquivo, **dados)
+            os.replace(base + '.ivf.npz.tmp', base + '.ivf.npz')
+
+    @classmethod
+    def from_persist_path(cls, persist_path: str) -> "IVFVectorStore":
+        store = super().from_persist_path(persist_path)
+
+        base = os.path.splitext(persist_path)[0]
+        if os.path.exists(base + '.ivf.npz'):
+            with np.load(base + '.ivf.npz') as arquivo:
+                dados = dict(arquivo)
+            store.nprobe = int(dados['nprobe'])
+            store.min_train_size = int(dados['min_train_size'])
+            store.nlist = None if int(dados['nlist']) < 0 else int(dados['nlist'])
+            if 'centroides' in dados:
+                store._centroides = dados['centroides']
+                store._atribuicoes = dados['atribuicoes']
+                store._n_treino = int(dados['n_treino'])
+
+        return store
+
+
+def sample_queries(store: NumpyVectorStore, n_queries: int = 200, seed: int = 0) -> np.ndarray:
+    """
+    Gera queries de teste a partir de embeddings do próprio índice, somados a um pequeno ruído, o que dispensa chamadas
+    ao modelo de embedding.
+    :param store: o vector store
+    :param n_queries: o número de queries
+    :param seed: a semente da amostragem
+    :return: os embeddings das queries, um por linha
+    """
+    rng = np.random.default_rng(seed)
+    with store._lock:
+        matriz = store._matriz[:store._n]
+
+    amostra = matriz[rng.choice(len(matriz), min(n_queries, len(matriz)), replace=False)]
+
+    return amostra + rng.normal(scale=0.5 / np.sqrt(matriz.shape[1]), size=amostra.shape).astype(np.float32)
+
+
+def recall_report(store: IVFVectorStore, queries: Optional[np.ndarray] = None, similarity_top_k: int = 3,
+                  nprobes: Sequence[int] = (1, 2, 4, 8, 16, 32)) -> List[Dict[str, float]]:
+    """
+    Compara a busca aproximada com a busca exata para diferentes valores de nprobe, medindo o recall (fração dos top-k
+    exatos que a busca aproximada também retorna) e o tempo médio por consulta.
+    :param store: o vector store aproximado
+    :param queries: os embeddings das queries de teste, um por linha (por padrão, geradas com sample_queries)
+    :param similarity_top_k: o número de nós retornados por consulta
+    :param nprobes: os valores de nprobe avaliados
+    :return: uma linha por valor de nprobe, com o recall, os tempos médios (em ms) e a fração média do índice visitada
+    """
+    if queries is None:
+        queries = sample_queries(store)
+    queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+
+    inicio = time.perf_counter()
+    exatos = [NumpyVectorStore.query_batch(store, [query], similarity_top_k)[0] for query in queries]
+    ms_exato = (time.perf_counter() - inicio) / len(queries) * 1000
+
+    nprobe_original = store.nprobe
+    linhas = []
+    try:
+        for nprobe in nprobes:
+            store.nprobe = nprobe
+            inicio = time.perf_counter()
+            aproximados = [store.query_batch([query], similarity_top_k)[0] for query in queries]
+            ms_aproximado = (time.perf_counter() - inicio) / len(queries) * 1000
+
+            acertos = sum(len(set(exato.ids) & set(aproximado.ids)) for exato, aproximado in zip(exatos, aproximados))
+            total = sum(len(exato.ids) for exato in exatos)
+
+            # Fração do índice comparada com cada query, a partir do tamanho dos clusters visitados
+            if store.trained:
+                with store._lock:
+                    tamanhos = np.array([len(lista) for lista in store._listas_invertidas()])
+                    clusters, _ = top_k(store._normalizar(queries) @ store._centroides.T,
+                                        min(nprobe, len(tamanhos)))
+                fracao = float(tamanhos[clusters].sum(axis=1).mean()) / max(1, int(tamanhos.sum()))
+            else:
+                fracao = 1.0
+
+            linhas.append({'nprobe': nprobe, 'recall': acertos / total if total else 1.0, 'ms_aproximado': ms_aproximado,
+                           'ms_exato': ms_exato, 'fracao_visitada': fracao})
+    finally:
+        store.nprobe = nprobe_original
+
+    return linhas
@@ -0,0 +1,79 @@
+import os
+import json
+import hashlib
+from typing import Any, Dict, Optional
+
+# Nome do arquivo do manifesto, salvo junto ao índice persistido
+MANIFEST_FILENAME = 'manifest.json'
+
+# Versão do formato do manifesto. Manifestos de outra versão fazem com que o índice seja reconstruído do zero.
+MANIFEST_VERSION = 1
+
+
+def file_hash(path: str) -> str:
+    """
+    Calcula o hash do conteúdo de um arquivo, lendo-o em blocos para não carregar arquivos grandes inteiros em memória.
+    :param path: o caminho do arquivo
+    :return: o hash SHA-256 do arquivo, em hexadecimal
+    """
+    sha = hashlib.sha256()
+    with open(path, 'rb') as arquivo:
+        for bloco in iter(lambda: arquivo.read(1024 * 1024), b''):
+            sha.update(bloco)
+
+    return sha.hexdigest()
+
+
+def text_hash(text: str) -> str:
+    """
+    Calcula o hash de um texto, utilizado para identificar os chunks de um índice.
+    :param text: o texto
+    :return: o hash SHA-256 do texto, em hexadecimal
+    """
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def empty_manifest(index_config: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Cria um manifesto vazio, para um índice que ainda não possui fontes indexadas.
+    :param index_config: as configurações de indexação do índice (por exemplo, tamanho do chunk)
+    :return: o manifesto vazio
+    """
+    return {'versao': MANIFEST_VERSION, 'config': index_config, 'fontes': {}}
+
+
+def load_manifest(persist_dir: str) -> Optional[Dict[str, Any]]:
+    """
+    Carrega o manifesto do índice persistido em persist_dir. O manifesto registra, para cada arquivo fonte, o hash do
+    arquivo, os documentos gerados a partir dele e o hash de cada um de seus chunks.
+    :param persist_dir: o diretório onde o índice foi persistido
+    :return: o manifesto carregado, ou None caso o índice não possua manifesto
+    """
+    caminho = os.path.join(persist_dir, MANIFEST_FILENAME)
+    if not os.path.exists(caminho):
+        return None
+
+    with open(caminho, 'r', encoding='utf-8') as arquivo:
+        manifesto = json.load(arquivo)
+
+    if manifesto.get('versao') != MANIFEST_VERSION:
+        return None
+
+    return manifesto
+
+
+def save_manifest(persist_dir: str, manifest: Dict[str, Any]) -> None:
+    """
+    Salva o manifesto do índice em persist_dir. O arquivo é escrito em um arquivo temporário e depois renomeado, para
+    que uma interrupção não deixe um manifesto corrompido.
+    :param persist_dir: o diretório onde o índice foi persistido
+    :param manifest: o manifesto a ser salvo
+    :return: None
+    """
+    caminho = os.path.join(persist_dir, MANIFEST_FILENAME)
+    caminho_temporario = caminho + '.tmp'
+
+    with open(caminho_temporario, 'w', encoding='utf-8') as arquivo:
+        json.dump(manifest, arquivo, indent=4, ensure_ascii=False)
+
+    os.replace(caminho_temporario, caminho)
@@ -0,0 +1,291 @@
+import os
+import json
+import threading
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple
+
+import fsspec
+import numpy as np
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.schema import BaseNode
+from llama_index.core.vector_stores.types import (
+    BasePydanticVectorStore,
+    VectorStoreQuery,
+    VectorStoreQueryMode,
+    VectorStoreQueryResult,
+)
+
+# Nome base dos arquivos do vector store, o mesmo utilizado pelo StorageContext para o vector store padrão
+NUMPY_VECTOR_STORE_BASENAME = 'default__vector_store'
+
+
+def top_k(scores: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Seleciona os k maiores scores de cada linha com argpartition, ordenando apenas os selecionados.
+    :param scores: matriz de scores, uma linha por query
+    :param k: o número de scores selecionados por linha (no máximo o número de colunas)
+    :return: as colunas selecionadas e seus scores, em ordem decrescente de score
+    """
+    if k < scores.shape[1]:
+        topo = np.argpartition(scores, scores.shape[1] - k, axis=1)[:, -k:]
+    else:
+        topo = np.tile(np.arange(scores.shape[1]), (scores.shape[0], 1))
+
+    scores_topo = np.take_along_axis(scores, topo, axis=1)
+    ordem = np.argsort(-scores_topo, axis=1)
+
+    return np.take_along_axis(topo, ordem, axis=1), np.take_along_axis(scores_topo, ordem, axis=1)
+
+
+class NumpyVectorStore(BasePydanticVectorStore):
+    """
+    Vector store que mantém todos os embeddings do índice em uma única matriz contígua de float32, com as linhas já
+    normalizadas. A similaridade de cosseno de uma query com todos os nós é calculada com um único produto
+    matriz-vetor, e os top-k são selecionados com argpartition, sem ordenar todos os scores. Várias queries podem ser
+    respondidas de uma só vez com query_batch. Os textos dos nós continuam no docstore do índice.
+    """
+
+    stores_text: bool = False
+
+    _matriz: np.ndarray = PrivateAttr()
+    _n: int = PrivateAttr()
+    _ids: List[str] = PrivateAttr()
+    _ref_doc_ids: List[str] = PrivateAttr()
+    _posicoes: Dict[str, int] = PrivateAttr()
+    _por_documento: Dict[str, Set[str]] = PrivateAttr()
+    _lock: threading.RLock = PrivateAttr()
+
+    def __init__(self, embeddings: Optional[np.ndarray] = None, ids: Optional[List[str]] = None,
+                 ref_doc_ids: Optional[List[str]] = None, **kwargs: Any):
+        """
+        :param embeddings: matriz com os embeddings já normalizados, um por linha (por padrão, um store vazio)
+        :param ids: os ids dos nós de cada linha da matriz
+        :param ref_doc_ids: os ids dos documentos de origem de cada linha da matriz
+        """
+        super().__init__(**kwargs)
+        self._lock = threading.RLock()
+        self._ids = list(ids or [])
+        self._ref_doc_ids = list(ref_doc_ids or [])
+        self._n = len(self._ids)
+        self._matriz = (np.ascontiguousarray(embeddings, dtype=np.float32) if embeddings is not None
+                        else np.empty((0, 0), dtype=np.float32))
+        self._posicoes = {node_id: i for i, node_id in enumerate(self._ids)}
+        self._por_documento = {}
+        for node_id, ref_doc_id in zip(self._ids, self._ref_doc_ids):
+            self._por_documento.setdefault(ref_doc_id, set()).add(node_id)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "NumpyVectorStore"
+
+    @property
+    def client(self) -> None:
+        return None
+
+    @staticmethod
+    def _normalizar(embeddings: np.ndarray) -> np.ndarray:
+        """
+        Normaliza as linhas da matriz, para que o produto interno corresponda à similaridade de cosseno.
+        :param embeddings: a matriz de embeddings
+        :return: a matriz normalizada, em float32
+        """
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        normas = np.linalg.norm(embeddings, axis=-1, keepdims=True)
+        normas[normas == 0] = 1.0
+
+        return embeddings / normas
+
+    def get(self, text_id: str) -> List[float]:
+        """
+        Retorna o embedding (normalizado) de um nó.
+        :param text_id: o id do nó
+        :return: o embedding do nó
+        """
+        with self._lock:
+            return self._matriz[self._posicoes[text_id]].tolist()
+
+    def add(self, nodes: List[BaseNode], **add_kwargs: Any) -> List[str]:
+        if not nodes:
+            return []
+
+        novos = self._normalizar([node.get_embedding() for node in nodes])
+
+        with self._lock:
+            if self._n == 0 and self._matriz.shape[1] != novos.shape[1]:
+                self._matriz = np.empty((0, novos.shape[1]), dtype=np.float32)
+            elif novos.shape[1] != self._matriz.shape[1]:
+                raise ValueError(f"Dimensão dos embeddings ({novos.shape[1]}) diferente da dimensão do índice "
+                                 f"({self._matriz.shape[1]}).")
+
+            # As listas de ids são substituídas, e não alteradas, para que as consultas em andamento continuem vendo
+            # as listas que obtiveram. As novas linhas ficam além do tamanho visto por essas consultas.
+            ids = list(self._ids)
+            ref_doc_ids = list(self._ref_doc_ids)
+            matriz_copiada = False
+
+            for node, embedding in zip(nodes, novos):
+                ref_doc_id = node.ref_doc_id or "None"
+
+                # Substituindo o embedding de um nó que já está no store. A matriz é copiada antes da primeira
+                # substituição, pois as consultas em andamento leem as linhas já existentes da matriz anterior.
+                if node.node_id in self._posicoes:
+                    posicao = self._posicoes[node.node_id]
+                    if not matriz_copiada:
+                        self._matriz = self._matriz.copy()
+                        matriz_copiada = True
+                    self._matriz[posicao] = embedding
+
+                    # Atualizando o documento de origem do nó, caso ele tenha mudado
+                    anterior = ref_doc_ids[posicao]
+                    if anterior != ref_doc_id:
+                        nos_anterior = self._por_documento.get(anterior, set())
+                        nos_anterior.discard(node.node_id)
+                        if not nos_anterior:
+                            self._por_documento.pop(anterior, None)
+                        self._por_documento.setdefault(ref_doc_id, set()).add(node.node_id)
+                        ref_doc_ids[posicao] = ref_doc_id
+                    continue
+
+                # Dobrando a capacidade da matriz quando ela está cheia, para que as inserções sejam O(1) amortizado
+                if self._n == self._matriz.shape[0]:
+                    matriz = np.empty((max(16, 2 * self._n), self._matriz.shape[1]), dtype=np.float32)
+                    matriz[:self._n] = self._matriz[:self._n]
+                    self._matriz = matriz
+
+                self._matriz[self._n] = embedding
+                self._posicoes[node.node_id] = self._n
+                ids.append(node.node_id)
+                ref_doc_ids.append(ref_doc_id)
+                self._por_documento.setdefault(ref_doc_id, set()).add(node.node_id)
+                self._n += 1
+
+            self._ids = ids
+            self._ref_doc_ids = ref_doc_ids
+
+        return [node.node_id for node in nodes]
+
+    def delete(self, ref_doc_id: str, **delete_kwargs: Any) -> None:
+        with self._lock:
+            removidos = self._por_documento.pop(ref_doc_id, set())
+            if removidos:
+                mantidos = np.ones(self._n, dtype=bool)
+                mantidos[[self._posicoes[node_id] for node_id in removidos]] = False
+                self._manter_linhas(mantidos)
+
+    def _manter_linhas(self, mantidos: np.ndarray) -> None:
+        """
+        Mantém apenas as linhas indicadas. São criadas uma nova matriz e uma nova lista de ids, sem alterar as
+        anteriores, que podem estar em uso por consultas em andamento.
+        :param mantidos: máscara booleana das linhas mantidas
+        :return: None
+        """
+        self._matriz = self._matriz[:self._n][mantidos]
+        self._ids = [node_id for node_id, manter in zip(self._ids, mantidos) if manter]
+        self._ref_doc_ids = [ref_doc_id for ref_doc_id, manter in zip(self._ref_doc_ids, mantidos) if manter]
+        self._posicoes = {node_id: i for i, node_id in enumerate(self._ids)}
+        self._n = len(self._ids)
+
+    def _validar(self, query: VectorStoreQuery) -> None:
+        """
+        Verifica se a query utiliza apenas recursos suportados pelo store.
+        :param query: a query
+        :return: None
+        """
+        if query.mode != VectorStoreQueryMode.DEFAULT:
+            raise ValueError(f"Modo de consulta {query.mode} não suportado pelo NumpyVectorStore.")
+        if query.filters is not None:
+            raise ValueError("O NumpyVectorStore não suporta filtros de metadados.")
+
+    def _candidatos(self, node_ids: Optional[Sequence[str]]) -> Optional[np.ndarray]:
+        """
+        Converte a restrição de ids da query em posições da matriz.
+        :param node_ids: os ids aos quais a busca deve se restringir (None para todos os nós)
+        :return: as posições dos nós, ou None para todos os nós
+        """
+        if node_ids is None:
+            return None
+
+        return np.array([self._posicoes[node_id] for node_id in node_ids if node_id in self._posicoes], dtype=np.int64)
+
+    def query(self, query: VectorStoreQuery, **kwargs: Any) -> VectorStoreQueryResult:
+        self._validar(query)
+
+        return self.query_batch([query.query_embedding], query.similarity_top_k, query.node_ids)[0]
+
+    def query_batch(self, query_embeddings: Sequence[Sequence[float]], similarity_top_k: int = 3,
+                    node_ids: Optional[Sequence[str]] = None) -> List[VectorStoreQueryResult]:
+        """
+        Busca os nós mais similares a várias queries de uma só vez, com um único produto entre matrizes.
+        :param query_embeddings: os embeddings das queries
+        :param similarity_top_k: o número de nós retornados para cada query
+        :param node_ids: os ids aos quais a busca deve se restringir (None para todos os nós)
+        :return: o resultado de cada query, na ordem das queries
+        """
+        queries = self._normalizar(np.atleast_2d(query_embeddings))
+
+        # Obtendo uma visão consistente da matriz e dos ids, que não são alterados pelas escritas posteriores
+        with self._lock:
+            matriz = self._matriz[:self._n]
+            ids = self._ids
+            candidatos = self._candidatos(node_ids)
+
+        if candidatos is not None:
+            matriz = matriz[candidatos]
+            ids = [ids[i] for i in candidatos]
+
+        k = min(similarity_top_k, len(ids))
+        if k == 0:
+            return [VectorStoreQueryResult(similarities=[], ids=[]) for _ in queries]
+
+        topo, scores_topo = top_k(queries @ matriz.T, k)
+
+        return [VectorStoreQueryResult(similarities=linha_scores.tolist(), ids=[ids[i] for i in linha])
+                for linha, linha_scores in zip(topo, scores_topo)]
+
+    def persist(self, persist_path: str, fs: Optional[fsspec.AbstractFileSystem] = None) -> None:
+        """
+        Salva a matriz de embeddings em um arquivo .npy e os ids dos nós em um arquivo .json, ao lado de persist_path.
+        :param persist_path: o caminho do vector store indicado pelo StorageContext
+        :param fs: não utilizado, os arquivos são salvos no sistema de arquivos local
+        :return: None
+        """
+        base = os.path.splitext(persist_path)[0]
+        diretorio = os.path.dirname(base)
+        if diretorio and not os.path.exists(diretorio):
+            os.makedirs(diretorio)
+
+        with self._lock:
+            matriz = self._matriz[:self._n].copy()
+            dados = {'ids': list(self._ids), 'ref_doc_ids': list(self._ref_doc_ids)}
+
+        # Escrevendo em arquivos temporários e renomeando, para que uma interrupção não corrompa o índice
+        with open(base + '.npy.tmp', 'wb') as arquivo:
+            np.save(arquivo, matriz)
+        with open(base + '.ids.json.tmp', 'w', encoding='utf-8') as arquivo:
+            json.dump(dados, arquivo)
+        os.replace(base + '.npy.tmp', base + '.npy')
+        os.replace(base + '.ids.json.tmp', base + '.ids.json')
+
+    @classmethod
+    def from_persist_path(cls, persist_path: str) -> "NumpyVectorStore":
+        """
+        Carrega o vector store salvo por persist.
+        :param persist_path: o caminho do vector store indicado pelo StorageContext
+        :return: o vector store carregado
+        """
+        base = os.path.splitext(persist_path)[0]
+        if not os.path.exists(base + '.npy'):
+            raise ValueError(f"NumpyVectorStore não encontrado em {base}.npy.")
+
+        with open(base + '.ids.json', 'r', encoding='utf-8') as arquivo:
+            dados = json.load(arquivo)
+
+        return cls(np.load(base + '.npy'), dados['ids'], dados['ref_doc_ids'])
+
+    @classmethod
+    def from_persist_dir(cls, persist_dir: str) -> "NumpyVectorStore":
+        """
+        Carrega o vector store salvo junto ao índice persistido em persist_dir.
+        :param persist_dir: o diretório onde o índice foi persistido
+        :return: o vector store carregado
+        """
+        return cls.from_persist_path(os.path.join(persist_dir, NUMPY_VECTOR_STORE_BASENAME + '.json'))
@@ -0,0 +1,112 @@
+import re
+import time
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, Hashable, List, Optional, Tuple
+
+# Políticas de descarte suportadas pelo cache
+POLITICAS = ('lru', 'fifo')
+
+
+def normalize_query(query: str) -> str:
+    """
+    Normaliza a query do usuário, para que variações irrelevantes (maiúsculas, espaços e pontuação final) resultem na
+    mesma chave de cache.
+    :param query: a query do usuário
+    :return: a query normalizada
+    """
+    query = unicodedata.normalize('NFC', query).lower().strip()
+    query = re.sub(r'\s+', ' ', query)
+
+    return query.rstrip('?!.;, ')
+
+
+class RetrievalCache:
+    def __init__(self, max_entries: int = 1024, ttl: Optional[float] = 3600, policy: str = 'lru'):
+        """
+        Classe que armazena os resultados das recuperações de nós, evitando que a mesma pergunta seja embedada e
+        buscada no índice novamente. O cache é limitado em número de entradas, descartando as entradas conforme a
+        política escolhida, e cada entrada expira após ttl segundos. É seguro para uso por várias threads.
+        :param max_entries: número máximo de entradas armazenadas
+        :param ttl: tempo, em segundos, após o qual uma entrada expira (None para não expirar)
+        :param policy: política de descarte quando o cache está cheio: 'lru' (a entrada usada há mais tempo) ou 'fifo'
+        (a entrada inserida há mais tempo)
+        """
+        if policy not in POLITICAS:
+            raise ValueError(f"Política de descarte {policy} inválida. Utilize um dos valores: {POLITICAS}.")
+
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.policy = policy
+
+        self._lock = threading.Lock()
+        self._entradas: "OrderedDict[Hashable, Tuple[float, List[str]]]" = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+        self._descartes = 0
+        self._expiracoes = 0
+
+    def get(self, key: Hashable) -> Optional[List[str]]:
+        """
+        Busca o resultado armazenado para a chave.
+        :param key: a chave da recuperação
+        :return: uma cópia dos materiais armazenados, ou None caso a chave não esteja no cache ou tenha expirado
+        """
+        with self._lock:
+            entrada = self._entradas.get(key)
+            if entrada is None:
+                self._misses += 1
+                return None
+
+            inserido_em, materiais = entrada
+            if self.ttl is not None and time.monotonic() - inserido_em > self.ttl:
+                del self._entradas[key]
+                self._expiracoes += 1
+                self._misses += 1
+                return None
+
+            if self.policy == 'lru':
+                self._entradas.move_to_end(key)
+
+            self._hits += 1
+            return list(materiais)
+
+    def put(self, key: Hashable, materials: List[str]) -> None:
+        """
+        Armazena o resultado de uma recuperação, descartando entradas caso o cache esteja cheio.
+        :param key: a chave da recuperação
+        :param materials: os materiais recuperados
+        :return: None
+        """
+        with self._lock:
+            self._entradas[key] = (time.monotonic(), list(materials))
+            self._entradas.move_to_end(key)
+
+            while len(self._entradas) > self.max_entries:
+                self._entradas.popitem(last=False)
+                self._descartes += 1
+
+    def invalidate(self, index_id: Optional[str] = None) -> None:
+        """
+        Remove as entradas de um índice, ou todas as entradas.
+        :param index_id: identificador do índice cujas entradas serão removidas. As chaves devem ser tuplas cujo
+        segundo elemento é o identificador do índice. (None para remover todas as entradas)
+        :return: None
+        """
+        with self._lock:
+            if index_id is None:
+                self._entradas.clear()
+                return
+
+            for key in [key for key in self._entradas if key[1] == index_id]:
+                del self._entradas[key]
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Retorna as métricas de uso do cache.
+        :return: dicionário com o número de hits, misses, descartes, expirações e entradas armazenadas
+        """
+        with self._lock:
+            return {'hits': self._hits, 'misses': self._misses, 'descartes': self._descartes,
+                    'expiracoes': self._expiracoes, 'entradas': len(self._entradas)}
@@ -1,5 +1,12 @@
-from data_indexing.indexing_tools import index_video, index_img, index_exercicios, index_pdf
+from data_indexing.indexing_tools import index_video, index_img, index_exercicios, index_pdf, get_index, \
+    configure_indexing_embeddings, configure_vector_store, VECTOR_STORES
+from data_indexing.ivf_vector_store import IVFVectorStore, recall_report
+from data_indexing.embedding_cache import configure_embedding_cache
+from llm.openai_client import configure_openai_client, create_openai_embedding
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import argparse
+import time
+from typing import List, Optional
 
 
 def main():
@@ -68,28 +75,191 @@ def main():
         help="O caminho onde o índice do PDF será salvo",
     )
 
+    parser.add_argument(
+        "--embedding-cache",
+        required=False,
+        type=str,
+        default="results/embedding_cache.sqlite",
+        help="O caminho do cache de embeddings em disco, que evita embedar novamente textos já embedados",
+    )
+
+    parser.add_argument(
+        "--workers",
+        required=False,
+        type=int,
+        default=4,
+        help="O número de fontes indexadas simultaneamente",
+    )
+
+    parser.add_argument(
+        "--embed-batch-size",
+        required=False,
+        type=int,
+        default=64,
+        help="O número de textos enviados em cada requisição ao modelo de embedding",
+    )
+
+    parser.add_argument(
+        "--embed-concurrency",
+        required=False,
+        type=int,
+        default=4,
+        help="O número máximo de requisições de embedding simultâneas, somando todas as fontes",
+    )
+
+    parser.add_argument(
+        "--vector-store",
+        required=False,
+        type=str,
+        choices=VECTOR_STORES,
+        default="numpy",
+        help="O vector store dos índices. Alterá-lo faz com que os índices sejam reconstruídos.",
+    )
+
+    parser.add_argument(
+        "--ivf-nlist",
+        required=False,
+        type=int,
+        default=None,
+        help="O número de clusters dos índices com busca aproximada (por padrão, a raiz do número de chunks)",
+    )
+
+    parser.add_argument(
+        "--ivf-nprobe",
+        required=False,
+        type=int,
+        default=None,
+        help="O número de clusters visitados por consulta nos índices com busca aproximada (por padrão, o valor salvo "
+             "no índice, ou 8 nos índices novos). Valores maiores aumentam o recall e o tempo de cada consulta.",
+    )
+
+    parser.add_argument(
+        "--recall-report",
+        action="store_true",
+        help="Compara, para cada índice com busca aproximada, o recall e o tempo das consultas com a busca exata",
+    )
+
+    parser.add_argument(
+        "--openai-rpm",
+        required=False,
+        type=float,
+        default=None,
+        help="O número máximo de requisições por minuto à API da OpenAI, compartilhado por todo o processo",
+    )
+
+    parser.add_argument(
+        "--openai-tpm",
+        required=False,
+        type=float,
+        default=None,
+        help="O número máximo de tokens (estimados) por minuto enviados à API da OpenAI, compartilhado por todo o "
+             "processo",
+    )
+
+    parser.add_argument(
+        "--openai-base-url",
+        required=False,
+        type=str,
+        default=None,
+        help="O endereço da API da OpenAI (por exemplo, um servidor local de testes)",
+    )
+
     args = parser.parse_args()
 
-    # Rodando a indexação de todos os tipos de dados
+    # Utilizando o modelo de embedding da OpenAI pelo cliente compartilhado do processo, com o cache de embeddings em
+    # disco
+    configure_openai_client(args.openai_rpm, args.openai_tpm, base_url=args.openai_base_url)
+    configure_embedding_cache(args.embedding_cache, create_openai_embedding())
+    configure_indexing_embeddings(args.embed_batch_size, args.embed_concurrency)
+    configure_vector_store(args.vector_store, nlist=args.ivf_nlist, nprobe=args.ivf_nprobe)
+
+    # Rodando a indexação de todos os tipos de dados, com até args.workers fontes em paralelo
+    fontes = {
+        'vídeo': (index_video, args.video_path, args.persist_video),
+        'imagem': (index_img, args.img_path, args.persist_img),
+        'exercícios': (index_exercicios, args.exerc_path, args.persist_exerc),
+        'PDF': (index_pdf, args.pdf_path, args.persist_pdf),
+    }
 
-    print("Indexando o vídeo...\n")
-    index_video(args.video_path, args.persist_video)
-    print("Indexação do vídeo concluída.\n")
+    inicio = time.perf_counter()
+    resumos = {}
+    falhas = {}
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        futures = {}
+        for nome, (indexar, caminho, persist_dir) in fontes.items():
+            print(f"Indexando {nome}...\n")
+            futures[executor.submit(indexar, caminho, persist_dir)] = nome
 
-    print("Indexando a imagem...\n")
-    index_img(args.img_path, args.persist_img)
-    print("Indexação da imagem concluída.\n")
+        for future in as_completed(futures):
+            nome = futures[future]
+            try:
+                resumos[nome] = future.result()
+                print(f"Indexação de {nome} concluída.\n")
+            except Exception as erro:
+                falhas[nome] = erro
+                print(f"Falha na indexação de {nome}: {erro}\n")
 
-    print("Indexando os exercícios...\n")
-    index_exercicios(args.exerc_path, args.persist_exerc)
-    print("Indexação dos exercícios concluída.\n")
+    duracao = time.perf_counter() - inicio
 
-    print("Indexando o PDF...\n")
-    index_pdf(args.pdf_path, args.persist_pdf)
-    print("Indexação do PDF concluída.\n")
+    print(relatorio_vazao({nome: resumos[nome] for nome in fontes if nome in resumos}, duracao,
+                          [nome for nome in fontes if nome in falhas]))
+
+    if args.recall_report:
+        for nome, (_, _, persist_dir) in fontes.items():
+            if nome in falhas:
+                continue
+            store = get_index(persist_dir).vector_store
+            if isinstance(store, IVFVectorStore):
+                print(relatorio_recall(nome, store))
+
+    if falhas:
+        raise SystemExit(f"Não foi possível indexar: {', '.join(falhas)}.")
 
     print("Todos os dados foram indexados com sucesso!")
 
 
+def relatorio_recall(nome: str, store: IVFVectorStore) -> str:
+    """
+    Monta o relatório de recall da busca aproximada de um índice.
+    :param nome: o nome da fonte
+    :param store: o vector store do índice
+    :return: o relatório formatado
+    """
+    if not store.trained:
+        return f"O índice de {nome} é pequeno e utiliza a busca exata.\n"
+
+    linhas = [f"Recall@3 da busca aproximada de {nome}:",
+              f"{'nprobe':>8}{'Recall':>9}{'Visitado':>10}{'ms aprox.':>11}{'ms exato':>10}"]
+    for linha in recall_report(store, similarity_top_k=3):
+        linhas.append(f"{linha['nprobe']:>8}{linha['recall']:>9.3f}{linha['fracao_visitada']:>10.1%}"
+                      f"{linha['ms_aproximado']:>11.2f}{linha['ms_exato']:>10.2f}")
+
+    return '\n'.join(linhas) + '\n'
+
+
+def relatorio_vazao(resumos: dict, duracao: float, falhas: Optional[List[str]] = None) -> str:
+    """
+    Monta o relatório de vazão da indexação de cada fonte.
+    :param resumos: os resumos retornados pela indexação de cada fonte, indexados pelo nome da fonte
+    :param duracao: a duração total, em segundos, da indexação de todas as fontes
+    :param falhas: os nomes das fontes cuja indexação falhou
+    :return: o relatório formatado
+    """
+    linhas = [f"{'Fonte':<12}{'Chunks':>8}{'Embedados':>11}{'Tempo (s)':>11}{'Chunks/s':>11}{'Embeddings/s':>14}"]
+    for nome, resumo in resumos.items():
+        chunks = resumo['chunks_embedados'] + resumo['chunks_reaproveitados']
+        chunks_por_segundo = chunks / resumo['segundos'] if resumo['segundos'] else 0.0
+        embeddings_por_segundo = (resumo['chunks_embedados'] / resumo['segundos_embedding']
+                                  if resumo['segundos_embedding'] else 0.0)
+        linhas.append(f"{nome:<12}{chunks:>8}{resumo['chunks_embedados']:>11}{resumo['segundos']:>11.2f}"
+                      f"{chunks_por_segundo:>11.1f}{embeddings_por_segundo:>14.1f}")
+    for nome in falhas or []:
+        linhas.append(f"{nome:<12}{'falhou':>8}")
+
+    linhas.append(f"\nTempo total: {duracao:.2f} s\n")
+
+    return '\n'.join(linhas)
+
+
 if __name__ == '__main__':
     main()
@@ -0,0 +1,125 @@
+import asyncio
+import threading
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+
+# Instâncias criadas, indexadas pelo nome, para a consulta das métricas
+_instancias: Dict[str, "SingleFlight"] = {}
+_lock_instancias = threading.Lock()
+
+
+class SingleFlight:
+    def __init__(self, name: str):
+        """
+        Classe que evita que chamadas simultâneas e idênticas sejam executadas mais de uma vez: a primeira chamada de uma
+        chave executa a computação e as chamadas que chegam enquanto ela está em andamento aguardam e recebem o mesmo
+        resultado (ou o mesmo erro). Ao terminar, a chave é liberada, de forma que chamadas posteriores executam a
+        computação novamente (ou encontram o resultado no cache). É seguro para uso por várias threads e por corrotinas.
+        :param name: o nome da computação, utilizado nas métricas
+        """
+        self.name = name
+
+        self._lock = threading.Lock()
+        self._em_andamento: Dict[Hashable, Future] = {}
+        self._chamadas = 0
+        self._agrupadas = 0
+
+        with _lock_instancias:
+            _instancias[name] = self
+
+    def begin(self, key: Hashable) -> Tuple[Future, bool]:
+        """
+        Registra uma chamada da chave. Quem recebe leader igual a True deve executar a computação e encerrá-la com
+        finish; os demais apenas aguardam o future.
+        :param key: a chave da computação
+        :return: o future com o resultado da computação e um booleano que indica se a chamada deve executá-la
+        """
+        with self._lock:
+            self._chamadas += 1
+            future = self._em_andamento.get(key)
+            if future is not None:
+                self._agrupadas += 1
+                return future, False
+
+            future = Future()
+            self._em_andamento[key] = future
+            return future, True
+
+    def finish(self, key: Hashable, future: Future, result: Any = None, error: BaseException = None) -> None:
+        """
+        Encerra a computação da chave, entregando o resultado (ou o erro) a todas as chamadas que a aguardam.
+        :param key: a chave da computação
+        :param future: o future retornado por begin
+        :param result: o resultado da computação
+        :param error: o erro da computação (None em caso de sucesso)
+        :return: None
+        """
+        with self._lock:
+            if self._em_andamento.get(key) is future:
+                del self._em_andamento[key]
+
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def do(self, key: Hashable, function: Callable[[], Any]) -> Any:
+        """
+        Executa a computação da chave, ou aguarda a computação idêntica que já está em andamento.
+        :param key: a chave da computação
+        :param function: a computação
+        :return: o resultado da computação
+        """
+        future, leader = self.begin(key)
+        if not leader:
+            return future.result()
+
+        try:
+            resultado = function()
+        except BaseException as e:
+            self.finish(key, future, error=e)
+            raise
+
+        self.finish(key, future, resultado)
+        return resultado
+
+    async def ado(self, key: Hashable, function: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Versão assíncrona de do, que aguarda a computação em andamento sem bloquear o event loop. As chamadas assíncronas
+        e as síncronas da mesma chave são agrupadas entre si.
+        :param key: a chave da computação
+        :param function: a função que retorna a corrotina da computação
+        :return: o resultado da computação
+        """
+        future, leader = self.begin(key)
+        if not leader:
+            return await asyncio.wrap_future(future)
+
+        try:
+            resultado = await function()
+        except BaseException as e:
+            self.finish(key, future, error=e)
+            raise
+
+        self.finish(key, future, resultado)
+        return resultado
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Retorna as métricas do agrupamento.
+        :return: dicionário com o número de chamadas, de chamadas agrupadas (que aguardaram uma computação já em
+        andamento, em vez de executá-la) e de computações em andamento
+        """
+        with self._lock:
+            return {'chamadas': self._chamadas, 'agrupadas': self._agrupadas, 'em_andamento': len(self._em_andamento)}
+
+
+def get_single_flight_stats() -> Dict[str, Dict[str, int]]:
+    """
+    Retorna as métricas de todas as computações agrupadas do processo (por exemplo, recuperações e embeddings).
+    :return: as métricas de cada computação, indexadas pelo nome
+    """
+    with _lock_instancias:
+        instancias = list(_instancias.values())
+
+    return {instancia.name: instancia.stats() for instancia in instancias}
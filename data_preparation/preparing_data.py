@@ -1,7 +1,10 @@
-from openai import OpenAI
 import os
 import json
 import pandas as pd
+from typing import Optional
+
+from data_preparation.transcription import TranscriptionBackend, transcribe_video
+from llm.openai_client import get_openai_client
 
 from dotenv import load_dotenv
 
@@ -9,51 +12,46 @@ load_dotenv(".env")
 
 
 def prepare_video(video_path: str = "./resources/Dica do professor.mp4",
-                  txt_to_save: str = "./data/video/video.txt") -> None:
+                  txt_to_save: str = "./data/video/video.txt", backend: Optional[TranscriptionBackend] = None,
+                  window_seconds: float = 600, overlap_seconds: float = 30, max_workers: int = 4) -> None:
     """
     Função que prepara o conteúdo do vídeo para ser utilizado em um modelo de geração de texto (LLM). A função irá transcrever o áudio do vídeo, segmentar o texto em frases e, em seguida, agrupar as frases em parágrafos. Por fim, a função irá salvar o conteúdo em um arquivo txt, que conterá o texto do parágrafo, os timestamps de início e fim do parágrafo e um link para o vídeo, que já estará na minutagem do conteúdo em questão.
     :param video_path: o caminho do vídeo que será utilizado para transcrição
     :param txt_to_save: o caminho do arquivo txt que irá armazenar o conteúdo do vídeo
+    :param backend: o serviço de transcrição (por padrão, o Whisper da API da OpenAI)
+    :param window_seconds: a duração, em segundos, das janelas de áudio transcritas separadamente
+    :param overlap_seconds: a sobreposição, em segundos, entre janelas consecutivas
+    :param max_workers: o número máximo de janelas transcritas simultaneamente
     :return: None
     """
 
-    # Obtendo a transcrição do vídeo em segmentos, juntamente com os timestamps de cada segmento.
-    client = OpenAI()
-
-    audio_file = open(video_path, "rb")
-    transcript = client.audio.transcriptions.create(
-        file=audio_file,
-        model="whisper-1",
-        response_format="verbose_json",
-        timestamp_granularities=["segment"],
-        language='pt'
-    )
-
-    # Organizando os segmentos e os timestamps em uma lista
-    segmentos = []
-    for t in transcript.segments:
-        segmentos.append([t['text'], t['start'], t['end']])
+    # Obtendo a transcrição do vídeo em segmentos, juntamente com os timestamps de cada segmento. O áudio é dividido em
+    # janelas sobrepostas, transcritas em paralelo, e os segmentos são reunidos na ordem do vídeo.
+    segmentos = transcribe_video(video_path, backend, window_seconds=window_seconds, overlap_seconds=overlap_seconds,
+                                 max_workers=max_workers)
 
     # Juntando os segmentos que não terminam com ponto final com os segmentos que terminam com ponto final, formando,
     # assim, frases.
     frases = []  # criando a lista para armazenar as frases
-    frase = ''  # string que irá representar as frases que serão formadas
+    partes = []  # lista com os segmentos da frase que está sendo formada
     inicio = 0  # variável que irá armazenar o timestamp de início de cada frase
 
     # Iterando sobre os segmentos para formar as frases
-    for i, r in enumerate(segmentos):
+    for texto, inicio_segmento, fim_segmento in segmentos:
 
-        # Se o segmento não terminar com ponto final, adicione-o à frase
-        if not r[0].endswith('.'):
-            frase += r[0] + ' '
+        # Captando o timestamp de início da frase no seu primeiro segmento
+        if not partes:
+            inicio = inicio_segmento
+        partes.append(texto)
 
-        # Se o segmento terminar com ponto final, adicione-o à frase e armazene a frase formada na lista de frases.
-        # Em seguida, reinicie a variável frase e capte o timestamp de início da próxima frase.
-        else:
-            frase += r[0]
-            frases.append([frase, inicio, r[2]])
-            inicio = segmentos[i + 1][1]
-            frase = ''
+        # Se o segmento terminar com ponto final, armazene a frase formada na lista de frases e reinicie a frase
+        if texto.endswith('.'):
+            frases.append([' '.join(partes), inicio, fim_segmento])
+            partes = []
+
+    # Armazenando o trecho final, caso o último segmento não termine com ponto final
+    if partes:
+        frases.append([' '.join(partes), inicio, segmentos[-1][2]])
 
     # Acumulando 4 frases para formar um parágrafo
     paragrafos = []
@@ -61,26 +59,20 @@ def prepare_video(video_path: str = "./resources/Dica do professor.mp4",
     # Iterando sobre as frases para formar os parágrafos, de 4 em 4. Além disso, armazenando o timestamp de início e
     # fim de cada parágrafo.
     for i in range(0, len(frases), 4):
-        if i + 4 <= len(frases):
-            paragrafo = frases[i][0] + ' ' + frases[i + 1][0] + ' ' + frases[i + 2][0] + ' ' + frases[i + 3][0]
-            paragrafos.append([paragrafo, frases[i][1], frases[i + 3][2]])
-        else:
-            paragrafo = frases[i][0] + ' ' + frases[i + 1][0] + ' ' + frases[i + 2][0]
-            paragrafos.append([paragrafo, frases[i][1], frases[i + 2][2]])
+        grupo = frases[i:i + 4]
+        paragrafos.append([' '.join(frase[0] for frase in grupo), grupo[0][1], grupo[-1][2]])
 
-    # Criando uma string que irá ser armazenado em um txt, representando o conteúdo do vídeo.
-    string_video = ''
+    # Criando as partes da string que irá ser armazenada em um txt, representando o conteúdo do vídeo.
+    partes_video = []
 
     # Nessa string, terá o texto do parágrafo, os timestamps de início e fim do parágrafo e um link para o vídeo,
     # que já estará na minutagem do conteúdo em questão.
-    for i in range(len(paragrafos)):
-        inicio = paragrafos[i][1]
-        fim = paragrafos[i][2]
-        texto = paragrafos[i][0]
-
+    for texto, inicio, fim in paragrafos:
         link = f"(Para acessar o conteúdo, clique no link https://youtu.be/w3L27GhWLog&t={round(inicio)}. O vídeo já está na minutagem do conteúdo em questão e ele dura cerca de {round(fim - inicio)} segundos.)"
 
-        string_video += f"O seguinte texto foi dito entre os segundos {round(inicio)} e {round(fim)} do vídeo: {texto}\n{link}\n\n\n"
+        partes_video.append(f"O seguinte texto foi dito entre os segundos {round(inicio)} e {round(fim)} do vídeo: {texto}\n{link}\n\n\n")
+
+    string_video = ''.join(partes_video)
 
     # Verifica se a pasta que o txt vai ser salvo existe
     caminho = '/'.join(txt_to_save.split('/')[:-1])
@@ -104,8 +96,8 @@ def prepare_img(
     :return: None
     """
 
-    # Enviando a imagem para o GPT-4o para a extração de informações da imagem.
-    client = OpenAI()
+    # Enviando a imagem para o GPT-4o para a extração de informações da imagem, pelo cliente compartilhado do processo
+    client = get_openai_client()
     response = client.chat.completions.create(
         model="gpt-4o",
         messages=[
@@ -1,5 +1,12 @@
 from data_preparation.preparing_data import prepare_img, prepare_video, prepare_exercises
+from llm.openai_client import configure_openai_client
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
 import argparse
+import time
+
+# Etapas da preparação, na ordem em que são exibidas
+ETAPAS = ('video', 'imagem', 'exercicios')
 
 
 def main():
@@ -20,6 +27,31 @@ def main():
         help="O caminho onde o txt criado a partir do vídeo será salvo",
     )
 
+    parser.add_argument(
+        "--video-window",
+        required=False,
+        type=float,
+        default=600,
+        help="A duração, em segundos, das janelas de áudio do vídeo transcritas separadamente",
+    )
+
+    parser.add_argument(
+        "--video-overlap",
+        required=False,
+        type=float,
+        default=30,
+        help="A sobreposição, em segundos, entre janelas de áudio consecutivas. Deve ser maior que a duração dos "
+             "segmentos transcritos, para que uma fala cortada na borda de uma janela apareça inteira na seguinte.",
+    )
+
+    parser.add_argument(
+        "--video-workers",
+        required=False,
+        type=int,
+        default=4,
+        help="O número máximo de janelas de áudio transcritas simultaneamente",
+    )
+
     parser.add_argument(
         "--img-url",
         required=False,
@@ -53,24 +85,122 @@ def main():
         help="O caminho onde o txt criado a partir dos exercícios será salvo",
     )
 
+    parser.add_argument(
+        "--workers",
+        required=False,
+        type=int,
+        default=3,
+        help="O número de etapas executadas simultaneamente",
+    )
+
+    parser.add_argument(
+        "--only",
+        required=False,
+        nargs="+",
+        choices=ETAPAS,
+        default=None,
+        help="Executa apenas as etapas informadas",
+    )
+
+    parser.add_argument(
+        "--skip",
+        required=False,
+        nargs="+",
+        choices=ETAPAS,
+        default=[],
+        help="Não executa as etapas informadas",
+    )
+
+    parser.add_argument(
+        "--openai-rpm",
+        required=False,
+        type=float,
+        default=None,
+        help="O número máximo de requisições por minuto à API da OpenAI, compartilhado por todo o processo",
+    )
+
+    parser.add_argument(
+        "--openai-tpm",
+        required=False,
+        type=float,
+        default=None,
+        help="O número máximo de tokens (estimados) por minuto enviados à API da OpenAI, compartilhado por todo o "
+             "processo",
+    )
+
+    parser.add_argument(
+        "--openai-base-url",
+        required=False,
+        type=str,
+        default=None,
+        help="O endereço da API da OpenAI (por exemplo, um servidor local de testes)",
+    )
+
     args = parser.parse_args()
 
-    # Rodando a preparação de todos os tipos de dados
+    # Todas as etapas compartilham o pool de conexões e o limitador de requisições da OpenAI
+    configure_openai_client(args.openai_rpm, args.openai_tpm, base_url=args.openai_base_url)
+
+    etapas = {
+        'video': ('o vídeo', partial(prepare_video, window_seconds=args.video_window,
+                                     overlap_seconds=args.video_overlap, max_workers=args.video_workers),
+                  args.video_path, args.txt_video),
+        'imagem': ('a imagem', prepare_img, args.img_url, args.txt_img),
+        'exercicios': ('os exercícios', prepare_exercises, args.exerc_path, args.txt_exerc),
+    }
+    selecionadas = [etapa for etapa in ETAPAS if (args.only is None or etapa in args.only) and etapa not in args.skip]
 
-    print("Preparando o vídeo...\n")
-    prepare_video(args.video_path, args.txt_video)
-    print("Preparação do vídeo concluída.\n")
+    if not selecionadas:
+        print("Nenhuma etapa selecionada.")
+        return
 
-    print("Preparando a imagem...\n")
-    prepare_img(args.img_url, args.txt_img)
-    print("Preparação da imagem concluída.\n")
+    # Rodando a preparação dos tipos de dados selecionados, com até args.workers etapas em paralelo
+    inicio = time.perf_counter()
+    duracoes = {}
+    falhas = {}
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        futures = {}
+        for etapa in selecionadas:
+            descricao, preparar, entrada, saida = etapas[etapa]
+            print(f"Preparando {descricao}...\n")
+            futures[executor.submit(_executar_etapa, preparar, entrada, saida)] = etapa
 
-    print("Preparando os exercícios...\n")
-    prepare_exercises(args.exerc_path, args.txt_exerc)
-    print("Preparação dos exercícios concluída.\n")
+        for future in as_completed(futures):
+            etapa = futures[future]
+            descricao = etapas[etapa][0]
+            try:
+                duracoes[etapa] = future.result()
+                print(f"Preparação d{descricao} concluída em {duracoes[etapa]:.2f} s.\n")
+            except Exception as erro:
+                falhas[etapa] = erro
+                print(f"Falha na preparação d{descricao}: {erro}\n")
+
+    for etapa in selecionadas:
+        if etapa in duracoes:
+            print(f"{etapa:<12}{duracoes[etapa]:>10.2f} s")
+        else:
+            print(f"{etapa:<12}{'falhou':>12}")
+    print(f"\nTempo total: {time.perf_counter() - inicio:.2f} s\n")
+
+    if falhas:
+        raise SystemExit(f"Não foi possível preparar: {', '.join(falhas)}.")
 
     print("Todos os dados foram preparados com sucesso!")
 
 
+def _executar_etapa(preparar, entrada: str, saida: str) -> float:
+    """
+    Executa uma etapa da preparação, medindo o tempo gasto.
+    :param preparar: a função de preparação da etapa
+    :param entrada: o caminho (ou URL) do dado a ser preparado
+    :param saida: o caminho onde o txt preparado será salvo
+    :return: a duração da etapa, em segundos
+    """
+    inicio = time.perf_counter()
+    preparar(entrada, saida)
+
+    return time.perf_counter() - inicio
+
+
 if __name__ == '__main__':
     main()
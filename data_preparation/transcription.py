@@ -0,0 +1,220 @@
+import os
+import json
+import shutil
+import tempfile
+import subprocess
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+# Segmento transcrito: (texto, início em segundos, fim em segundos)
+Segmento = Tuple[str, float, float]
+
+# Distância, em segundos, da borda de uma janela abaixo da qual um segmento é considerado cortado pela borda
+_TOLERANCIA_BORDA = 0.5
+
+
+class TranscriptionBackend(ABC):
+    """
+    Classe base dos serviços de transcrição de áudio. Cada implementação recebe o caminho de um arquivo de áudio e
+    retorna os segmentos transcritos, com os timestamps relativos ao início do arquivo. Novas implementações (por
+    exemplo, um modelo local ou uma transcrição fixa para testes) podem ser passadas à transcribe_video.
+    """
+
+    @abstractmethod
+    def transcribe(self, audio_path: str, language: str = 'pt') -> List[Segmento]:
+        """
+        Transcreve um arquivo de áudio.
+        :param audio_path: o caminho do arquivo de áudio
+        :param language: o idioma falado no áudio
+        :return: a lista de segmentos transcritos, em ordem
+        """
+
+
+class OpenAIWhisperBackend(TranscriptionBackend):
+    def __init__(self, model: str = 'whisper-1', client=None):
+        """
+        Transcrição utilizando o Whisper da API da OpenAI.
+        :param model: o modelo de transcrição
+        :param client: o cliente da OpenAI (por padrão, o cliente compartilhado pelo processo)
+        """
+        if client is None:
+            from llm.openai_client import get_openai_client
+            client = get_openai_client()
+
+        self.model = model
+        self.client = client
+
+    def transcribe(self, audio_path: str, language: str = 'pt') -> List[Segmento]:
+        with open(audio_path, 'rb') as audio_file:
+            transcript = self.client.audio.transcriptions.create(
+                file=audio_file,
+                model=self.model,
+                response_format="verbose_json",
+                timestamp_granularities=["segment"],
+                language=language
+            )
+
+        return [(_campo(t, 'text'), float(_campo(t, 'start')), float(_campo(t, 'end'))) for t in transcript.segments]
+
+
+class LocalWhisperBackend(TranscriptionBackend):
+    def __init__(self, model: str = 'base'):
+        """
+        Transcrição utilizando o Whisper localmente, através do pacote openai-whisper, sem chamadas à API.
+        :param model: o tamanho do modelo do Whisper (tiny, base, small, medium ou large)
+        """
+        try:
+            import whisper
+        except ImportError:
+            raise ValueError("O pacote openai-whisper não está instalado. Instale-o com pip install openai-whisper.")
+
+        self.model = whisper.load_model(model)
+
+    def transcribe(self, audio_path: str, language: str = 'pt') -> List[Segmento]:
+        resultado = self.model.transcribe(audio_path, language=language)
+
+        return [(t['text'], float(t['start']), float(t['end'])) for t in resultado['segments']]
+
+
+def _campo(segmento, nome: str):
+    """
+    Obtém um campo do segmento retornado pela API, que pode vir como dicionário ou como objeto.
+    :param segmento: o segmento
+    :param nome: o nome do campo
+    :return: o valor do campo
+    """
+    if isinstance(segmento, dict):
+        return segmento[nome]
+
+    return getattr(segmento, nome)
+
+
+def audio_duration(video_path: str) -> float:
+    """
+    Obtém a duração do áudio de um vídeo, utilizando o ffprobe.
+    :param video_path: o caminho do vídeo
+    :return: a duração, em segundos
+    """
+    saida = subprocess.run(['ffprobe', '-v', 'error', '-show_entries', 'format=duration', '-of', 'json', video_path],
+                           check=True, capture_output=True, text=True).stdout
+
+    return float(json.loads(saida)['format']['duration'])
+
+
+def extract_audio(video_path: str, audio_path: str, start: float, duration: float) -> None:
+    """
+    Extrai um trecho do áudio de um vídeo em um arquivo mp3 mono de 16 kHz, formato compacto o suficiente para que uma
+    janela de vários minutos fique abaixo do limite de upload da API de transcrição.
+    :param video_path: o caminho do vídeo
+    :param audio_path: o caminho do arquivo de áudio a ser criado
+    :param start: o início do trecho, em segundos
+    :param duration: a duração do trecho, em segundos
+    :return: None
+    """
+    subprocess.run(['ffmpeg', '-y', '-v', 'error', '-ss', str(start), '-t', str(duration), '-i', video_path, '-vn',
+                    '-ac', '1', '-ar', '16000', '-b:a', '64k', audio_path], check=True)
+
+
+def split_windows(duration: float, window_seconds: float = 600,
+                  overlap_seconds: float = 30) -> List[Tuple[float, float]]:
+    """
+    Divide a duração do áudio em janelas consecutivas que se sobrepõem, para que uma fala cortada no fim de uma janela
+    apareça inteira na janela seguinte.
+    :param duration: a duração do áudio, em segundos
+    :param window_seconds: a duração de cada janela, em segundos
+    :param overlap_seconds: a sobreposição entre janelas consecutivas, em segundos
+    :return: a lista de janelas, como tuplas (início, duração)
+    """
+    if duration <= 0:
+        raise ValueError("A duração do áudio deve ser maior que zero.")
+    if overlap_seconds >= window_seconds:
+        raise ValueError("A sobreposição deve ser menor que a duração da janela.")
+
+    janelas = []
+    inicio = 0.0
+    while True:
+        janelas.append((inicio, min(window_seconds, duration - inicio)))
+        if inicio + window_seconds >= duration:
+            break
+        inicio += window_seconds - overlap_seconds
+
+    return janelas
+
+
+def stitch_segments(windows: List[Tuple[float, float]], transcriptions: List[List[Segmento]]) -> List[Segmento]:
+    """
+    Junta as transcrições das janelas em uma única transcrição, convertendo os timestamps para o tempo do vídeo. Os
+    segmentos que tocam a borda de uma janela (uma fala cortada pelo início ou pelo fim do trecho) são descartados, pois
+    aparecem inteiros na janela vizinha. Os segmentos transcritos inteiros nas duas janelas de uma sobreposição são
+    atribuídos à janela em que está o seu ponto médio, de modo que não sejam duplicados. Para que nenhuma fala seja
+    perdida, a sobreposição deve ser maior que a duração dos segmentos.
+    :param windows: as janelas, como tuplas (início, duração)
+    :param transcriptions: os segmentos transcritos de cada janela, com timestamps relativos à janela
+    :return: os segmentos do vídeo inteiro, em ordem
+    """
+    def pertence(i: int, inicio: float, fim: float) -> bool:
+        meio = (inicio + fim) / 2
+
+        # Sobreposição com a janela anterior, que vai de início da janela i ao fim da janela i - 1
+        if i > 0:
+            comeco, final = windows[i][0], windows[i - 1][0] + windows[i - 1][1]
+            if inicio <= comeco + _TOLERANCIA_BORDA:
+                return False
+            if fim < final - _TOLERANCIA_BORDA and meio < (comeco + final) / 2:
+                return False
+
+        # Sobreposição com a janela seguinte, que vai do início da janela i + 1 ao fim da janela i
+        if i < len(windows) - 1:
+            comeco, final = windows[i + 1][0], windows[i][0] + windows[i][1]
+            if fim >= final - _TOLERANCIA_BORDA:
+                return False
+            if inicio > comeco + _TOLERANCIA_BORDA and meio >= (comeco + final) / 2:
+                return False
+
+        return True
+
+    segmentos = []
+    for i, ((inicio_janela, _), transcricao) in enumerate(zip(windows, transcriptions)):
+        for texto, inicio, fim in transcricao:
+            inicio, fim = inicio + inicio_janela, fim + inicio_janela
+            if pertence(i, inicio, fim):
+                segmentos.append((texto, inicio, fim))
+
+    return segmentos
+
+
+def transcribe_video(video_path: str, backend: Optional[TranscriptionBackend] = None, language: str = 'pt',
+                     window_seconds: float = 600, overlap_seconds: float = 30, max_workers: int = 4) -> List[Segmento]:
+    """
+    Transcreve o áudio de um vídeo em janelas sobrepostas, transcritas em paralelo. Cada janela é extraída para um
+    arquivo temporário, enviada ao serviço de transcrição e apagada em seguida, de modo que o uso de memória e o tamanho
+    de cada envio não dependem da duração do vídeo.
+    :param video_path: o caminho do vídeo
+    :param backend: o serviço de transcrição (por padrão, o Whisper da API da OpenAI)
+    :param language: o idioma falado no vídeo
+    :param window_seconds: a duração de cada janela, em segundos
+    :param overlap_seconds: a sobreposição entre janelas consecutivas, em segundos
+    :param max_workers: o número máximo de janelas transcritas simultaneamente
+    :return: os segmentos transcritos do vídeo, em ordem, com timestamps no tempo do vídeo
+    """
+    backend = backend or OpenAIWhisperBackend()
+    janelas = split_windows(audio_duration(video_path), window_seconds, overlap_seconds)
+    diretorio = tempfile.mkdtemp(prefix='transcricao_')
+
+    def transcrever_janela(i: int) -> List[Segmento]:
+        inicio, duracao = janelas[i]
+        audio_path = os.path.join(diretorio, f'janela_{i}.mp3')
+        extract_audio(video_path, audio_path, inicio, duracao)
+        try:
+            return backend.transcribe(audio_path, language)
+        finally:
+            os.remove(audio_path)
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            transcricoes = list(executor.map(transcrever_janela, range(len(janelas))))
+    finally:
+        shutil.rmtree(diretorio, ignore_errors=True)
+
+    return stitch_segments(janelas, transcricoes)
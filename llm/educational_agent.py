@@ -1,8 +1,11 @@
 from llama_index.core.tools import FunctionTool
-from llm_tools.tools import send_message, get_content, get_php_exercises
+from llm_tools.tools import (send_message, get_content, get_php_exercises, asend_message, aget_content,
+                             aget_php_exercises)
 from llama_index.llms.openai import OpenAI
+from llm.streaming_llm import StreamingOpenAI
 from llama_index.core.agent import ReActAgent
-from llama_index.core import PromptTemplate
+from llm.prompt_budget import BudgetedReActChatFormatter
+from llm.openai_client import openai_client_kwargs
 from dotenv import load_dotenv
 
 load_dotenv(".env")
@@ -10,7 +13,8 @@ load_dotenv(".env")
 
 class EduAgent:
     def __init__(self, model_name: str = "gpt-3.5-turbo-0125", temperature: float = 0, max_iterations: int = 1000,
-                 verbose=True, load_tools: bool = True):
+                 verbose=True, load_tools: bool = True, streaming: bool = True, llm=None,
+                 max_prompt_tokens: int = 6000):
         """
         Classe que cria um agente de ensino para auxiliar no ensino de estrutura de páginas web, formatação de texto em
         documentos hipertexto e apresentação de links, listas e tabelas em HTML5.
@@ -19,6 +23,12 @@ class EduAgent:
         :param max_iterations: número máximo de iterações que o agente pode realizar
         :param verbose: booleano que indica se o agente deve imprimir mensagens de seu raciocínio ou não
         :param load_tools: booleano que indica se as ferramentas padrão devem ser carregadas ou não
+        :param streaming: booleano que indica se as mensagens do agente devem ser exibidas ao usuário à medida que são
+        geradas
+        :param llm: o LLM utilizado pelo agente (por padrão, o modelo GPT model_name da OpenAI). Permite, por exemplo,
+        executar o agente sem chamadas à API, com um LLM determinístico.
+        :param max_prompt_tokens: número de tokens do prompt acima do qual as etapas antigas da conversa são resumidas
+        ou omitidas
         """
         self.model_name = model_name
         self.temperature = temperature
@@ -26,20 +36,25 @@ class EduAgent:
         self.verbose = verbose
         self.tools = []  # Lista de ferramentas que o agente pode utilizar
         self.load_tools = load_tools
+        self.streaming = streaming
+        self.llm = llm
+        self.max_prompt_tokens = max_prompt_tokens
 
         # Carregando as ferramentas padrão
         if self.load_tools:
-            self.add_tools(send_message)
-            self.add_tools(get_content)
-            self.add_tools(get_php_exercises)
+            self.add_tools(send_message, asend_message)
+            self.add_tools(get_content, aget_content)
+            self.add_tools(get_php_exercises, aget_php_exercises)
 
-    def add_tools(self, function):
+    def add_tools(self, function, async_function=None):
         """
         Adiciona uma nova ferramenta ao agente.
         :param function: função Python que será adicionada como ferramenta
+        :param async_function: versão assíncrona da função, utilizada quando o agente é executado no runtime assíncrono
+        (por padrão, a função é executada em uma thread auxiliar)
         :return: mensagem de sucesso
         """
-        self.tools.append(FunctionTool.from_defaults(fn=function))
+        self.tools.append(FunctionTool.from_defaults(fn=function, async_fn=async_function))
 
         return f"Função {function.__name__} adicionada com sucesso!"
 
@@ -57,12 +72,13 @@ class EduAgent:
         :return: o agente criado
         """
 
-        # Instanciando o LLM
-        llm = OpenAI(model=self.model_name, temperature=self.temperature)
-
-        # Criando o agente
-        agent = ReActAgent.from_tools(self.tools, llm=llm, max_iterations=self.max_iterations,
-                                      verbose=self.verbose)
+        # Instanciando o LLM. No modo streaming, o LLM publica a mensagem destinada ao usuário enquanto ela é gerada. Os
+        # LLMs de todos os agentes compartilham o pool de conexões e o limitador de requisições do processo.
+        if self.llm is not None:
+            llm = self.llm
+        else:
+            llm_class = StreamingOpenAI if self.streaming else OpenAI
+            llm = llm_class(model=self.model_name, temperature=self.temperature, **openai_client_kwargs())
 
         # Definindo o prompt do sistema, para a atuação do agente no modelo ReAct
         react_system_header_str = """
@@ -128,11 +144,14 @@ class EduAgent:
         7. Você é expressamente proibido de utilizar "Answer" antes da conversa estar finalizada.
         """
 
-        # Criando o prompt do sistema
-        react_system_prompt = PromptTemplate(react_system_header_str)
+        # Criando o formatador do prompt, que mantém o prompt do sistema como prefixo estável e limita o número de
+        # tokens enviados em cada chamada ao LLM
+        react_chat_formatter = BudgetedReActChatFormatter(system_header=react_system_header_str,
+                                                          max_prompt_tokens=self.max_prompt_tokens)
 
-        # Atualizando o prompt do sistema no agente
-        agent.update_prompts({"agent_worker:system_prompt": react_system_prompt})
+        # Criando o agente
+        agent = ReActAgent.from_tools(self.tools, llm=llm, max_iterations=self.max_iterations,
+                                      react_chat_formatter=react_chat_formatter, verbose=self.verbose)
         agent.reset()
 
         return agent
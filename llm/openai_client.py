@@ -0,0 +1,410 @@
+import json
+import time
+import random
+import asyncio
+import threading
+from collections import deque
+from email.utils import parsedate_to_datetime
+from typing import Any, Deque, Dict, Optional
+
+import httpx
+
+from chat.tracing import QUANTIS, span
+
+# Status HTTP após os quais a requisição é repetida
+STATUS_REPETIVEIS = (408, 409, 429, 500, 502, 503, 504)
+
+# Número de tokens de saída assumido quando a requisição não informa max_tokens
+_TOKENS_DE_SAIDA_PADRAO = 256
+
+# Número aproximado de caracteres por token, utilizado para estimar os tokens de uma requisição
+_CARACTERES_POR_TOKEN = 4
+
+# Configuração do cliente: limites por minuto, tentativas, pool de conexões e endereço da API
+_rpm: Optional[float] = None
+_tpm: Optional[float] = None
+_max_retries = 5
+_backoff_base = 0.5
+_backoff_max = 30.0
+_max_connections = 20
+_base_url: Optional[str] = None
+_timeout = 60.0
+
+_lock = threading.Lock()
+_limitador_requisicoes: Optional["TokenBucket"] = None
+_limitador_tokens: Optional["TokenBucket"] = None
+_http_client: Optional[httpx.Client] = None
+_async_http_client: Optional[httpx.AsyncClient] = None
+_openai_client = None
+
+# Métricas do cliente: requisições, repetições, falhas e os tempos de espera no limitador
+_contadores: Dict[str, int] = {'requests': 0, 'retries': 0, 'failures': 0, 'throttled': 0}
+_esperas: Deque[float] = deque(maxlen=10000)
+_soma_esperas = 0.0
+
+
+class TokenBucket:
+    def __init__(self, per_minute: float, capacity: Optional[float] = None):
+        """
+        Limitador do tipo token bucket: o balde é reabastecido continuamente a per_minute unidades por minuto, até a
+        sua capacidade. Cada reserva retira todas as unidades do balde, mesmo que ele fique negativo (inclusive reservas
+        maiores que a capacidade), e retorna o tempo que o chamador deve aguardar até que a dívida seja paga. Dessa
+        forma, as reservas são atendidas em ordem de chegada, sem que os chamadores precisem consultar o balde
+        repetidamente.
+        :param per_minute: o número de unidades (requisições ou tokens) liberadas por minuto
+        :param capacity: o número máximo de unidades acumuladas enquanto o balde não é utilizado (por padrão, as
+        liberadas em um segundo, já que a API também aplica os limites em janelas menores que um minuto, e não apenas ao
+        total do minuto)
+        """
+        if per_minute <= 0:
+            raise ValueError("O limite por minuto deve ser maior que zero.")
+
+        self.rate = per_minute / 60
+        self.capacity = capacity or max(1.0, self.rate)
+        self._disponivel = self.capacity
+        self._atualizado = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount: float = 1) -> float:
+        """
+        Reserva unidades do balde.
+        :param amount: o número de unidades
+        :return: o tempo, em segundos, a aguardar antes de utilizar as unidades
+        """
+        with self._lock:
+            agora = time.monotonic()
+            self._disponivel = min(self.capacity, self._disponivel + (agora - self._atualizado) * self.rate)
+            self._atualizado = agora
+            self._disponivel -= amount
+
+            return max(0.0, -self._disponivel / self.rate)
+
+
+def configure_openai_client(rpm: Optional[float] = None, tpm: Optional[float] = None, max_retries: int = 5,
+                            max_connections: int = 20, base_url: Optional[str] = None, timeout: float = 60.0,
+                            backoff_base: float = 0.5, backoff_max: float = 30.0) -> None:
+    """
+    Configura o cliente da OpenAI compartilhado por todo o processo (agente, caminho rápido, embeddings e preparação dos
+    dados). Deve ser chamada antes da criação dos LLMs e do modelo de embedding, pois o pool de conexões é recriado.
+    :param rpm: o número máximo de requisições por minuto (None para não limitar)
+    :param tpm: o número máximo de tokens (estimados) por minuto (None para não limitar)
+    :param max_retries: o número máximo de repetições de uma requisição que falhou por limite de taxa, erro do servidor
+    ou de conexão
+    :param max_connections: o número máximo de conexões abertas com a API
+    :param base_url: o endereço da API (por padrão, o da OpenAI ou o definido em OPENAI_BASE_URL). Permite, por exemplo,
+    apontar o cliente para um servidor local de testes.
+    :param timeout: o tempo máximo, em segundos, de cada requisição
+    :param backoff_base: o tempo base, em segundos, da espera exponencial entre as repetições
+    :param backoff_max: o tempo máximo, em segundos, de espera entre as repetições
+    :return: None
+    """
+    if max_retries < 0 or max_connections < 1:
+        raise ValueError("O número de repetições não pode ser negativo e o de conexões deve ser maior que zero.")
+
+    global _rpm, _tpm, _max_retries, _max_connections, _base_url, _timeout, _backoff_base, _backoff_max
+    global _limitador_requisicoes, _limitador_tokens, _http_client, _async_http_client, _openai_client
+
+    with _lock:
+        _rpm, _tpm = rpm, tpm
+        _max_retries = max_retries
+        _max_connections = max_connections
+        _base_url = base_url
+        _timeout = timeout
+        _backoff_base, _backoff_max = backoff_base, backoff_max
+
+        _limitador_requisicoes = TokenBucket(rpm) if rpm else None
+        _limitador_tokens = TokenBucket(tpm) if tpm else None
+
+        # Os clientes são recriados na próxima utilização, com a nova configuração. Os clientes anteriores não são
+        # fechados, pois ainda podem estar em uso por LLMs já criados.
+        _http_client = None
+        _async_http_client = None
+        _openai_client = None
+
+
+def _limites() -> httpx.Limits:
+    """
+    :return: os limites do pool de conexões, mantendo as conexões abertas entre as requisições
+    """
+    return httpx.Limits(max_connections=_max_connections, max_keepalive_connections=_max_connections,
+                        keepalive_expiry=30)
+
+
+def get_http_client() -> httpx.Client:
+    """
+    Retorna o cliente HTTP síncrono compartilhado pelo processo, criando-o na primeira chamada.
+    :return: o cliente HTTP
+    """
+    global _http_client
+
+    with _lock:
+        if _http_client is None:
+            _http_client = httpx.Client(transport=_TransporteLimitado(httpx.HTTPTransport(limits=_limites())),
+                                        timeout=_timeout)
+
+        return _http_client
+
+
+def get_async_http_client() -> httpx.AsyncClient:
+    """
+    Retorna o cliente HTTP assíncrono compartilhado pelo processo, criando-o na primeira chamada. As conexões do cliente
+    pertencem ao event loop onde são abertas, então ele deve ser utilizado por um único event loop (o do runtime
+    assíncrono).
+    :return: o cliente HTTP
+    """
+    global _async_http_client
+
+    with _lock:
+        if _async_http_client is None:
+            _async_http_client = httpx.AsyncClient(
+                transport=_TransporteLimitadoAssincrono(httpx.AsyncHTTPTransport(limits=_limites())), timeout=_timeout)
+
+        return _async_http_client
+
+
+def get_openai_client():
+    """
+    Retorna o cliente da OpenAI compartilhado pelo processo, que utiliza o pool de conexões e o limitador do processo.
+    As repetições são feitas pelo transporte, e não pelo SDK.
+    :return: o cliente da OpenAI
+    """
+    global _openai_client
+
+    http_client = get_http_client()
+    with _lock:
+        if _openai_client is None:
+            from openai import OpenAI
+            _openai_client = OpenAI(base_url=_base_url, http_client=http_client, max_retries=0, timeout=_timeout)
+
+        return _openai_client
+
+
+def openai_client_kwargs() -> Dict[str, Any]:
+    """
+    Retorna os argumentos que fazem um LLM ou modelo de embedding da OpenAI do LlamaIndex utilizar os clientes HTTP
+    compartilhados pelo processo.
+    :return: os argumentos
+    """
+    kwargs = {'http_client': get_http_client(), 'async_http_client': get_async_http_client(), 'max_retries': 0,
+              'timeout': _timeout}
+    if _base_url is not None:
+        kwargs['api_base'] = _base_url
+
+    return kwargs
+
+
+def create_openai_embedding(model: Optional[str] = None):
+    """
+    Cria o modelo de embedding da OpenAI que utiliza os clientes HTTP compartilhados pelo processo.
+    :param model: o modelo de embedding (por padrão, o modelo padrão do LlamaIndex)
+    :return: o modelo de embedding
+    """
+    from llama_index.embeddings.openai import OpenAIEmbedding
+
+    kwargs = openai_client_kwargs()
+    if model is not None:
+        kwargs['model'] = model
+
+    return OpenAIEmbedding(**kwargs)
+
+
+def get_client_metrics() -> Dict[str, Any]:
+    """
+    Retorna as métricas do cliente compartilhado.
+    :return: o número de requisições, de repetições, de falhas e de requisições que aguardaram o limitador, além das
+    estatísticas do tempo de espera no limitador (em segundos), em 'queue_delay'
+    """
+    with _lock:
+        metricas: Dict[str, Any] = dict(_contadores)
+        ordenadas = sorted(_esperas)
+        espera = {'count': len(ordenadas), 'sum': _soma_esperas, 'max': ordenadas[-1] if ordenadas else 0.0}
+
+    for quantil in QUANTIS:
+        espera[f'p{int(quantil * 100)}'] = (ordenadas[min(len(ordenadas) - 1, int(quantil * len(ordenadas)))]
+                                            if ordenadas else 0.0)
+    metricas['queue_delay'] = espera
+
+    return metricas
+
+
+def _contar(chave: str, quantidade: int = 1) -> None:
+    with _lock:
+        _contadores[chave] += quantidade
+
+
+def _estimar_tokens(request: httpx.Request) -> int:
+    """
+    Estima os tokens consumidos por uma requisição, a partir do seu corpo: os caracteres das mensagens ou dos textos a
+    embedar, mais o número máximo de tokens de saída.
+    :param request: a requisição, com o corpo já lido
+    :return: o número estimado de tokens
+    """
+    try:
+        corpo = json.loads(request.content or b'{}')
+    except (ValueError, UnicodeDecodeError):
+        return 0
+    if not isinstance(corpo, dict):
+        return 0
+
+    caracteres = 0
+    for message in corpo.get('messages') or []:
+        conteudo = message.get('content') if isinstance(message, dict) else None
+        if isinstance(conteudo, str):
+            caracteres += len(conteudo)
+        elif isinstance(conteudo, list):
+            caracteres += sum(len(parte.get('text', '')) for parte in conteudo if isinstance(parte, dict))
+
+    entrada = corpo.get('input')
+    if isinstance(entrada, str):
+        caracteres += len(entrada)
+    elif isinstance(entrada, list):
+        caracteres += sum(len(texto) for texto in entrada if isinstance(texto, str))
+
+    tokens = caracteres // _CARACTERES_POR_TOKEN
+    if 'messages' in corpo:
+        tokens += corpo.get('max_tokens') or _TOKENS_DE_SAIDA_PADRAO
+
+    return tokens
+
+
+def _reservar(request: httpx.Request) -> float:
+    """
+    Reserva a requisição nos limitadores de requisições e de tokens por minuto.
+    :param request: a requisição, com o corpo já lido
+    :return: o tempo, em segundos, a aguardar antes de enviá-la
+    """
+    espera = 0.0
+    if _limitador_requisicoes is not None:
+        espera = _limitador_requisicoes.reserve(1)
+    if _limitador_tokens is not None:
+        espera = max(espera, _limitador_tokens.reserve(_estimar_tokens(request)))
+
+    return espera
+
+
+def _registrar_espera(espera: float) -> None:
+    global _soma_esperas
+
+    with _lock:
+        _contadores['requests'] += 1
+        _esperas.append(espera)
+        _soma_esperas += espera
+        if espera > 0:
+            _contadores['throttled'] += 1
+
+
+def _tempo_de_espera(tentativa: int, response: Optional[httpx.Response]) -> float:
+    """
+    Calcula a espera antes de uma nova tentativa: o tempo indicado pela API em Retry-After, se houver, ou uma espera
+    exponencial com jitter completo (um valor aleatório entre zero e o dobro da espera anterior), que evita que as
+    requisições recusadas ao mesmo tempo sejam repetidas juntas.
+    :param tentativa: o número da tentativa que falhou (começando em 0)
+    :param response: a resposta da tentativa (None em erros de conexão)
+    :return: o tempo de espera, em segundos
+    """
+    if response is not None:
+        try:
+            if 'retry-after-ms' in response.headers:
+                return min(_backoff_max, float(response.headers['retry-after-ms']) / 1000)
+            if 'retry-after' in response.headers:
+                valor = response.headers['retry-after']
+                try:
+                    segundos = float(valor)
+                except ValueError:
+                    segundos = parsedate_to_datetime(valor).timestamp() - time.time()
+                return min(_backoff_max, max(0.0, segundos))
+        except (TypeError, ValueError):
+            pass
+
+    return random.uniform(0, min(_backoff_max, _backoff_base * 2 ** tentativa))
+
+
+class _TransporteLimitado(httpx.BaseTransport):
+    def __init__(self, transport: httpx.BaseTransport):
+        """
+        Transporte HTTP que aplica o limitador do processo antes de cada requisição e repete as requisições que falham
+        por limite de taxa, erro do servidor ou de conexão.
+        :param transport: o transporte que mantém o pool de conexões
+        """
+        self._transport = transport
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        # Lendo o corpo, para que a requisição possa ser reenviada
+        request.read()
+
+        tentativa = 0
+        while True:
+            espera = _reservar(request)
+            with span('openai_queue', request.url.path, wait_ms=espera * 1000):
+                if espera:
+                    time.sleep(espera)
+            _registrar_espera(espera)
+
+            try:
+                response = self._transport.handle_request(request)
+            except httpx.TransportError:
+                if tentativa >= _max_retries:
+                    _contar('failures')
+                    raise
+                response = None
+
+            if response is not None and (response.status_code not in STATUS_REPETIVEIS or tentativa >= _max_retries):
+                if response.status_code >= 400:
+                    _contar('failures')
+                return response
+
+            pausa = _tempo_de_espera(tentativa, response)
+            if response is not None:
+                # Lendo a resposta antes de fechá-la, para que a conexão volte ao pool
+                response.read()
+                response.close()
+            _contar('retries')
+            time.sleep(pausa)
+            tentativa += 1
+
+    def close(self) -> None:
+        self._transport.close()
+
+
+class _TransporteLimitadoAssincrono(httpx.AsyncBaseTransport):
+    def __init__(self, transport: httpx.AsyncBaseTransport):
+        """
+        Versão assíncrona de _TransporteLimitado, que aguarda o limitador e as repetições sem bloquear o event loop.
+        :param transport: o transporte que mantém o pool de conexões
+        """
+        self._transport = transport
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        await request.aread()
+
+        tentativa = 0
+        while True:
+            espera = _reservar(request)
+            with span('openai_queue', request.url.path, wait_ms=espera * 1000):
+                if espera:
+                    await asyncio.sleep(espera)
+            _registrar_espera(espera)
+
+            try:
+                response = await self._transport.handle_async_request(request)
+            except httpx.TransportError:
+                if tentativa >= _max_retries:
+                    _contar('failures')
+                    raise
+                response = None
+
+            if response is not None and (response.status_code not in STATUS_REPETIVEIS or tentativa >= _max_retries):
+                if response.status_code >= 400:
+                    _contar('failures')
+                return response
+
+            pausa = _tempo_de_espera(tentativa, response)
+            if response is not None:
+                await response.aread()
+                await response.aclose()
+            _contar('retries')
+            await asyncio.sleep(pausa)
+            tentativa += 1
+
+    async def aclose(self) -> None:
+        await self._transport.aclose()
@@ -0,0 +1,167 @@
+from functools import lru_cache
+from typing import List, Optional, Sequence, Tuple
+
+from llama_index.core.agent.react.formatter import ReActChatFormatter, get_react_tool_descriptions
+from llama_index.core.agent.react.types import BaseReasoningStep, ObservationReasoningStep
+from llama_index.core.base.llms.types import ChatMessage, MessageRole
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.tools import BaseTool
+
+# Avisos do sistema anexados a cada mensagem do usuário. Apenas a ocorrência mais recente é enviada ao LLM.
+SYSTEM_REMINDERS = ("\n(Aviso 1 do Sistema: caso essa mensagem seja uma dúvida, explique em seus pensamentos qual o "
+                    "nível do usuário e seu formato de aprendizado preferido.)\n(Aviso 2 do Sistema: caso essa mensagem "
+                    "seja uma dúvida, utilize a ferramenta de obtenção de conteúdo para basear sua resposta.)")
+
+# Aviso enviado ao agente quando o usuário fica inativo
+IDLE_NOTICE = ("(Aviso do Sistema: o usuário ficou inativo e não respondeu. Finalize a conversa agora, despedindo-se e "
+               "utilizando o formato de Answer.)")
+
+# Número aproximado de caracteres por token, utilizado para resumir as observações antigas
+_CARACTERES_POR_TOKEN = 4
+
+
+def add_system_reminders(message: str) -> str:
+    """
+    Anexa os avisos do sistema a uma mensagem do usuário.
+    :param message: a mensagem do usuário
+    :return: a mensagem com os avisos
+    """
+    return message + SYSTEM_REMINDERS
+
+
+@lru_cache(maxsize=4096)
+def _contar_tokens(texto: str) -> int:
+    """
+    Conta os tokens de um texto com o tokenizador do LlamaIndex. Como as mesmas mensagens são enviadas em todas as
+    chamadas de um turno, a contagem de cada uma é guardada em cache.
+    :param texto: o texto
+    :return: o número de tokens
+    """
+    from llama_index.core.utils import get_tokenizer
+    return len(get_tokenizer()(texto))
+
+
+class BudgetedReActChatFormatter(ReActChatFormatter):
+    """
+    Formatador do prompt do agente ReAct que limita o número de tokens enviados em cada chamada ao LLM. O prompt do
+    sistema é formatado uma única vez e sempre abre as mensagens, formando um prefixo estável que pode ser reaproveitado
+    pelo cache de prompts da API. Os avisos do sistema são mantidos apenas na mensagem mais recente que os contém. Quando
+    o prompt ultrapassa max_prompt_tokens, as observações antigas são resumidas e, se ainda necessário, as etapas mais
+    antigas são omitidas, até que o prompt caia para target_ratio do limite. A compactação só avança quando o limite é
+    ultrapassado novamente, de forma que as mensagens já enviadas não mudam a cada chamada.
+    """
+
+    max_prompt_tokens: int = 6000
+    target_ratio: float = 0.6
+    keep_recent_steps: int = 6
+    max_observation_tokens: int = 200
+
+    last_prompt_tokens: int = 0
+
+    _cabecalho: Optional[Tuple[Tuple[str, ...], str, str]] = PrivateAttr(default=None)
+    _primeira_etapa: Optional[BaseReasoningStep] = PrivateAttr(default=None)
+    _resumidas: int = PrivateAttr(default=0)
+    _omitidas: int = PrivateAttr(default=0)
+
+    def format(self, tools: Sequence[BaseTool], chat_history: List[ChatMessage],
+               current_reasoning: Optional[List[BaseReasoningStep]] = None) -> List[ChatMessage]:
+        current_reasoning = current_reasoning or []
+
+        # Um novo turno do agente começa com outra lista de etapas: a compactação do turno anterior é descartada
+        if not current_reasoning or current_reasoning[0] is not self._primeira_etapa:
+            self._primeira_etapa = current_reasoning[0] if current_reasoning else None
+            self._resumidas = 0
+            self._omitidas = 0
+
+        mensagens = self._montar(tools, chat_history, current_reasoning)
+        tokens = self._contar(mensagens)
+
+        if tokens > self.max_prompt_tokens:
+            alvo = self.max_prompt_tokens * self.target_ratio
+            compactaveis = max(0, len(current_reasoning) - self.keep_recent_steps)
+
+            # Resumindo as observações antigas
+            self._resumidas = max(self._resumidas, compactaveis)
+            mensagens = self._montar(tools, chat_history, current_reasoning)
+            tokens = self._contar(mensagens)
+
+            # Omitindo as etapas mais antigas, sem deixar uma observação separada da ação que a originou
+            while tokens > alvo and self._omitidas < compactaveis:
+                self._omitidas += 1
+                while (self._omitidas < compactaveis
+                       and isinstance(current_reasoning[self._omitidas], ObservationReasoningStep)):
+                    self._omitidas += 1
+                mensagens = self._montar(tools, chat_history, current_reasoning)
+                tokens = self._contar(mensagens)
+
+        self.last_prompt_tokens = tokens
+
+        return mensagens
+
+    def _montar(self, tools: Sequence[BaseTool], chat_history: List[ChatMessage],
+                current_reasoning: List[BaseReasoningStep]) -> List[ChatMessage]:
+        """
+        Monta as mensagens enviadas ao LLM, com o estado atual da compactação.
+        :param tools: as ferramentas do agente
+        :param chat_history: o histórico da conversa
+        :param current_reasoning: as etapas do turno atual
+        :return: as mensagens
+        """
+        mensagens = [ChatMessage(role=MessageRole.SYSTEM, content=self._formatar_cabecalho(tools))]
+        mensagens.extend(ChatMessage(role=message.role, content=message.content) for message in chat_history)
+
+        if self._omitidas:
+            mensagens.append(ChatMessage(role=MessageRole.USER,
+                                         content=f"(Aviso do Sistema: {self._omitidas} etapas anteriores da conversa "
+                                                 f"foram omitidas para economizar espaço.)"))
+
+        for i, etapa in enumerate(current_reasoning[self._omitidas:], start=self._omitidas):
+            if isinstance(etapa, ObservationReasoningStep):
+                conteudo = etapa.get_content()
+                if i < self._resumidas:
+                    conteudo = self._resumir(conteudo)
+                mensagens.append(ChatMessage(role=MessageRole.USER, content=conteudo))
+            else:
+                mensagens.append(ChatMessage(role=MessageRole.ASSISTANT, content=etapa.get_content()))
+
+        # Mantendo os avisos do sistema apenas na mensagem mais recente que os contém
+        com_avisos = [i for i, message in enumerate(mensagens) if SYSTEM_REMINDERS in (message.content or '')]
+        for i in com_avisos[:-1]:
+            mensagens[i].content = mensagens[i].content.replace(SYSTEM_REMINDERS, '')
+
+        return mensagens
+
+    def _formatar_cabecalho(self, tools: Sequence[BaseTool]) -> str:
+        """
+        Formata o prompt do sistema com a descrição das ferramentas, reaproveitando o texto enquanto as ferramentas e o
+        prompt não mudam.
+        :param tools: as ferramentas do agente
+        :return: o prompt do sistema formatado
+        """
+        nomes = tuple(tool.metadata.get_name() for tool in tools)
+        if self._cabecalho is None or self._cabecalho[:2] != (nomes, self.system_header):
+            format_args = {"tool_desc": "\n".join(get_react_tool_descriptions(tools)), "tool_names": ", ".join(nomes)}
+            if self.context:
+                format_args["context"] = self.context
+            self._cabecalho = (nomes, self.system_header, self.system_header.format(**format_args))
+
+        return self._cabecalho[2]
+
+    def _resumir(self, conteudo: str) -> str:
+        """
+        Resume uma observação antiga, mantendo apenas o seu início.
+        :param conteudo: a observação
+        :return: a observação resumida
+        """
+        limite = self.max_observation_tokens * _CARACTERES_POR_TOKEN
+        if len(conteudo) <= limite:
+            return conteudo
+
+        return conteudo[:limite].rstrip() + " [...] (observação antiga resumida)"
+
+    def _contar(self, mensagens: List[ChatMessage]) -> int:
+        """
+        :param mensagens: as mensagens
+        :return: o número de tokens das mensagens
+        """
+        return sum(_contar_tokens(message.content or '') for message in mensagens)
@@ -0,0 +1,283 @@
+import re
+import asyncio
+import unicodedata
+from typing import List, Optional, Tuple
+
+from llama_index.core.base.llms.types import ChatMessage, MessageRole
+
+from chat.broker import MessageBroker, get_broker
+from chat.tracing import begin_turn, end_turn, span
+from data_indexing.indexing_tools import retrieve_nodes_cached
+
+# Configuração do caminho rápido: se está habilitado, o índice consultado e o LLM que gera a resposta
+_habilitado = False
+_persist_dir = 'results/pdf'
+_llm = None
+
+# Tamanho máximo, em caracteres, de uma mensagem respondida diretamente
+_TAMANHO_MAXIMO = 400
+
+# Número de trocas anteriores (mensagem do usuário e resposta) enviadas junto à mensagem atual
+_TROCAS_NO_HISTORICO = 2
+
+# Tamanho máximo, em caracteres, de cada resposta direta relatada ao agente
+_TAMANHO_RELATO = 300
+
+# Termos (sem acentos) que indicam uma dúvida sobre os assuntos tratados pelo agente
+_TERMOS_DO_ASSUNTO = re.compile(
+    r'\b(html5?|tags?|elementos?|atributos?|links?|hiperlinks?|ancoras?|href|listas?|ul|ol|tabelas?|table|tr|td|th|'
+    r'thead|tbody|titulos?|cabecalhos?|rodapes?|paragrafos?|negrito|italico|formatacao|formatar|hipertexto|paginas?|'
+    r'documentos?|estrutura|semantic[oa]s?|section|article|nav|aside|header|footer|div|span|body|doctype|strong|'
+    r'h[1-6]|img|src|alt)\b')
+
+# Início de uma pergunta
+_PERGUNTA = re.compile(
+    r'^(o que|oque|como|qual|quais|quando|onde|por que|porque|pra que|para que|quem|explique|explica|me explique|'
+    r'me explica|me fale|fale sobre|defina|diferenca|posso|devo|existe|tem como|e possivel)\b')
+
+# Pedidos que exigem o agente completo: outros formatos de conteúdo, exercícios, continuações da conversa e despedidas
+_PRECISA_DO_AGENTE = re.compile(
+    r'\b(videos?|imagens?|infograficos?|figuras?|exercicios?|php|audios?|podcasts?|nao entendi|explica melhor|'
+    r'explique melhor|de novo|novamente|outro exemplo|mais exemplos|mais detalhes|anterior|isso|disso|nisso|'
+    r'tchau|obrigad[oa]|valeu|ate logo|ate mais)\b')
+
+# Prompt da resposta direta, com as mesmas regras de ensino do agente ReAct
+_PROMPT_RESPOSTA_DIRETA = """Você é um assistente virtual de programação de páginas web, projetado para ajudar no ensino de estrutura de páginas web, formatação de texto em documentos hipertexto e apresentação de links, listas e tabelas em HTML5. Se a dúvida fugir desse escopo, informe que não pode ajudar com esse tema.
+
+A partir do nível da dúvida do usuário, infira seu nível de conhecimento sobre o assunto. Se ele for iniciante, explique usando analogias, trazendo exemplos, utilizando uma linguagem mais simples e acessível. Se ele for intermediário, utilize uma linguagem mais técnica, mas não tão avançada, além de se aprofundar mais na explicação. Se ele for avançado, explique de forma científica e técnica, utilizando exemplos de código e explicando de forma aprofundada.
+
+Junto à mensagem do usuário, você receberá um conteúdo de apoio. Utilize esse conteúdo apenas como base: crie a resposta com suas palavras, adaptando-a ao nível do usuário, e restrinja-se a responder o que o usuário perguntou.{saudacao}
+
+Responda no seguinte formato:
+
+Thought: uma frase com o nível do usuário e como você irá explicar.
+Answer: a sua resposta ao usuário."""
+
+_SAUDACAO = ("\n\nEsta é a primeira mensagem do usuário: cumprimente-o e apresente-se como assistente virtual de "
+             "programação de páginas web antes de responder.")
+
+
+def configure_fast_path(enabled: bool = False, persist_dir: str = 'results/pdf', llm=None,
+                        model_name: str = "gpt-3.5-turbo-0125") -> None:
+    """
+    Configura o caminho rápido, que responde às dúvidas simples com uma única chamada ao LLM, sem o ciclo ReAct.
+    :param enabled: se True, as dúvidas simples são respondidas diretamente
+    :param persist_dir: o índice consultado para as respostas diretas (o índice de conteúdo em texto)
+    :param llm: o LLM que gera as respostas diretas (por padrão, o modelo GPT model_name da OpenAI, em modo streaming)
+    :param model_name: o nome do modelo GPT utilizado quando llm não é informado
+    :return: None
+    """
+    global _habilitado, _persist_dir, _llm
+    _habilitado = enabled
+    _persist_dir = persist_dir
+
+    if enabled and llm is None:
+        from llm.streaming_llm import StreamingOpenAI
+        from llm.openai_client import openai_client_kwargs
+        llm = StreamingOpenAI(model=model_name, temperature=0, **openai_client_kwargs())
+    _llm = llm
+
+
+def _normalizar(texto: str) -> str:
+    """
+    :param texto: o texto
+    :return: o texto em minúsculas, sem acentos e sem espaços repetidos
+    """
+    texto = unicodedata.normalize('NFKD', texto.lower())
+    texto = ''.join(c for c in texto if not unicodedata.combining(c))
+
+    return ' '.join(texto.split())
+
+
+def classify_message(message: str) -> str:
+    """
+    Classifica a mensagem do usuário, sem chamadas ao LLM, decidindo quem irá respondê-la. Apenas as dúvidas simples e
+    independentes sobre o assunto do agente, sem pedido de outro formato de conteúdo, seguem o caminho rápido. Na
+    dúvida, a mensagem é encaminhada ao agente.
+    :param message: a mensagem do usuário
+    :return: 'fast' para responder diretamente ou 'agent' para utilizar o agente ReAct
+    """
+    texto = _normalizar(message)
+
+    if not texto or len(texto) > _TAMANHO_MAXIMO or texto.count('?') > 1:
+        return 'agent'
+
+    if _PRECISA_DO_AGENTE.search(texto) or not _TERMOS_DO_ASSUNTO.search(texto):
+        return 'agent'
+
+    # Desconsiderando uma saudação no início da mensagem
+    texto = re.sub(r'^(oi|ola|bom dia|boa tarde|boa noite)\b[\s,!.]*', '', texto)
+    if not texto.endswith('?') and not _PERGUNTA.match(texto):
+        return 'agent'
+
+    return 'fast'
+
+
+def _historico(broker: MessageBroker) -> List[ChatMessage]:
+    """
+    Monta as últimas trocas de mensagens da sessão a partir do message broker. Se as mensagens do usuário e do
+    assistente não estiverem pareadas, o histórico não é utilizado.
+    :param broker: o message broker da sessão
+    :return: as mensagens das últimas trocas
+    """
+    usuario = broker.history('user')[:-1]
+    assistente = broker.history('assistant')
+    if len(usuario) != len(assistente):
+        return []
+
+    mensagens = []
+    for pergunta, resposta in list(zip(usuario, assistente))[-_TROCAS_NO_HISTORICO:]:
+        mensagens.append(ChatMessage(role=MessageRole.USER, content=pergunta))
+        mensagens.append(ChatMessage(role=MessageRole.ASSISTANT, content=resposta))
+
+    return mensagens
+
+
+def _mensagens_resposta_direta(message: str, materiais: List[str], broker: MessageBroker) -> List[ChatMessage]:
+    """
+    Monta as mensagens da resposta direta: o prompt, as últimas trocas da sessão e a mensagem com o conteúdo de apoio.
+    :param message: a mensagem do usuário
+    :param materiais: o conteúdo recuperado
+    :param broker: o message broker da sessão
+    :return: as mensagens enviadas ao LLM
+    """
+    saudacao = _SAUDACAO if not broker.history('assistant') else ''
+
+    return [ChatMessage(role=MessageRole.SYSTEM, content=_PROMPT_RESPOSTA_DIRETA.format(saudacao=saudacao)),
+            *_historico(broker),
+            ChatMessage(role=MessageRole.USER, content=f"Conteúdo de apoio: {materiais}\n\nMensagem do usuário: {message}")]
+
+
+def _extrair_resposta(texto: str) -> Optional[str]:
+    """
+    Mantém apenas a resposta gerada, sem o pensamento.
+    :param texto: o texto gerado pelo LLM
+    :return: a resposta, ou None caso esteja vazia
+    """
+    _, separador, resposta = texto.partition('Answer:')
+    resposta = resposta.strip() if separador else re.sub(r'^Thought:.*\n?', '', texto).strip()
+
+    return resposta or None
+
+
+def answer_directly(message: str, broker: Optional[MessageBroker] = None) -> Optional[str]:
+    """
+    Responde a uma dúvida simples com uma única chamada ao LLM: o conteúdo é recuperado diretamente e enviado junto à
+    mensagem, sem as etapas de pensamento e de ação do agente. A resposta é exibida ao usuário enquanto é gerada.
+    :param message: a mensagem do usuário
+    :param broker: o message broker da sessão (por padrão, o broker em uso)
+    :return: a resposta, ou None caso não haja conteúdo relevante (e a mensagem deva ser respondida pelo agente)
+    """
+    broker = broker or get_broker()
+
+    with span('fast_path', 'answer_directly'):
+        materiais = retrieve_nodes_cached(_persist_dir, message)
+        if not materiais:
+            return None
+
+        texto = ''
+        for chunk in _llm.stream_chat(_mensagens_resposta_direta(message, materiais, broker)):
+            texto = chunk.message.content or ''
+
+    return _extrair_resposta(texto)
+
+
+async def aanswer_directly(message: str, broker: Optional[MessageBroker] = None) -> Optional[str]:
+    """
+    Versão assíncrona de answer_directly. A busca é executada em uma thread auxiliar e a geração, de forma assíncrona.
+    :param message: a mensagem do usuário
+    :param broker: o message broker da sessão (por padrão, o broker em uso)
+    :return: a resposta, ou None caso não haja conteúdo relevante (e a mensagem deva ser respondida pelo agente)
+    """
+    broker = broker or get_broker()
+
+    with span('fast_path', 'answer_directly'):
+        materiais = await asyncio.to_thread(retrieve_nodes_cached, _persist_dir, message)
+        if not materiais:
+            return None
+
+        texto = ''
+        async for chunk in await _llm.astream_chat(_mensagens_resposta_direta(message, materiais, broker)):
+            texto = chunk.message.content or ''
+
+    return _extrair_resposta(texto)
+
+
+def serve_fast_turns(message: Optional[str], broker: Optional[MessageBroker] = None,
+                     timeout: Optional[float] = None) -> Tuple[Optional[str], List[Tuple[str, str]]]:
+    """
+    Responde diretamente às mensagens do usuário enquanto elas forem dúvidas simples, aguardando a próxima mensagem
+    após cada resposta. Retorna a primeira mensagem que precisa do agente.
+    :param message: a mensagem do usuário, já recebida do broker
+    :param broker: o message broker da sessão (por padrão, o broker em uso)
+    :param timeout: tempo máximo, em segundos, de espera por uma nova mensagem (por padrão, o idle_timeout do broker)
+    :return: a mensagem a ser respondida pelo agente (None se o usuário ficou inativo) e as trocas respondidas
+    diretamente, como tuplas (mensagem do usuário, resposta)
+    """
+    broker = broker or get_broker()
+    timeout = broker.idle_timeout if timeout is None else timeout
+    respondidas = []
+
+    while _habilitado and message is not None and classify_message(message) == 'fast':
+        resposta = answer_directly(message, broker)
+        if resposta is None:
+            break
+
+        broker.publish('assistant', resposta)
+        end_turn()
+        respondidas.append((message, resposta))
+
+        message = broker.receive('user', timeout=timeout)
+        if message is not None:
+            begin_turn(message)
+
+    return message, respondidas
+
+
+async def aserve_fast_turns(message: Optional[str], broker: Optional[MessageBroker] = None,
+                            timeout: Optional[float] = None) -> Tuple[Optional[str], List[Tuple[str, str]]]:
+    """
+    Versão assíncrona de serve_fast_turns, que aguarda as mensagens do usuário sem ocupar uma thread.
+    :param message: a mensagem do usuário, já recebida do broker
+    :param broker: o message broker da sessão (por padrão, o broker em uso)
+    :param timeout: tempo máximo, em segundos, de espera por uma nova mensagem (por padrão, o idle_timeout do broker)
+    :return: a mensagem a ser respondida pelo agente (None se o usuário ficou inativo) e as trocas respondidas
+    diretamente, como tuplas (mensagem do usuário, resposta)
+    """
+    broker = broker or get_broker()
+    timeout = broker.idle_timeout if timeout is None else timeout
+    respondidas = []
+
+    while _habilitado and message is not None and classify_message(message) == 'fast':
+        resposta = await aanswer_directly(message, broker)
+        if resposta is None:
+            break
+
+        broker.publish('assistant', resposta)
+        end_turn()
+        respondidas.append((message, resposta))
+
+        message = await broker.areceive('user', timeout=timeout)
+        if message is not None:
+            begin_turn(message)
+
+    return message, respondidas
+
+
+def describe_fast_turns(exchanges: List[Tuple[str, str]]) -> str:
+    """
+    Relata ao agente as trocas respondidas diretamente, para que ele conheça toda a conversa.
+    :param exchanges: as trocas, como tuplas (mensagem do usuário, resposta)
+    :return: o relato, ou uma string vazia caso não haja trocas
+    """
+    if not exchanges:
+        return ''
+
+    relatos = []
+    for pergunta, resposta in exchanges:
+        if len(resposta) > _TAMANHO_RELATO:
+            resposta = resposta[:_TAMANHO_RELATO].rstrip() + ' [...]'
+        relatos.append(f'Usuário: {pergunta}\nResposta: {resposta}')
+
+    return ("(Aviso do Sistema: as seguintes dúvidas do usuário foram respondidas diretamente, sem a sua participação:\n"
+            + '\n'.join(relatos) + ")\n")
@@ -0,0 +1,46 @@
+from typing import Any, Sequence
+from llama_index.core.base.llms.types import ChatMessage, ChatResponseAsyncGen, ChatResponseGen
+from llama_index.llms.openai import OpenAI
+from chat.broker import get_broker
+from chat.streaming import ReActStreamParser
+
+
+class StreamingOpenAI(OpenAI):
+    """
+    LLM da OpenAI que, durante o streaming, repassa ao usuário a mensagem que está sendo gerada. Os trechos gerados no
+    formato ReAct passam por um ReActStreamParser e o texto destinado ao usuário é publicado como rascunho no message
+    broker da sessão atual, sendo exibido na interface antes mesmo de o agente terminar sua ação.
+    """
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "streaming_openai_llm"
+
+    def stream_chat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponseGen:
+        # O broker é obtido aqui, pois a geração pode continuar sendo consumida em outra thread
+        broker = get_broker()
+        broker.clear_draft('assistant')
+        parser = ReActStreamParser(lambda texto: broker.append_draft('assistant', texto))
+
+        stream = super().stream_chat(messages, **kwargs)
+
+        def gen() -> ChatResponseGen:
+            for chunk in stream:
+                parser.feed(chunk.delta)
+                yield chunk
+
+        return gen()
+
+    async def astream_chat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponseAsyncGen:
+        broker = get_broker()
+        broker.clear_draft('assistant')
+        parser = ReActStreamParser(lambda texto: broker.append_draft('assistant', texto))
+
+        stream = await super().astream_chat(messages, **kwargs)
+
+        async def gen() -> ChatResponseAsyncGen:
+            async for chunk in stream:
+                parser.feed(chunk.delta)
+                yield chunk
+
+        return gen()
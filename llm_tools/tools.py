@@ -1,9 +1,239 @@
-import json
-from typing import List, Union
-from data_indexing.indexing_tools import get_index, get_retriever, retrieve_nodes
-import time
+import os
+import re
+import asyncio
+import threading
+import weakref
+import contextvars
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple, Union
+from data_indexing.indexing_tools import retrieve_nodes_cached, retrieve_nodes_fused
+from data_indexing.retrieval_cache import normalize_query
+from chat.broker import get_broker
+from chat.tracing import begin_turn, end_turn, span, traced_tool
+from llm.prompt_budget import IDLE_NOTICE, add_system_reminders
+from llm.router import aserve_fast_turns, describe_fast_turns, serve_fast_turns
 
+# Mapeando o formato de conteúdo preferido para o diretório do seu respectivo índice do RAG
+MAP_FORMAT_TO_PERSIST_DIR = {'texto': 'results/pdf', 'video': 'results/video', 'imagem': 'results/image'}
 
+# Diretório do índice dos exercícios de PHP
+EXERCICIOS_PERSIST_DIR = 'results/exercicios'
+
+# Link da imagem indexada, anexado ao conteúdo de imagem
+LINK_IMAGEM = ("\n(Este é o link para acessar a imagem a qual o texto se refere https://raw.githubusercontent.com/grupo-a/challenge-artificial-intelligence/main/resources"
+               "/Infografico-1.jpg)\n")
+
+# Instruções adicionais ao agente para cada formato de conteúdo retornado
+INSTRUCOES_FORMATO = {
+    'texto': "",
+    'video': " Além disso, envie para o usuário o link do vídeo que irá auxiliar na dúvida dele. Você é proibido de responder sem enviar o link.",
+    'imagem': " Além disso, envie para o usuário o link da imagem que irá auxiliar na dúvida dele. Você é proibido de responder sem enviar o link.",
+}
+
+# Nome de cada formato exibido ao agente quando o conteúdo combina vários formatos
+NOMES_FORMATO = {'texto': 'texto', 'video': 'vídeo', 'imagem': 'imagem'}
+
+# Configuração da busca de conteúdo: se todos os formatos são consultados ao mesmo tempo, com os resultados combinados,
+# e o peso do formato preferido do usuário na combinação
+_busca_combinada = False
+_peso_formato_preferido = 2.0
+
+
+def configure_content_search(fused: bool = False, preferred_boost: float = 2.0) -> None:
+    """
+    Configura a busca de conteúdo da ferramenta get_content.
+    :param fused: se True, todos os formatos são consultados em paralelo e os resultados são combinados, de modo que o
+    agente recebe conteúdo de outro formato quando o formato preferido não tem conteúdo relevante, sem precisar chamar
+    a ferramenta novamente
+    :param preferred_boost: o peso do formato preferido na combinação dos resultados (os demais formatos têm peso 1)
+    :return: None
+    """
+    global _busca_combinada, _peso_formato_preferido
+    _busca_combinada = fused
+    _peso_formato_preferido = preferred_boost
+
+
+# Antecipação das buscas de conteúdo: ao chegar uma mensagem do usuário, as buscas que o agente provavelmente fará são
+# iniciadas em paralelo com a sua primeira chamada ao LLM. Cada sessão (identificada pelo seu message broker) guarda as
+# buscas antecipadas da última mensagem e o último formato de conteúdo pedido pelo agente.
+_antecipacao_habilitada = False
+_executor_antecipacao = ThreadPoolExecutor(max_workers=4, thread_name_prefix='antecipacao')
+_antecipacoes: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+_lock_antecipacoes = threading.Lock()
+
+# Métricas da antecipação: buscas iniciadas, buscas aproveitadas pelo agente, buscas canceladas antes de começar e
+# buscas do agente sem uma busca antecipada da mesma query
+_contadores_antecipacao: Dict[str, int] = {'iniciadas': 0, 'aproveitadas': 0, 'canceladas': 0, 'perdidas': 0}
+
+
+def configure_prefetch(enabled: bool = False) -> None:
+    """
+    Configura a antecipação das buscas de conteúdo.
+    :param enabled: se True, a busca de conteúdo é iniciada assim que a mensagem do usuário chega, antes de o agente
+    chamar get_content
+    :return: None
+    """
+    global _antecipacao_habilitada
+    _antecipacao_habilitada = enabled
+
+
+def get_prefetch_stats() -> Dict[str, float]:
+    """
+    Retorna as métricas da antecipação das buscas de conteúdo, que permitem avaliar o seu benefício: como apenas a busca
+    da mesma query é aproveitada, as buscas antecipadas são desperdiçadas quando o agente reescreve a query.
+    :return: dicionário com o número de buscas antecipadas iniciadas, aproveitadas pelo agente e canceladas antes de
+    começar, o número de buscas do agente sem uma busca antecipada correspondente ('perdidas') e a fração das buscas
+    do agente que aproveitaram uma busca antecipada ('taxa_aproveitamento')
+    """
+    with _lock_antecipacoes:
+        metricas: Dict[str, float] = dict(_contadores_antecipacao)
+
+    buscas = metricas['aproveitadas'] + metricas['perdidas']
+    metricas['taxa_aproveitamento'] = metricas['aproveitadas'] / buscas if buscas else 0.0
+
+    return metricas
+
+
+def _contar_antecipacao(chave: str, quantidade: int = 1) -> None:
+    with _lock_antecipacoes:
+        _contadores_antecipacao[chave] += quantidade
+
+
+def _estado_antecipacao() -> Dict:
+    """
+    :return: o estado da antecipação da sessão atual, criando-o caso ainda não exista
+    """
+    broker = get_broker()
+    with _lock_antecipacoes:
+        estado = _antecipacoes.get(broker)
+        if estado is None:
+            estado = {'buscas': {}, 'formato': 'texto'}
+            _antecipacoes[broker] = estado
+
+        return estado
+
+
+def _indices_provaveis(user_msg: str, ultimo_formato: str) -> List[str]:
+    """
+    Estima os índices que o agente irá consultar para responder à mensagem: o formato pedido na mensagem, o último
+    formato utilizado na sessão e o formato padrão (texto), além dos exercícios de PHP, quando pedidos.
+    :param user_msg: a mensagem do usuário
+    :param ultimo_formato: o último formato de conteúdo pedido pelo agente na sessão
+    :return: os diretórios dos índices
+    """
+    if _busca_combinada:
+        return list(MAP_FORMAT_TO_PERSIST_DIR.values())
+
+    texto = normalize_query(user_msg)
+    formatos = []
+    if re.search(r'v[ií]deo', texto):
+        formatos.append('video')
+    if re.search(r'imagem|imagens|infogr[aá]fico|figura', texto):
+        formatos.append('imagem')
+    formatos += [ultimo_formato, 'texto']
+
+    indices = list(dict.fromkeys(MAP_FORMAT_TO_PERSIST_DIR[formato] for formato in formatos))
+    if re.search(r'php|exerc[ií]cio', texto):
+        indices.append(EXERCICIOS_PERSIST_DIR)
+
+    return indices
+
+
+def _antecipar(persist_dir: str, user_msg: str) -> List[str]:
+    """
+    Executa uma busca antecipada. O resultado também fica no cache de recuperações.
+    :param persist_dir: o diretório do índice
+    :param user_msg: a mensagem do usuário
+    :return: os materiais encontrados
+    """
+    with span('prefetch', os.path.normpath(persist_dir)):
+        return retrieve_nodes_cached(persist_dir, user_msg)
+
+
+def prefetch_content(user_msg: str) -> None:
+    """
+    Inicia, em segundo plano, as buscas de conteúdo que o agente provavelmente fará para responder à mensagem do
+    usuário, enquanto o LLM gera o primeiro pensamento do agente. As buscas da mensagem anterior que ainda não
+    começaram são canceladas, para não ocuparem o pool compartilhado pelas sessões.
+    :param user_msg: a mensagem do usuário
+    :return: None
+    """
+    if not _antecipacao_habilitada:
+        return
+
+    estado = _estado_antecipacao()
+    consulta = normalize_query(user_msg)
+
+    for busca in estado['buscas'].values():
+        if not busca.cancelled() and busca.cancel():
+            _contar_antecipacao('canceladas')
+
+    # Cada busca é executada com uma cópia do contexto atual, para que seja registrada no turno da conversa
+    estado['buscas'] = {(os.path.normpath(persist_dir), consulta):
+                        _executor_antecipacao.submit(contextvars.copy_context().run, _antecipar, persist_dir, user_msg)
+                        for persist_dir in _indices_provaveis(user_msg, estado['formato'])}
+    _contar_antecipacao('iniciadas', len(estado['buscas']))
+
+
+def _busca_antecipada(persist_dir: str, user_msg: str) -> Optional[Future]:
+    """
+    Procura uma busca antecipada no índice para a query do agente. Apenas a busca da mesma query (normalizada) é
+    aproveitada, pois o resultado da busca de outra mensagem não corresponde ao que o agente pediu.
+    :param persist_dir: o diretório do índice
+    :param user_msg: a query do agente
+    :return: a busca antecipada, ou None caso não haja
+    """
+    if not _antecipacao_habilitada:
+        return None
+
+    buscas = _estado_antecipacao()['buscas']
+    chave_indice = os.path.normpath(persist_dir)
+
+    busca = buscas.get((chave_indice, normalize_query(user_msg)))
+    if busca is None:
+        _contar_antecipacao('perdidas')
+
+    return busca
+
+
+def _aguardar_antecipada(busca: Optional[Future]) -> bool:
+    """
+    Decide se a busca antecipada deve ser aguardada: se ela ainda não começou (está na fila, atrás das buscas de outras
+    sessões), é cancelada, para que a busca seja feita diretamente.
+    :param busca: a busca antecipada (None caso não haja)
+    :return: booleano que indica se a busca já começou e deve ser aguardada
+    """
+    if busca is None or busca.cancelled():
+        return False
+
+    if busca.cancel():
+        _contar_antecipacao('canceladas')
+        return False
+
+    _contar_antecipacao('aproveitadas')
+    return True
+
+
+def _recuperar(persist_dir: str, user_msg: str) -> List[str]:
+    """
+    Recupera o conteúdo do índice para a query do agente, aproveitando a busca antecipada, caso haja. Se a busca
+    antecipada ainda não começou (está na fila, atrás das buscas de outras sessões), ela é cancelada e a busca é feita
+    diretamente.
+    :param persist_dir: o diretório do índice
+    :param user_msg: a query do agente
+    :return: os materiais encontrados
+    """
+    busca = _busca_antecipada(persist_dir, user_msg)
+    if _aguardar_antecipada(busca):
+        try:
+            return busca.result()
+        except Exception as e:
+            print(f'Erro na busca antecipada em {persist_dir}: {e}')
+
+    return retrieve_nodes_cached(persist_dir, user_msg)
+
+
+@traced_tool
 def send_message(message: str) -> str:
     """
     Função "Enviar Mensagem": esta função envia uma mensagem para o usuário.
@@ -11,37 +241,59 @@ def send_message(message: str) -> str:
     :return: a resposta do usuário após receber a mensagem
     """
 
-    # Verifica se o arquivo JSON existe
-    caminho_assistant = './message_broker/assistant_msgs.json'
-    with open(caminho_assistant, 'r', encoding='utf-8') as arquivo:
-        assistant_msgs = json.load(arquivo)
+    # Publicando a mensagem para o usuário
+    broker = get_broker()
+    broker.publish('assistant', message)
+    end_turn()
+
+    # Aguardando a resposta do usuário. A thread é acordada assim que o usuário responde.
+    resposta_usuario = broker.receive('user', timeout=broker.idle_timeout)
 
-    assistant_msgs["assistant"].append(message)
-    with open(caminho_assistant, 'w', encoding='utf-8') as arquivo:
-        json.dump(assistant_msgs, arquivo, indent=4)
+    # Se o usuário ficou inativo por tempo demais, o agente deve encerrar a conversa, liberando o atendimento
+    if resposta_usuario is None:
+        return IDLE_NOTICE
 
-    caminho_user = './message_broker/user_msgs.json'
-    with open(caminho_user, 'r', encoding='utf-8') as arquivo:
-        user_msgs = json.load(arquivo)
+    begin_turn(resposta_usuario)
 
-    num_user_msgs = len(user_msgs["user"])
-    while True:
-        time.sleep(1)
-        with open(caminho_user, 'r', encoding='utf-8') as arquivo:
-            user_msgs = json.load(arquivo)
-        num_user_msgs2 = len(user_msgs["user"])
+    # Respondendo diretamente às dúvidas simples, sem a participação do agente, que recebe apenas o relato das trocas
+    resposta_usuario, respondidas = serve_fast_turns(resposta_usuario, broker)
+    if resposta_usuario is None:
+        return IDLE_NOTICE
 
-        if num_user_msgs2 > num_user_msgs:
-            break
+    # Antecipando a busca de conteúdo que o agente provavelmente fará em seguida
+    prefetch_content(resposta_usuario)
 
-    resposta_usuario = user_msgs["user"][-1]
+    return describe_fast_turns(respondidas) + add_system_reminders(resposta_usuario)
 
-    return resposta_usuario + ("\n(Aviso 1 do Sistema: caso essa mensagem seja uma dúvida, explique em seus "
-                               "pensamentos qual o nível do usuário e seu formato de aprendizado preferido.)\n(Aviso "
-                               "2 do Sistema: caso essa mensagem seja uma dúvida, utilize a ferramenta de obtenção de "
-                               "conteúdo para basear sua resposta.)")
 
+@traced_tool
+async def asend_message(message: str) -> str:
+    """
+    Versão assíncrona de send_message, utilizada pelo agente no runtime assíncrono: a resposta do usuário é aguardada
+    sem ocupar uma thread.
+    :param message: a mensagem a ser enviada
+    :return: a resposta do usuário após receber a mensagem
+    """
+    broker = get_broker()
+    broker.publish('assistant', message)
+    end_turn()
+
+    resposta_usuario = await broker.areceive('user', timeout=broker.idle_timeout)
+    if resposta_usuario is None:
+        return IDLE_NOTICE
 
+    begin_turn(resposta_usuario)
+
+    resposta_usuario, respondidas = await aserve_fast_turns(resposta_usuario, broker)
+    if resposta_usuario is None:
+        return IDLE_NOTICE
+
+    prefetch_content(resposta_usuario)
+
+    return describe_fast_turns(respondidas) + add_system_reminders(resposta_usuario)
+
+
+@traced_tool
 def get_content(user_msg: str, content_format: str) -> Union[str, List[str]]:
     """
     Função "Obter Conteúdo": esta função busca conteúdo com base na dúvida do usuário, no formato de conteúdo preferido do usuário.
@@ -52,37 +304,77 @@ def get_content(user_msg: str, content_format: str) -> Union[str, List[str]]:
     :return: uma lista com os conteúdos e materiais correspondentes à dúvida do usuário. Caso a lista esteja vazia, a função retorna uma mensagem informando que não foi possível encontrar conteúdo.
     """
 
-    # Mapeando o formato de conteúdo preferido para o seu respectivo índice do RAG
-    map_format_to_index = {'texto': get_index('results/pdf'), 'video': get_index('results/video'),
-                           'imagem': get_index('results/image')}
+    if _antecipacao_habilitada:
+        _estado_antecipacao()['formato'] = content_format
 
-    # Instanciando o retriever que irá recuperar os conteúdos do RAG
-    retriever = get_retriever(map_format_to_index[content_format])
+    if _busca_combinada:
+        return _get_content_fused(user_msg, content_format)
 
-    # Recuperando os nós, que representam o conteúdo, do RAG
-    rag_return = retrieve_nodes(retriever, user_msg)
+    # Recuperando os nós, que representam o conteúdo, do índice do formato preferido. Os índices são carregados uma
+    # única vez por processo, perguntas repetidas são respondidas pelo cache de recuperações e, se a busca já foi
+    # antecipada, o seu resultado é aproveitado.
+    rag_return = _recuperar(MAP_FORMAT_TO_PERSIST_DIR[content_format], user_msg)
 
     # Se o RAG retornar algum conteúdo, retorna esse conteúdo
     if rag_return:
         # Se o conteúdo for de imagem, anexa o link da imagem ao conteúdo
         if content_format == 'imagem':
-            rag_return_img = []
-            for r in rag_return:
-                rag_return_img.append(
-                    r + "\n(Este é o link para acessar a imagem a qual o texto se refere https://raw.githubusercontent.com/grupo-a/challenge-artificial-intelligence/main/resources"
-                        "/Infografico-1.jpg)\n")
-
-            return f"Adapte o seguinte conteúdo ao nível do usuário (veja se é iniciante, intermediário ou avançado): {rag_return_img}\nVocê deve utilizar esse conteúdo apenas como base, você deve criar a resposta com suas palavras e adaptando ao nível do usuário. Restrinja-se em apenas responder o que o usuário perguntou, não forneça informações que fuja de sua dúvida. Além disso, envie para o usuário o link da imagem que irá auxiliar na dúvida dele. Você é proibido de responder sem enviar o link."
-
-        elif content_format == "video":
-            return f"Adapte o seguinte conteúdo ao nível do usuário (veja se é iniciante, intermediário ou avançado): {rag_return}\nVocê deve utilizar esse conteúdo apenas como base, você deve criar a resposta com suas palavras e adaptando ao nível do usuário. Restrinja-se em apenas responder o que o usuário perguntou, não forneça informações que fuja de sua dúvida. Além disso, envie para o usuário o link do vídeo que irá auxiliar na dúvida dele. Você é proibido de responder sem enviar o link."
-        else:
-            return f"Adapte o seguinte conteúdo ao nível do usuário (veja se é iniciante, intermediário ou avançado): {rag_return}\nVocê deve utilizar esse conteúdo apenas como base, você deve criar a resposta com suas palavras e adaptando ao nível do usuário. Restrinja-se em apenas responder o que o usuário perguntou, não forneça informações que fuja de sua dúvida."
+            rag_return = [r + LINK_IMAGEM for r in rag_return]
+
+        return _instrucoes_conteudo(rag_return, [content_format])
     else:
         return ("Não foi possível encontrar conteúdo. Talvez em outros formatos possa haver conteúdos relacionados à "
                 "dúvida do usuário. Explique para ele essa possibilidade.")
 
 
+def _instrucoes_conteudo(materiais: List[str], formatos: List[str]) -> str:
+    """
+    Monta a observação entregue ao agente com os materiais recuperados e as instruções de uso de cada formato.
+    :param materiais: os materiais recuperados
+    :param formatos: os formatos presentes nos materiais
+    :return: a observação para o agente
+    """
+    instrucoes = ''.join(INSTRUCOES_FORMATO[formato] for formato in ('texto', 'video', 'imagem') if formato in formatos)
+
+    return f"Adapte o seguinte conteúdo ao nível do usuário (veja se é iniciante, intermediário ou avançado): {materiais}\nVocê deve utilizar esse conteúdo apenas como base, você deve criar a resposta com suas palavras e adaptando ao nível do usuário. Restrinja-se em apenas responder o que o usuário perguntou, não forneça informações que fuja de sua dúvida.{instrucoes}"
+
+
+def _get_content_fused(user_msg: str, content_format: str) -> str:
+    """
+    Busca conteúdo em todos os formatos ao mesmo tempo, combinando os resultados com prioridade para o formato
+    preferido do usuário.
+    :param user_msg: mensagem do usuário, contendo sua dúvida
+    :param content_format: formato do conteúdo que o usuário prefere
+    :return: a observação para o agente
+    """
+    # Aguardando as buscas antecipadas da mesma query já iniciadas, cujos resultados são então obtidos do cache de
+    # recuperações. As que ainda não começaram são canceladas e feitas diretamente.
+    for persist_dir in MAP_FORMAT_TO_PERSIST_DIR.values():
+        busca = _busca_antecipada(persist_dir, user_msg)
+        if _aguardar_antecipada(busca):
+            busca.exception()
+
+    encontrados: List[Tuple[str, str]] = retrieve_nodes_fused(MAP_FORMAT_TO_PERSIST_DIR, user_msg,
+                                                              preferred=content_format,
+                                                              preferred_boost=_peso_formato_preferido)
+    if not encontrados:
+        return ("Não foi possível encontrar conteúdo em nenhum dos formatos disponíveis (texto, vídeo e imagem). "
+                "Explique isso ao usuário.")
+
+    # Identificando o formato de cada material e anexando o link da imagem ao conteúdo de imagem
+    materiais = [f"(Formato: {NOMES_FORMATO[formato]}) " + (material + LINK_IMAGEM if formato == 'imagem' else material)
+                 for formato, material in encontrados]
+    formatos = [formato for formato, _ in encontrados]
+    observacao = _instrucoes_conteudo(materiais, formatos)
+
+    if content_format not in formatos:
+        observacao += (f" Não foi encontrado conteúdo no formato preferido do usuário ({NOMES_FORMATO[content_format]})"
+                       f", então explique isso a ele e utilize o conteúdo dos formatos encontrados.")
+
+    return observacao
+
+
+@traced_tool
 def get_php_exercises(user_msg: str) -> Union[str, List[str]]:
     """
     Função "Obter Exercícios de PHP": esta função busca exercícios de PHP com base na dúvida do usuário, caso seja uma dúvida relacionada a desenvolvimento de sistemas com PHP.
@@ -90,11 +382,8 @@ def get_php_exercises(user_msg: str) -> Union[str, List[str]]:
     :return: uma lista com os exercícios correspondentes à dúvida do usuário. Caso a lista esteja vazia, a função retorna uma mensagem informando que não foi possível encontrar exercícios.
     """
 
-    # Instanciando o retriever que irá recuperar os conteúdos do RAG
-    retriever = get_retriever(get_index('results/exercicios'))
-
     # Recuperando os nós, que representam o conteúdo, do RAG
-    rag_return = retrieve_nodes(retriever, user_msg)
+    rag_return = _recuperar(EXERCICIOS_PERSIST_DIR, user_msg)
 
     # Se o RAG retornar algum conteúdo, retorna esse conteúdo
     if rag_return:
@@ -102,3 +391,23 @@ def get_php_exercises(user_msg: str) -> Union[str, List[str]]:
     else:
         return ("Não foi possível encontrar conteúdo. Talvez em outros formatos possa haver conteúdos relacionados à "
                 "dúvida do usuário. Explique para ele essa possibilidade.")
+
+
+async def aget_content(user_msg: str, content_format: str) -> Union[str, List[str]]:
+    """
+    Versão assíncrona de get_content. A busca, que utiliza o índice em memória e o modelo de embedding, é executada em
+    uma thread auxiliar apenas enquanto dura, liberando o event loop.
+    :param user_msg: mensagem do usuário, contendo sua dúvida
+    :param content_format: formato do conteúdo que o usuário prefere
+    :return: o conteúdo encontrado, como em get_content
+    """
+    return await asyncio.to_thread(get_content, user_msg, content_format)
+
+
+async def aget_php_exercises(user_msg: str) -> Union[str, List[str]]:
+    """
+    Versão assíncrona de get_php_exercises, com a busca executada em uma thread auxiliar.
+    :param user_msg: mensagem do usuário, contendo sua dúvida
+    :return: os exercícios encontrados, como em get_php_exercises
+    """
+    return await asyncio.to_thread(get_php_exercises, user_msg)
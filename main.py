@@ -1,75 +1,377 @@
-import gradio as gr
-import time
-import json
-from utils import create_message_broker, start_chat
-from llm.educational_agent import EduAgent
+from __future__ import annotations
+
+import asyncio
+import argparse
 import threading
+from typing import TYPE_CHECKING
+from startup import StartupProfile
+
+# O gradio, o LlamaIndex e o cliente da OpenAI são importados apenas em main: o gradio na thread principal, para que a
+# interface entre no ar o quanto antes, e os demais na thread de inicialização, enquanto a interface já está no ar.
+if TYPE_CHECKING:
+    import gradio as gr
+    from chat.sessions import SessionManager
+
+gr = None
+
+# Gerenciador das sessões dos usuários, criado pela thread de inicialização
+session_manager: SessionManager = None
 
+# Sinalizam o fim da inicialização do gerenciador de sessões e o fim do carregamento dos índices e dos agentes, com ou
+# sem sucesso
+_pronto = threading.Event()
+_aquecido = threading.Event()
 
-def talk_to_agent(message: str, history):
+
+def talk_to_agent(message: str, history, request: gr.Request):
     """
     Função que realiza a conversa entre o usuário e o agente.
     :param message: mensagem do usuário
     :param history: histórico de mensagens
+    :param request: requisição do Gradio, utilizada para identificar a sessão do usuário
     :return:
     """
-    # Abrindo o JSON que armazena as mensagens do usuário
-    caminho_user = './message_broker/user_msgs.json'
-    with open(caminho_user, 'r') as arquivo:
-        user_msgs = json.load(arquivo)
+    # Aguardando o fim da inicialização, caso a mensagem tenha chegado antes de o agente estar pronto
+    if not _pronto.is_set():
+        yield "Iniciando o agente de ensino, aguarde um instante..."
+        _pronto.wait()
+
+    if session_manager is None:
+        yield "Não foi possível iniciar o agente de ensino. Tente novamente mais tarde."
+        return
 
-    # Adicionando a mensagem do usuário ao JSON
-    user_msgs["user"].append(message)
-    with open(caminho_user, 'w') as arquivo:
-        json.dump(user_msgs, arquivo, indent=4)
+    sessao = session_manager.get_session(request.session_hash)
+    broker = sessao.broker
 
-    # Abrindo o JSON que armazena as mensagens do assistente
-    caminho_assistant = './message_broker/assistant_msgs.json'
-    with open(caminho_assistant, 'r') as arquivo:
-        assistant_msgs = json.load(arquivo)
+    # Captando a posição da próxima mensagem do assistente antes de enviar a mensagem do usuário, para não perder uma
+    # resposta que chegue imediatamente, e a versão atual do rascunho, para não exibir o rascunho do turno anterior
+    offset_assistant, versao_rascunho = broker.position('assistant')
 
-    # Analisando o número de mensagens do agente, antes do usuário começar a responder
-    old_assistant_msgs = len(assistant_msgs["assistant"])
+    # Enviando a mensagem do usuário ao agente da sessão
+    if not session_manager.submit(request.session_hash, message):
+        yield "No momento, todos os atendentes estão ocupados e a fila de espera está cheia. Tente novamente em instantes."
+        return
 
-    # Loop que verifica se há novas mensagens do agente
+    # Acompanhando a resposta do agente: cada trecho é exibido assim que o LLM o gera e a função é acordada a cada
+    # novo trecho, até que a mensagem completa seja publicada. Enquanto a sessão estiver na fila, o usuário é
+    # informado da sua posição.
     while True:
-        time.sleep(1)  # Espera 1 segundo antes de verificar se há novas mensagens do usuário,
-        # para que dê tempo de abrir o arquivo JSON
+        posicao = session_manager.queue_position(request.session_hash)
+        if posicao is not None:
+            yield f"Aguardando atendimento... você é o {posicao}º da fila."
+            timeout = 2
+        else:
+            timeout = None
+
+        resposta, rascunho, versao_rascunho = broker.wait_for_update('assistant', offset_assistant, versao_rascunho,
+                                                                     timeout=timeout)
+        if resposta is not None:
+            yield resposta.replace('<', '').replace('>', '')
+            return
 
-        # Abrindo o JSON que armazena as mensagens do assistente
-        with open(caminho_assistant, 'r') as arquivo:
-            assistant_msgs2 = json.load(arquivo)
+        if rascunho:
+            yield rascunho.replace('<', '').replace('>', '')
 
-        # Captando o número de mensagens do assistente
-        new_assistant_msgs = len(assistant_msgs2["assistant"])
 
-        # Verificando se há novas mensagens do assistente
-        if new_assistant_msgs > old_assistant_msgs:
-            break
+async def atalk_to_agent(message: str, history, request: gr.Request):
+    """
+    Versão assíncrona de talk_to_agent, utilizada no runtime assíncrono: a resposta do agente é acompanhada sem ocupar
+    uma thread do Gradio.
+    :param message: mensagem do usuário
+    :param history: histórico de mensagens
+    :param request: requisição do Gradio, utilizada para identificar a sessão do usuário
+    :return:
+    """
+    if not _pronto.is_set():
+        yield "Iniciando o agente de ensino, aguarde um instante..."
+        await asyncio.to_thread(_pronto.wait)
 
-    # Se há novas mensagens do assistente, ela é retornada, simulando o retorno em streaming
-    resposta = assistant_msgs2["assistant"][-1].replace('<', '').replace('>', '')
-    for i in range(len(resposta)):
-        time.sleep(0.01)
-        yield resposta[: i + 7]
+    if session_manager is None:
+        yield "Não foi possível iniciar o agente de ensino. Tente novamente mais tarde."
+        return
 
+    sessao = session_manager.get_session(request.session_hash)
+    broker = sessao.broker
+    offset_assistant, versao_rascunho = broker.position('assistant')
 
-if __name__ == '__main__':
-    # Criando o message broker
-    create_message_broker()
+    if not session_manager.submit(request.session_hash, message):
+        yield "No momento, todos os atendentes estão ocupados e a fila de espera está cheia. Tente novamente em instantes."
+        return
+
+    while True:
+        posicao = session_manager.queue_position(request.session_hash)
+        if posicao is not None:
+            yield f"Aguardando atendimento... você é o {posicao}º da fila."
+            timeout = 2
+        else:
+            timeout = None
+
+        resposta, rascunho, versao_rascunho = await broker.await_for_update('assistant', offset_assistant,
+                                                                            versao_rascunho, timeout=timeout)
+        if resposta is not None:
+            yield resposta.replace('<', '').replace('>', '')
+            return
+
+        if rascunho:
+            yield rascunho.replace('<', '').replace('>', '')
+
+
+def _inicializar(args: argparse.Namespace, profile: StartupProfile) -> None:
+    """
+    Inicializa, em segundo plano, o que a conversa com o agente precisa: importa e configura as ferramentas, cria o
+    gerenciador de sessões e, já com a interface atendendo, carrega os índices e cria um agente antecipadamente.
+    :param args: os argumentos da linha de comando
+    :param profile: o perfil de inicialização, onde a duração de cada etapa é registrada
+    :return: None
+    """
+    global session_manager
+
+    try:
+        with profile.stage('importação do LlamaIndex, da OpenAI e das ferramentas'):
+            from chat.sessions import AsyncSessionManager, SessionManager
+            from llm.educational_agent import EduAgent
+            from llm_tools.tools import (MAP_FORMAT_TO_PERSIST_DIR, EXERCICIOS_PERSIST_DIR, configure_content_search,
+                                         configure_prefetch)
+            from data_indexing.indexing_tools import warm_up_indexes, configure_retrieval_mode
+            from data_indexing.embedding_cache import configure_embedding_cache
+            from chat.tracing import configure_tracing
+            from llm.router import configure_fast_path
+            from llm.openai_client import configure_openai_client, create_openai_embedding
+
+        # Configurando o cliente da OpenAI compartilhado pelos agentes, pelo caminho rápido e pelo modelo de embedding:
+        # um único pool de conexões e um único limitador de requisições e tokens por minuto
+        configure_openai_client(args.openai_rpm, args.openai_tpm, base_url=args.openai_base_url)
+
+        # Configurando a busca de conteúdo do agente
+        configure_content_search(args.fused_retrieval, args.preferred_boost)
+        configure_prefetch(args.prefetch)
+        configure_retrieval_mode(args.retrieval_mode)
+        configure_fast_path(args.fast_path, MAP_FORMAT_TO_PERSIST_DIR['texto'])
+
+        # Utilizando o cache de embeddings em disco, para que perguntas repetidas não precisem ser embedadas novamente
+        configure_embedding_cache(args.embedding_cache, create_openai_embedding())
+
+        # Registrando os traces de cada turno (etapas do ReAct, ferramentas, recuperações e chamadas ao LLM)
+        if args.trace_jsonl is not None or args.metrics_port is not None:
+            configure_tracing(args.trace_jsonl, args.metrics_port)
+
+        # Criando o gerenciador de sessões: cada usuário do Gradio conversa com seu próprio agente de ensino, obtido
+        # de um pool limitado de workers. As mensagens de cada sessão são salvas em um log em ./message_broker. No
+        # runtime assíncrono, cada sessão em atendimento é uma corrotina, e não uma thread.
+        gerenciador = AsyncSessionManager if args.runtime == 'async' else SessionManager
+        session_manager = gerenciador(lambda: EduAgent(max_prompt_tokens=args.max_prompt_tokens).create_agent(),
+                                      max_workers=args.max_workers, max_queue=args.max_queue,
+                                      idle_timeout=args.idle_timeout, persist_dir='./message_broker')
+    except Exception as e:
+        print(f'Erro ao iniciar o agente de ensino: {e}')
+        _aquecido.set()
+        return
+    finally:
+        _pronto.set()
+
+    profile.mark('pronto para atender')
 
-    # Instanciando o agente de ensino
-    agent = EduAgent()
-    agent = agent.create_agent()
+    # Carregando os índices e criando os primeiros agentes antes da primeira mensagem do usuário. Uma mensagem que
+    # chegue antes disso é atendida normalmente, aguardando o carregamento do índice que utilizar. O aquecimento é
+    # sempre sinalizado, mesmo após um erro, para que o relatório da inicialização não fique aguardando.
+    try:
+        with profile.stage('carregamento dos índices'):
+            try:
+                warm_up_indexes(list(MAP_FORMAT_TO_PERSIST_DIR.values()) + [EXERCICIOS_PERSIST_DIR])
+            except Exception as e:
+                print(f'Não foi possível pré-carregar os índices: {e}')
 
-    # Função para iniciar o chat em um thread separado
-    def start_chat_thread(agent):
-        start_chat(agent)
+        with profile.stage('criação dos agentes'):
+            try:
+                session_manager.prewarm(args.prewarm_agents)
+            except Exception as e:
+                print(f'Não foi possível criar os agentes antecipadamente: {e}')
 
+        print(f'Índices e agentes prontos em {profile.mark("índices e agentes prontos"):.1f}s.')
+    finally:
+        _aquecido.set()
 
-    # Iniciando o chat entre o usuário e o agente em um novo thread
-    chat_thread = threading.Thread(target=start_chat_thread, args=(agent,))
-    chat_thread.start()
 
-    # Iniciando a interface de chat, através do Gradio
-    gr.ChatInterface(talk_to_agent).launch(share=True)
+def main():
+    global gr
+
+    parser = argparse.ArgumentParser(description="Interface de chat com o agente de ensino")
+    parser.add_argument(
+        "--max-workers",
+        required=False,
+        type=int,
+        default=8,
+        help="Número máximo de conversas atendidas simultaneamente",
+    )
+
+    parser.add_argument(
+        "--max-queue",
+        required=False,
+        type=int,
+        default=32,
+        help="Número máximo de conversas aguardando atendimento. Acima disso, novas conversas são recusadas.",
+    )
+
+    parser.add_argument(
+        "--idle-timeout",
+        required=False,
+        type=float,
+        default=300,
+        help="Tempo, em segundos, sem mensagens do usuário após o qual o atendimento da conversa é liberado",
+    )
+
+    parser.add_argument(
+        "--embedding-cache",
+        required=False,
+        type=str,
+        default="results/embedding_cache.sqlite",
+        help="O caminho do cache de embeddings em disco, compartilhado entre execuções e processos",
+    )
+
+    parser.add_argument(
+        "--fused-retrieval",
+        action="store_true",
+        help="Busca o conteúdo em todos os formatos ao mesmo tempo, combinando os resultados com prioridade para o "
+             "formato preferido do usuário",
+    )
+
+    parser.add_argument(
+        "--fast-path",
+        action="store_true",
+        help="Responde às dúvidas simples sobre o conteúdo com uma única chamada ao LLM, buscando o conteúdo "
+             "diretamente, sem o ciclo ReAct. As demais mensagens continuam sendo respondidas pelo agente.",
+    )
+
+    parser.add_argument(
+        "--prefetch",
+        action="store_true",
+        help="Inicia a busca de conteúdo assim que a mensagem do usuário chega, em paralelo com a primeira chamada do "
+             "agente ao LLM, aproveitando o resultado quando o agente chama get_content",
+    )
+
+    parser.add_argument(
+        "--preferred-boost",
+        required=False,
+        type=float,
+        default=2.0,
+        help="O peso do formato preferido do usuário na combinação dos resultados da busca em todos os formatos",
+    )
+
+    parser.add_argument(
+        "--retrieval-mode",
+        required=False,
+        type=str,
+        choices=("vector", "hybrid"),
+        default="vector",
+        help="O modo de recuperação: 'vector' (busca por embeddings) ou 'hybrid' (busca lexical BM25, que dispensa a "
+             "busca por embeddings em consultas por palavras-chave, combinada com a busca por embeddings)",
+    )
+
+    parser.add_argument(
+        "--runtime",
+        required=False,
+        type=str,
+        choices=("threads", "async"),
+        default="threads",
+        help="O runtime das conversas: 'threads' (cada sessão em atendimento ocupa uma thread) ou 'async' (cada sessão "
+             "é uma corrotina, aguardando o usuário e o LLM sem ocupar threads, o que permite muitas conversas "
+             "simultâneas com um --max-workers maior)",
+    )
+
+    parser.add_argument(
+        "--prewarm-agents",
+        required=False,
+        type=int,
+        default=1,
+        help="Número de agentes criados durante a inicialização, antes da primeira mensagem",
+    )
+
+    parser.add_argument(
+        "--import-profile",
+        action="store_true",
+        help="Mede o tempo de cada etapa da inicialização e de importação de cada pacote, exibindo um relatório ao "
+             "fim da inicialização",
+    )
+
+    parser.add_argument(
+        "--max-prompt-tokens",
+        required=False,
+        type=int,
+        default=6000,
+        help="Número de tokens do prompt acima do qual as etapas antigas da conversa são resumidas ou omitidas, "
+             "mantendo constantes a latência e o custo de cada chamada ao LLM em conversas longas",
+    )
+
+    parser.add_argument(
+        "--trace-jsonl",
+        required=False,
+        type=str,
+        default=None,
+        help="Arquivo JSONL onde o trace de cada turno (etapas do ReAct, ferramentas, recuperações e chamadas ao LLM, "
+             "com a contagem de tokens) é salvo",
+    )
+
+    parser.add_argument(
+        "--metrics-port",
+        required=False,
+        type=int,
+        default=None,
+        help="Porta local onde as métricas agregadas dos traces (p50/p95/p99 por tipo de operação) são servidas, em "
+             "/metrics (formato Prometheus) e /metrics.json",
+    )
+
+    parser.add_argument(
+        "--openai-rpm",
+        required=False,
+        type=float,
+        default=None,
+        help="O número máximo de requisições por minuto à API da OpenAI, compartilhado por todo o processo",
+    )
+
+    parser.add_argument(
+        "--openai-tpm",
+        required=False,
+        type=float,
+        default=None,
+        help="O número máximo de tokens (estimados) por minuto enviados à API da OpenAI, compartilhado por todo o "
+             "processo",
+    )
+
+    parser.add_argument(
+        "--openai-base-url",
+        required=False,
+        type=str,
+        default=None,
+        help="O endereço da API da OpenAI (por exemplo, um servidor local de testes)",
+    )
+
+    args = parser.parse_args()
+    profile = StartupProfile(profile_imports=args.import_profile)
+
+    # Importando e configurando as ferramentas e carregando os índices em segundo plano, enquanto a interface entra
+    # no ar
+    threading.Thread(target=_inicializar, args=(args, profile), name='inicializacao', daemon=True).start()
+
+    with profile.stage('importação do gradio'):
+        import gradio as gr
+
+    # Iniciando a interface de chat, através do Gradio. O limite de concorrência do Gradio é removido, pois a
+    # admissão das conversas é controlada pelo gerenciador de sessões.
+    with profile.stage('criação da interface'):
+        interface = gr.ChatInterface(atalk_to_agent if args.runtime == 'async' else talk_to_agent,
+                                     concurrency_limit=None)
+
+    interface.launch(share=True, prevent_thread_lock=True)
+    print(f'Interface no ar em {profile.mark("interface no ar"):.1f}s.')
+
+    # Exibindo o relatório de inicialização quando a interface e o agente estiverem prontos
+    if args.import_profile:
+        _aquecido.wait()
+        profile.uninstall()
+        print(profile.report())
+
+    interface.block_thread()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+import sys
+import time
+import builtins
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Tuple
+
+
+class StartupProfile:
+    def __init__(self, profile_imports: bool = False):
+        """
+        Classe que mede onde o tempo de inicialização da aplicação é gasto: a duração de cada etapa, em qualquer
+        thread, os marcos atingidos (por exemplo, a interface no ar) e, opcionalmente, o tempo de importação de cada
+        pacote.
+        :param profile_imports: booleano que indica se o tempo de importação de cada pacote deve ser medido. A medição
+        substitui a função de importação do Python até que uninstall seja chamada.
+        """
+        self._inicio = time.perf_counter()
+        self._lock = threading.Lock()
+        self._etapas: List[Tuple[str, str, float, float]] = []  # (nome, thread, início, duração)
+        self._marcos: List[Tuple[str, float]] = []
+        self._importacoes: Dict[str, float] = defaultdict(float)  # tempo próprio de importação de cada pacote
+        self._modulos_iniciais = len(sys.modules)
+        self._pilhas = threading.local()
+        self._import_original = None
+
+        if profile_imports:
+            self._instalar()
+
+    def elapsed(self) -> float:
+        """
+        :return: o tempo, em segundos, desde a criação do perfil
+        """
+        return time.perf_counter() - self._inicio
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """
+        Mede a duração de uma etapa da inicialização.
+        :param name: o nome da etapa
+        :return: None
+        """
+        inicio = self.elapsed()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._etapas.append((name, threading.current_thread().name, inicio, self.elapsed() - inicio))
+
+    def mark(self, name: str) -> float:
+        """
+        Registra um marco da inicialização.
+        :param name: o nome do marco
+        :return: o tempo, em segundos, desde a criação do perfil
+        """
+        instante = self.elapsed()
+        with self._lock:
+            self._marcos.append((name, instante))
+
+        return instante
+
+    def _instalar(self) -> None:
+        """
+        Substitui a função de importação do Python por uma que mede o tempo próprio de cada importação (descontando as
+        importações feitas por ela), atribuído ao pacote de primeiro nível do módulo importado.
+        :return: None
+        """
+        self._import_original = builtins.__import__
+        original = self._import_original
+        pilhas = self._pilhas
+        importacoes = self._importacoes
+
+        def importar(name, globals=None, locals=None, fromlist=(), level=0):
+            # Importações relativas e de módulos já carregados são contabilizadas no módulo que as faz
+            if level or name in sys.modules:
+                return original(name, globals, locals, fromlist, level)
+
+            pilha = getattr(pilhas, 'pilha', None)
+            if pilha is None:
+                pilha = pilhas.pilha = []
+
+            pilha.append(0.0)
+            inicio = time.perf_counter()
+            try:
+                return original(name, globals, locals, fromlist, level)
+            finally:
+                total = time.perf_counter() - inicio
+                filhos = pilha.pop()
+                importacoes[name.split('.')[0]] += total - filhos
+                if pilha:
+                    pilha[-1] += total
+
+        builtins.__import__ = importar
+
+    def uninstall(self) -> None:
+        """
+        Restaura a função de importação original do Python.
+        :return: None
+        """
+        if self._import_original is not None:
+            builtins.__import__ = self._import_original
+            self._import_original = None
+
+    def report(self, top: int = 15) -> str:
+        """
+        Monta o relatório de inicialização.
+        :param top: o número de pacotes exibidos, dos mais lentos para importar
+        :return: o relatório
+        """
+        with self._lock:
+            etapas = sorted(self._etapas, key=lambda etapa: etapa[2])
+            marcos = list(self._marcos)
+            importacoes = sorted(self._importacoes.items(), key=lambda item: item[1], reverse=True)
+
+        linhas = ["Relatório de inicialização (instante de início e duração, em segundos)", "Etapas:"]
+        linhas += [f"  {inicio:7.2f}  {duracao:7.2f}  {nome} [{thread}]" for nome, thread, inicio, duracao in etapas]
+        linhas.append("Marcos:")
+        linhas += [f"  {instante:7.2f}           {nome}" for nome, instante in marcos]
+
+        if importacoes:
+            linhas.append(f"Importações ({len(sys.modules) - self._modulos_iniciais} módulos carregados, "
+                          f"{sum(tempo for _, tempo in importacoes):.2f}s no total), tempo próprio por pacote:")
+            linhas += [f"  {tempo:7.2f}  {pacote}" for pacote, tempo in importacoes[:top]]
+
+        return "\n".join(linhas)
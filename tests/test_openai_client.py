@@ -0,0 +1,94 @@
+import time
+
+import pytest
+
+from benchmarks.openai_stub_server import OpenAIStubServer
+from llm.openai_client import TokenBucket, configure_openai_client, get_client_metrics, get_openai_client
+
+
+@pytest.fixture
+def servidor(monkeypatch):
+    monkeypatch.setenv('OPENAI_API_KEY', 'sk-servidor-local')
+    servidor = OpenAIStubServer(retry_after=0.05, embed_dim=8).start()
+    yield servidor
+    servidor.stop()
+    configure_openai_client()
+
+
+def test_token_bucket_cobra_a_divida_em_ordem_de_chegada():
+    balde = TokenBucket(per_minute=60)
+
+    assert balde.reserve() == 0.0
+    assert balde.reserve() == pytest.approx(1.0, abs=0.05)
+    assert balde.reserve() == pytest.approx(2.0, abs=0.05)
+
+
+def test_token_bucket_cobra_reservas_maiores_que_a_capacidade():
+    balde = TokenBucket(per_minute=60000)
+
+    # A capacidade é de 1000 unidades (um segundo), mas a reserva de 5000 deve aguardar as 4000 restantes
+    assert balde.reserve(5000) == pytest.approx(4.0, abs=0.05)
+    assert balde.reserve(1000) == pytest.approx(5.0, abs=0.05)
+
+
+def test_token_bucket_rejeita_limite_invalido():
+    with pytest.raises(ValueError):
+        TokenBucket(per_minute=0)
+
+
+def test_repete_requisicoes_recusadas_respeitando_retry_after(servidor):
+    configure_openai_client(base_url=servidor.base_url, max_retries=3, backoff_base=5.0)
+    servidor.reject_first = 2
+    antes = get_client_metrics()
+
+    inicio = time.perf_counter()
+    resposta = get_openai_client().embeddings.create(model='text-embedding-ada-002', input='tabela')
+    duracao = time.perf_counter() - inicio
+
+    depois = get_client_metrics()
+    assert len(resposta.data[0].embedding) == 8
+    assert servidor.counters['requests'] == 3
+    assert servidor.counters['rate_limited'] == 2
+    assert depois['retries'] - antes['retries'] == 2
+    assert depois['failures'] == antes['failures']
+    # A espera segue o retry-after-ms do servidor (50 ms), e não a espera exponencial de backoff_base
+    assert 0.1 <= duracao < 2.0
+    # As repetições reutilizam a conexão aberta
+    assert servidor.counters['connections'] == 1
+
+
+def test_desiste_apos_o_numero_maximo_de_repeticoes(servidor):
+    from openai import RateLimitError
+
+    configure_openai_client(base_url=servidor.base_url, max_retries=1)
+    servidor.reject_first = 5
+    antes = get_client_metrics()
+
+    with pytest.raises(RateLimitError):
+        get_openai_client().embeddings.create(model='text-embedding-ada-002', input='tabela')
+
+    depois = get_client_metrics()
+    assert servidor.counters['requests'] == 2
+    assert depois['retries'] - antes['retries'] == 1
+    assert depois['failures'] - antes['failures'] == 1
+
+
+def test_repete_apos_erro_de_conexao(monkeypatch):
+    from openai import APIConnectionError
+
+    monkeypatch.setenv('OPENAI_API_KEY', 'sk-servidor-local')
+    servidor = OpenAIStubServer()
+    endereco = servidor.base_url
+    servidor.server_close()
+
+    configure_openai_client(base_url=endereco, max_retries=2, backoff_base=0.01)
+    antes = get_client_metrics()
+    try:
+        with pytest.raises(APIConnectionError):
+            get_openai_client().embeddings.create(model='text-embedding-ada-002', input='tabela')
+    finally:
+        configure_openai_client()
+
+    depois = get_client_metrics()
+    assert depois['retries'] - antes['retries'] == 2
+    assert depois['failures'] - antes['failures'] == 1
@@ -0,0 +1,46 @@
+import pytest
+
+from chat.broker import MessageBroker, bind_broker, unbind_broker
+from llm_tools import tools
+from llm_tools.tools import configure_prefetch, get_content, get_prefetch_stats, prefetch_content
+
+
+@pytest.fixture
+def buscas(monkeypatch):
+    consultas = []
+    monkeypatch.setattr(tools, 'retrieve_nodes_cached',
+                        lambda persist_dir, query, top_k=3: consultas.append((persist_dir, query)) or ['material'])
+    configure_prefetch(True)
+    token = bind_broker(MessageBroker())
+    yield consultas
+    unbind_broker(token)
+    configure_prefetch(False)
+
+
+def _variacao(antes, depois):
+    return {chave: depois[chave] - antes[chave] for chave in ('iniciadas', 'aproveitadas', 'canceladas', 'perdidas')}
+
+
+def test_aproveita_a_busca_antecipada_da_mesma_query(buscas):
+    antes = get_prefetch_stats()
+
+    prefetch_content('O que é uma tabela?')
+    tools._estado_antecipacao()['buscas'][('results/pdf', 'o que é uma tabela')].result(timeout=5)
+    assert 'material' in get_content('o que é uma tabela', 'texto')
+
+    assert _variacao(antes, get_prefetch_stats()) == {'iniciadas': 1, 'aproveitadas': 1, 'canceladas': 0,
+                                                      'perdidas': 0}
+    # A busca do agente aproveitou a busca antecipada, sem uma nova recuperação
+    assert buscas == [('results/pdf', 'O que é uma tabela?')]
+
+
+def test_conta_as_buscas_com_a_query_reescrita(buscas):
+    antes = get_prefetch_stats()
+
+    prefetch_content('O que é uma tabela?')
+    tools._estado_antecipacao()['buscas'][('results/pdf', 'o que é uma tabela')].result(timeout=5)
+    get_content('tag table HTML', 'texto')
+
+    assert _variacao(antes, get_prefetch_stats()) == {'iniciadas': 1, 'aproveitadas': 0, 'canceladas': 0,
+                                                      'perdidas': 1}
+    assert len(buscas) == 2
@@ -0,0 +1,32 @@
+import pytest
+
+from data_indexing import indexing_tools
+from data_indexing.indexing_tools import configure_retrieval_cache, configure_retrieval_mode, retrieve_nodes_cached
+
+
+@pytest.fixture
+def recuperacoes(monkeypatch):
+    chamadas = []
+    monkeypatch.setattr(indexing_tools, 'get_cached_retriever', lambda persist_dir, top_k: None)
+    monkeypatch.setattr(indexing_tools, 'retrieve_nodes',
+                        lambda retriever, query: chamadas.append('vector') or ['material denso'])
+    monkeypatch.setattr(indexing_tools, 'retrieve_nodes_hybrid',
+                        lambda persist_dir, query, top_k: chamadas.append('hybrid') or ['material híbrido'])
+    configure_retrieval_cache()
+    yield chamadas
+    configure_retrieval_mode()
+    configure_retrieval_cache()
+
+
+def test_cache_separa_os_modos_de_recuperacao(recuperacoes):
+    configure_retrieval_mode('vector')
+    assert retrieve_nodes_cached('results/pdf', 'O que é uma tabela?') == ['material denso']
+    assert retrieve_nodes_cached('results/pdf', 'o que é uma tabela') == ['material denso']
+
+    configure_retrieval_mode('hybrid')
+    assert retrieve_nodes_cached('results/pdf', 'O que é uma tabela?') == ['material híbrido']
+
+    configure_retrieval_mode('vector')
+    assert retrieve_nodes_cached('results/pdf', 'O que é uma tabela?') == ['material denso']
+
+    assert recuperacoes == ['vector', 'hybrid']
@@ -0,0 +1,145 @@
+import time
+import asyncio
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from chat.sessions import AsyncSessionManager, SessionManager
+
+
+class _Monitor:
+    def __init__(self):
+        """
+        Registra os agentes criados e as sessões atendidas ao mesmo tempo pelos agentes de teste.
+        """
+        self.lock = threading.Lock()
+        self.liberar = threading.Event()
+        self.criados = 0
+        self.ativos = 0
+        self.pico = 0
+
+    def entrar(self) -> None:
+        with self.lock:
+            self.ativos += 1
+            self.pico = max(self.pico, self.ativos)
+
+    def sair(self) -> None:
+        with self.lock:
+            self.ativos -= 1
+
+
+class _AgenteDeTeste:
+    def __init__(self, monitor: _Monitor, duracao: float):
+        """
+        Agente que responde após um tempo fixo (ou após monitor.liberar, caso a duração seja None), sem chamar o LLM.
+        """
+        self.monitor = monitor
+        self.duracao = duracao
+        self.memory = SimpleNamespace(put=lambda mensagem: None)
+
+    def stream_chat(self, message: str):
+        self.monitor.entrar()
+        try:
+            if self.duracao is None:
+                self.monitor.liberar.wait(5)
+            else:
+                time.sleep(self.duracao)
+        finally:
+            self.monitor.sair()
+        return SimpleNamespace(response='resposta')
+
+    async def astream_chat(self, message: str):
+        self.monitor.entrar()
+        try:
+            if self.duracao is None:
+                while not self.monitor.liberar.is_set():
+                    await asyncio.sleep(0.01)
+            else:
+                await asyncio.sleep(self.duracao)
+        finally:
+            self.monitor.sair()
+        return SimpleNamespace(response='resposta')
+
+    def reset(self) -> None:
+        pass
+
+
+def _criar_gerenciador(classe, monitor: _Monitor, duracao=0.05, **kwargs) -> SessionManager:
+    def criar_agente():
+        with monitor.lock:
+            monitor.criados += 1
+        return _AgenteDeTeste(monitor, duracao)
+
+    return classe(criar_agente, idle_timeout=0.05, **kwargs)
+
+
+def _aguardar(condicao, timeout: float = 5) -> None:
+    limite = time.monotonic() + timeout
+    while not condicao():
+        assert time.monotonic() < limite, 'condição não atingida a tempo'
+        time.sleep(0.005)
+
+
+@pytest.mark.parametrize('classe', [SessionManager, AsyncSessionManager])
+def test_limita_as_sessoes_atendidas_e_os_agentes_criados(classe):
+    monitor = _Monitor()
+    gerenciador = _criar_gerenciador(classe, monitor, max_workers=2, max_queue=10)
+    try:
+        sessoes = [f'sessao-{i}' for i in range(6)]
+        for session_id in sessoes:
+            assert gerenciador.submit(session_id, 'o que é uma tabela?')
+
+        # As sessões que aguardam uma vaga permanecem na fila
+        estatisticas = gerenciador.stats()
+        assert estatisticas['em_atendimento'] <= 2
+        assert estatisticas['na_fila'] >= 4
+
+        for session_id in sessoes:
+            assert gerenciador.get_session(session_id).broker.receive('assistant', timeout=5) == 'resposta'
+        _aguardar(lambda: gerenciador.stats()['em_atendimento'] == 0)
+    finally:
+        gerenciador.shutdown()
+
+    assert monitor.pico == 2
+    assert monitor.criados == 2
+    assert gerenciador.stats()['recusadas'] == 0
+
+
+@pytest.mark.parametrize('classe', [SessionManager, AsyncSessionManager])
+def test_recusa_sessoes_com_os_workers_ocupados_e_a_fila_cheia(classe):
+    monitor = _Monitor()
+    gerenciador = _criar_gerenciador(classe, monitor, duracao=None, max_workers=1, max_queue=1)
+    try:
+        assert gerenciador.submit('atendida', 'o que é uma tabela?')
+        _aguardar(lambda: monitor.ativos == 1)
+        assert gerenciador.submit('na-fila', 'o que é uma lista?')
+
+        assert not gerenciador.submit('recusada', 'o que é um link?')
+        assert not gerenciador.submit('recusada', 'o que é um link?')
+        estatisticas = gerenciador.stats()
+        assert (estatisticas['em_atendimento'], estatisticas['na_fila'], estatisticas['recusadas']) == (1, 1, 2)
+        assert gerenciador.queue_position('na-fila') == 1
+
+        monitor.liberar.set()
+        assert gerenciador.get_session('na-fila').broker.receive('assistant', timeout=5) == 'resposta'
+        _aguardar(lambda: gerenciador.stats()['em_atendimento'] == 0)
+    finally:
+        monitor.liberar.set()
+        gerenciador.shutdown()
+
+    assert monitor.criados == 1
+
+
+def test_descarta_o_contador_de_turnos_das_sessoes_expiradas():
+    from chat import tracing
+
+    gerenciador = SessionManager(lambda: None, session_ttl=0)
+    gerenciador.get_session('antiga')
+    tracing._turnos_por_sessao['antiga'] += 3
+
+    time.sleep(0.01)
+    gerenciador.get_session('nova')
+
+    assert gerenciador.stats()['sessoes'] == 1
+    assert 'antiga' not in tracing._turnos_por_sessao
@@ -0,0 +1,123 @@
+import os
+import json
+import random
+from typing import List
+
+import pytest
+
+from data_preparation import transcription
+from data_preparation.transcription import (Segmento, TranscriptionBackend, split_windows, stitch_segments,
+                                            transcribe_video)
+
+
+class _TranscricaoFixa(TranscriptionBackend):
+    def __init__(self, segments: List[Segmento]):
+        """
+        Serviço de transcrição de testes, que retorna os trechos de uma transcrição fixa do vídeo inteiro. A janela de
+        cada arquivo de áudio é lida do próprio arquivo, escrito por _extrair_janela. Os segmentos que cruzam a borda da
+        janela são cortados, como uma fala cortada pelo início ou pelo fim do trecho.
+        """
+        self.segments = segments
+
+    def transcribe(self, audio_path: str, language: str = 'pt') -> List[Segmento]:
+        with open(audio_path) as arquivo:
+            janela = json.load(arquivo)
+
+        inicio, fim = janela['start'], janela['start'] + janela['duration']
+        return [(texto, max(a, inicio) - inicio, min(b, fim) - inicio) for texto, a, b in self.segments
+                if b > inicio and a < fim]
+
+
+def _extrair_janela(video_path: str, audio_path: str, start: float, duration: float) -> None:
+    with open(audio_path, 'w') as arquivo:
+        json.dump({'start': start, 'duration': duration}, arquivo)
+
+
+def _transcricao_aleatoria(semente: int, duracao: float) -> List[Segmento]:
+    """
+    Gera uma transcrição com falas de 2 a 15 segundos, separadas por pausas de até um segundo.
+    """
+    gerador = random.Random(semente)
+    segmentos, tempo = [], 0.0
+    while tempo < duracao:
+        fala = gerador.uniform(2, 15)
+        segmentos.append((f'fala {len(segmentos)}', tempo, min(tempo + fala, duracao)))
+        tempo += fala + gerador.uniform(0, 1)
+
+    return segmentos
+
+
+def _transcrever_janelas(janelas, segmentos: List[Segmento], tmp_path) -> List[List[Segmento]]:
+    backend = _TranscricaoFixa(segmentos)
+    transcricoes = []
+    for i, (inicio, duracao) in enumerate(janelas):
+        audio_path = str(tmp_path / f'janela_{i}.json')
+        _extrair_janela('video.mp4', audio_path, inicio, duracao)
+        transcricoes.append(backend.transcribe(audio_path))
+
+    return transcricoes
+
+
+def test_split_windows_video_curto():
+    assert split_windows(100, 600, 30) == [(0.0, 100)]
+    assert split_windows(600, 600, 30) == [(0.0, 600)]
+
+
+def test_split_windows_multiplo_exato_do_passo():
+    # Duas janelas de 600 s, com 30 s de sobreposição, cobrem exatamente 1170 s
+    assert split_windows(1170, 600, 30) == [(0.0, 600), (570.0, 600)]
+    assert split_windows(1740, 600, 30) == [(0.0, 600), (570.0, 600), (1140.0, 600)]
+
+
+def test_split_windows_cobre_o_audio_com_sobreposicao():
+    janelas = split_windows(1500.5, 600, 30)
+
+    assert janelas[-1][0] + janelas[-1][1] == pytest.approx(1500.5)
+    for (inicio, duracao), (proximo, _) in zip(janelas, janelas[1:]):
+        assert inicio + duracao - proximo == pytest.approx(30)
+
+
+@pytest.mark.parametrize('duracao', [0, -10])
+def test_split_windows_rejeita_duracao_invalida(duracao):
+    with pytest.raises(ValueError):
+        split_windows(duracao)
+
+
+def test_split_windows_rejeita_sobreposicao_maior_que_a_janela():
+    with pytest.raises(ValueError):
+        split_windows(1000, 60, 60)
+
+
+def test_stitch_segments_fala_cortada_pela_borda(tmp_path):
+    janelas = split_windows(1170, 600, 30)
+    segmentos = [('antes', 560.0, 568.0), ('na borda', 572.0, 605.0), ('no meio', 580.0, 590.0),
+                 ('cortada', 595.0, 603.0), ('depois', 610.0, 615.0)]
+
+    resultado = stitch_segments(janelas, _transcrever_janelas(janelas, segmentos, tmp_path))
+
+    assert resultado == segmentos
+
+
+@pytest.mark.parametrize('semente', range(50))
+def test_stitch_segments_nao_duplica_nem_perde_falas(semente, tmp_path):
+    segmentos = _transcricao_aleatoria(semente, 1500)
+    janelas = split_windows(1500, 600, 30)
+
+    resultado = stitch_segments(janelas, _transcrever_janelas(janelas, segmentos, tmp_path))
+
+    assert [texto for texto, _, _ in resultado] == [texto for texto, _, _ in segmentos]
+    for (_, inicio, fim), (_, inicio_esperado, fim_esperado) in zip(resultado, segmentos):
+        assert inicio == pytest.approx(inicio_esperado) and fim == pytest.approx(fim_esperado)
+
+
+def test_transcribe_video_com_servico_local(monkeypatch, tmp_path):
+    segmentos = _transcricao_aleatoria(7, 1300)
+    monkeypatch.setattr(transcription, 'audio_duration', lambda video_path: 1300.0)
+    monkeypatch.setattr(transcription, 'extract_audio', _extrair_janela)
+    monkeypatch.setattr(transcription.tempfile, 'tempdir', str(tmp_path))
+
+    resultado = transcribe_video('video.mp4', _TranscricaoFixa(segmentos), window_seconds=300, overlap_seconds=20)
+
+    assert [texto for texto, _, _ in resultado] == [texto for texto, _, _ in segmentos]
+    # Os arquivos temporários das janelas são apagados
+    assert os.listdir(tmp_path) == []
@@ -1,102 +1,110 @@
-import os
-import json
 from llama_index.core.agent import ReActAgent
-import time
+from llama_index.core.chat_engine.types import StreamingAgentChatResponse
+from typing import Optional
+from chat.broker import MessageBroker, get_broker
+from chat.tracing import begin_turn, end_turn
+from llm.prompt_budget import add_system_reminders
+from llm.router import aserve_fast_turns, serve_fast_turns
+from llm_tools.tools import prefetch_content
+from llama_index.core.base.llms.types import ChatMessage, MessageRole
 
 
-def create_message_broker(user_json_path: str = './message_broker/user_msgs.json',
-                          assistant_json_path: str = './message_broker/assistant_msgs.json'):
+def start_chat(agent: ReActAgent, broker: Optional[MessageBroker] = None, idle_timeout: Optional[float] = None):
     """
-    Função que cria os arquivos JSON que armazenarão as mensagens do usuário e do assistente.
-    :param user_json_path: caminho do JSON que armazenará as mensagens do usuário
-    :param assistant_json_path: caminho do JSON que armazenará as mensagens do assistente
+    Função que inicia o chat do agente com o usuário. É nessa função que o agente responde às mensagens do usuário, atuando no modelo ReAct.
+    :param agent: agente de ensino que responderá às mensagens do usuário
+    :param broker: message broker que intermedeia as mensagens (por padrão, o broker em uso)
+    :param idle_timeout: tempo máximo, em segundos, de espera por uma nova mensagem do usuário. Esgotado esse tempo, a
+    função retorna (None para atender indefinidamente)
     :return:
     """
+    broker = broker or get_broker()
+
+    # Loop que aguarda novas mensagens do usuário e responde a elas
+    while True:
+        # Aguardando a próxima mensagem do usuário. A thread fica bloqueada até a mensagem ser publicada.
+        mensagem = broker.receive('user', timeout=idle_timeout)
+
+        # Encerrando o atendimento caso o usuário tenha ficado inativo
+        if mensagem is None:
+            return
+
+        # Iniciando o trace do turno, que vai da mensagem do usuário à próxima mensagem do agente
+        begin_turn(mensagem)
+
+        # Respondendo diretamente às dúvidas simples, que dispensam o ciclo ReAct. As trocas são guardadas na memória
+        # do agente, para que ele conheça toda a conversa.
+        mensagem, respondidas = serve_fast_turns(mensagem, broker, timeout=idle_timeout)
+        for pergunta, resposta in respondidas:
+            agent.memory.put(ChatMessage(role=MessageRole.USER, content=pergunta))
+            agent.memory.put(ChatMessage(role=MessageRole.ASSISTANT, content=resposta))
+
+        if mensagem is None:
+            return
+
+        # Antecipando a busca de conteúdo que o agente provavelmente fará, em paralelo com a sua primeira chamada ao LLM
+        prefetch_content(mensagem)
+
+        # Iniciando o chat do agente com o usuário, a partir da última mensagem do usuário. O chat é feito em modo
+        # streaming, para que as mensagens sejam exibidas ao usuário à medida que o LLM as gera.
+        response = agent.stream_chat(add_system_reminders(mensagem))
+
+        # Aguardando o fim da geração da resposta final, que já é exibida ao usuário enquanto é gerada
+        if isinstance(response, StreamingAgentChatResponse):
+            for _ in response.response_gen:
+                pass
+
+        # Armanezando a última resposta do agente, quando o ciclo ReAct se encerra
+        resposta = response.response
 
-    # Criando diretório para armazenar os JSONs
-    diretorio = './message_broker'
-    if not os.path.exists(diretorio):
-        os.makedirs(diretorio)
-        print(f'Diretório {diretorio} criado com sucesso.')
-    else:
-        print(f'O diretório {diretorio} já existe.')
-
-    # Criando json que armazenará as mensagens do usuário
-    if os.path.exists(user_json_path):
-        print('JSON do user já existente!')
-    else:
-        # Cria uma nova estrutura de dados JSON, caso não exista
-        user_msgs = {"user": []}
-        with open(user_json_path, 'w') as arquivo:
-            json.dump(user_msgs, arquivo, indent=4)
-        print('Caminho do user criado!')
-
-    # Criando json que armazenará as mensagens do assistente
-    if os.path.exists(assistant_json_path):
-        print('Caminho do assistant já existente!')
-    else:
-        # Cria uma nova estrutura de dados JSON, caso não exista
-        assistant_msgs = {"assistant": []}
-        with open(assistant_json_path, 'w') as arquivo:
-            json.dump(assistant_msgs, arquivo, indent=4)
-        print('JSON do assistant criado!')
-
-
-def start_chat(agent: ReActAgent, user_json_path: str = './message_broker/user_msgs.json',
-               assistant_json_path: str = './message_broker/assistant_msgs.json'):
+        # Se a resposta não for vazia, publica a resposta para o usuário
+        if resposta:
+            broker.publish('assistant', resposta)
+        end_turn()
+
+        agent.reset()
+
+
+async def astart_chat(agent: ReActAgent, broker: Optional[MessageBroker] = None, idle_timeout: Optional[float] = None):
     """
-    Função que inicia o chat do agente com o usuário. É nessa função que o agente responde às mensagens do usuário, atuando no modelo ReAct.
+    Versão assíncrona de start_chat, utilizada no runtime assíncrono: o agente é executado através da sua API
+    assíncrona e as mensagens do usuário são aguardadas sem ocupar uma thread, de modo que uma conversa aguardando o
+    usuário custa apenas uma corrotina.
     :param agent: agente de ensino que responderá às mensagens do usuário
-    :param user_json_path: caminho do JSON que armazena as mensagens do usuário
-    :param assistant_json_path: caminho do JSON que armazena as mensagens do assistente
+    :param broker: message broker que intermedeia as mensagens (por padrão, o broker em uso)
+    :param idle_timeout: tempo máximo, em segundos, de espera por uma nova mensagem do usuário. Esgotado esse tempo, a
+    função retorna (None para atender indefinidamente)
     :return:
     """
+    broker = broker or get_broker()
+
+    while True:
+        mensagem = await broker.areceive('user', timeout=idle_timeout)
+        if mensagem is None:
+            return
 
-    # Abrindo o JSON que armazena as mensagens do usuário
-    with open(user_json_path, 'r', encoding='utf-8') as arquivo:
-        user_msgs = json.load(arquivo)
+        begin_turn(mensagem)
 
-    # Analisando o número de mensagens do usuário, antes do agente começar a responder
-    old_user_msgs = len(user_msgs["user"])
+        mensagem, respondidas = await aserve_fast_turns(mensagem, broker, timeout=idle_timeout)
+        for pergunta, resposta in respondidas:
+            agent.memory.put(ChatMessage(role=MessageRole.USER, content=pergunta))
+            agent.memory.put(ChatMessage(role=MessageRole.ASSISTANT, content=resposta))
 
-    # Loop que verifica se há novas mensagens do usuário e responde a elas
-    while True:
-        time.sleep(1)  # Espera 1 segundo antes de verificar se há novas mensagens do usuário,
-        # para que dê tempo de abrir o arquivo JSON
-
-        # Abrindo o JSON que armazena as mensagens do usuário
-        with open(user_json_path, 'r', encoding='utf-8') as arquivo:
-            user_msgs2 = json.load(arquivo)
-
-        # Captando o número de mensagens do usuário
-        new_user_msgs = len(user_msgs2["user"])
-        resposta = ""  # variável que armazenará a resposta final do agente
-
-        # Verificando se há novas mensagens do usuário
-        if new_user_msgs > old_user_msgs:
-            # Iniciando o chat do agente com o usuário, a partir da última mensagem do usuário
-            response = agent.chat(user_msgs2["user"][-1] + ("\n(Aviso 1 do Sistema: caso essa mensagem seja uma "
-                                                            "dúvida, explique em seus"
-                                                            "pensamentos qual o nível do usuário e seu formato de aprendizado preferido.)\n(Aviso "
-                                                            "2 do Sistema: caso essa mensagem seja uma dúvida, utilize a ferramenta de obtenção de "
-                                                            "conteúdo para basear sua resposta.)"))
-
-            # Armanezando a última resposta do agente, quando o ciclo ReAct se encerra
-            resposta = response.response
-
-        # Se a resposta não for vazia, armazena a resposta no JSON do assistente
-        if resposta:
-            # Abrindo o JSON que armazena as mensagens do assistente
-            with open(assistant_json_path, 'r', encoding='utf-8') as arquivo:
-                assistant_msgs = json.load(arquivo)
+        if mensagem is None:
+            return
 
-            # Adicionando a mensagem do assistente ao JSON
-            assistant_msgs["assistant"].append(resposta)
+        prefetch_content(mensagem)
 
-            # Salvando a mensagem do assistente no JSON
-            with open(assistant_json_path, 'w') as arquivo:
-                json.dump(assistant_msgs, arquivo, indent=4)
+        response = await agent.astream_chat(add_system_reminders(mensagem))
+
+        # Aguardando o fim da geração da resposta final, que já é exibida ao usuário enquanto é gerada
+        if isinstance(response, StreamingAgentChatResponse):
+            async for _ in response.async_response_gen():
+                pass
+
+        resposta = response.response
+        if resposta:
+            broker.publish('assistant', resposta)
+        end_turn()
 
-            # Atualizando o número de mensagens do usuário
-            old_user_msgs = new_user_msgs + 1
-            agent.reset()
+        agent.reset()